@@ -1,5 +1,10 @@
 from django.apps import AppConfig
+from django.core import checks
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from core.routers import check_pin_cache
+        checks.register(check_pin_cache)
@@ -0,0 +1,176 @@
+"""
+Archive of cold orders.
+
+Orders older than ARCHIVE['DAYS'] whose status is final (one of
+ARCHIVE['STATUSES']) are moved from the hot order tables, with their
+lines, price detail, cart items, offers and status log, into
+ArchivedOrder and ArchivedOrderLine. Each batch of BATCH_SIZE orders, the
+oldest first, moves in its own transaction: the rows are copied and the
+orders deleted together, so an interrupted run leaves every order in
+exactly one place and the next run carries on from the orders left.
+
+On PostgreSQL the archive tables are partitioned by month of ordered_on
+and the partitions a batch needs are created before it is copied.
+
+Archived orders stay readable through OrderView, which falls back to the
+archive when an order is not in the hot table, and the sales rollups
+rebuild from both.
+"""
+import json
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from core import models
+
+DEFAULTS = {
+    'DAYS': 365,
+    'BATCH_SIZE': 500,
+    'STATUSES': [models.Order.DELIVERED, models.Order.CANCELLED],
+}
+
+
+def archive_settings():
+    """Return the ARCHIVE settings merged over the defaults"""
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'ARCHIVE', {}))
+    return options
+
+
+def month_start(moment):
+    """First instant, in UTC, of the month of a datetime"""
+    moment = moment.astimezone(timezone.utc)
+    return datetime(moment.year, moment.month, 1, tzinfo=timezone.utc)
+
+
+def ensure_partitions(moments):
+    """Create the monthly archive partitions holding the datetimes, PostgreSQL only"""
+    if connection.vendor != 'postgresql':
+        return
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for start in sorted({month_start(moment) for moment in moments}):
+            end = month_start(start + timedelta(days=32))
+            for model in (models.ArchivedOrder, models.ArchivedOrderLine):
+                table = model._meta.db_table
+                cursor.execute(
+                    f'CREATE TABLE IF NOT EXISTS {qn(f"{table}_{start:%Y%m}")} '
+                    f'PARTITION OF {qn(table)} FOR VALUES FROM (%s) TO (%s)', [start, end])
+
+
+def cold_orders(before, statuses):
+    """Orders that may be archived, oldest first"""
+    return models.Order.objects.filter(
+        ordered_on__lt=before, status__in=statuses).order_by('ordered_on', 'id')
+
+
+def related_ids(through, field, order_ids):
+    """Return {order id: [ids]} of a many to many field of orders"""
+    ids = {}
+    for order_id, related in through.objects.filter(order_id__in=order_ids).order_by(
+            'id').values_list('order_id', field):
+        ids.setdefault(order_id, []).append(related)
+    return ids
+
+
+def status_logs(order_ids):
+    """Return {order id: [status changes]} of orders"""
+    logs = {}
+    for entry in models.OrderStatusLog.objects.filter(order_id__in=order_ids).order_by('id').values(
+            'order_id', 'from_status', 'to_status', 'user_id', 'note', 'created_on'):
+        order_id = entry.pop('order_id')
+        entry['user'] = entry.pop('user_id')
+        logs.setdefault(order_id, []).append(entry)
+    return logs
+
+
+def archived_order(order, cart_items, offers, log):
+    """The ArchivedOrder row of an order"""
+    try:
+        detail = order.pricedetail
+    except models.PriceDetail.DoesNotExist:
+        detail = None
+    return models.ArchivedOrder(
+        id=order.id,
+        user_id=order.user_id,
+        ordered_on=order.ordered_on,
+        status=order.status,
+        shipping_address=order.shipping_address,
+        billing_address=order.billing_address,
+        payment_mode_id=order.payment_mode_id,
+        cart_item_ids=json.dumps(cart_items),
+        offer_ids=json.dumps(offers),
+        status_log=json.dumps(log, cls=JSONEncoder),
+        **{
+            name: getattr(detail, name, None)
+            for name in ('subtotal', 'discount', 'payment_charges', 'delievery_charges', 'grand_total')
+        }
+    )
+
+
+def archive_batch(before, batch_size=None, statuses=None):
+    """Move one batch of the cold orders placed before a datetime, return how many moved"""
+    options = archive_settings()
+    batch_size = batch_size or options['BATCH_SIZE']
+    statuses = statuses or options['STATUSES']
+    with transaction.atomic():
+        orders = list(cold_orders(before, statuses).select_related('pricedetail').select_for_update(
+            skip_locked=connection.features.has_select_for_update_skip_locked, of=('self',)
+        )[:batch_size])
+        if not orders:
+            return 0
+        ids = [order.id for order in orders]
+        cart_items = related_ids(models.Order.cartItems.through, 'shoppingcart_id', ids)
+        offers = related_ids(models.Order.offers_applied.through, 'offer_id', ids)
+        logs = status_logs(ids)
+        ordered_on = {order.id: order.ordered_on for order in orders}
+
+        ensure_partitions(ordered_on.values())
+        models.ArchivedOrder.objects.bulk_create(
+            archived_order(order, cart_items.get(order.id, []), offers.get(order.id, []),
+                           logs.get(order.id, []))
+            for order in orders
+        )
+        models.ArchivedOrderLine.objects.bulk_create(
+            models.ArchivedOrderLine(
+                id=line.id,
+                order_id=line.order_id,
+                ordered_on=ordered_on[line.order_id],
+                product_id=line.product_id,
+                category_id=line.category_id,
+                title=line.title,
+                unit=line.unit,
+                unit_price=line.unit_price,
+                count=line.count,
+            )
+            for line in models.OrderLine.objects.filter(order_id__in=ids).order_by('id')
+        )
+        models.Order.objects.filter(id__in=ids).delete()
+    return len(orders)
+
+
+def cutoff(days=None, now=None):
+    """Orders placed before the returned datetime are cold"""
+    days = archive_settings()['DAYS'] if days is None else days
+    return (now or timezone.now()) - timedelta(days=days)
+
+
+def archive(before, batch_size=None, max_batches=None):
+    """
+    Move the cold orders placed before a datetime batch by batch.
+
+    Returns (moved, finished), finished is False when max_batches stopped
+    the run with cold orders left.
+    """
+    batch_size = batch_size or archive_settings()['BATCH_SIZE']
+    total = batches = 0
+    while max_batches is None or batches < max_batches:
+        moved = archive_batch(before, batch_size)
+        total += moved
+        batches += 1
+        if moved < batch_size:
+            return total, True
+    return total, False
@@ -0,0 +1,35 @@
+"""
+Token authentication recording when tokens are used.
+
+Django only updates last_login when a user logs in with a password, a
+client keeping its token never does. TokenAuthentication records the
+last use of every token in TokenUsage, which the `tokens` retention
+policy reads. The row is written at most once per TOKEN_TOUCH_SECONDS of
+the RETENTION settings, a cache key marks the tokens touched recently.
+"""
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework import authentication
+
+from core.db.upsert import upsert
+from core.models import TokenUsage
+from core.retention import retention_settings
+
+
+def touch(token, now=None):
+    """Record that the token was used, unless it was recorded recently"""
+    seconds = retention_settings()['TOKEN_TOUCH_SECONDS']
+    if seconds and not cache.add(f'token-used:{token.key}', True, seconds):
+        return False
+    upsert(TokenUsage, [{'token_id': token.key, 'last_used': now or timezone.now()}],
+           ['token_id'], ['last_used'])
+    return True
+
+
+class TokenAuthentication(authentication.TokenAuthentication):
+    """DRF token authentication touching the last use of the token"""
+
+    def authenticate_credentials(self, key):
+        user, token = super().authenticate_credentials(key)
+        touch(token)
+        return user, token
@@ -0,0 +1,189 @@
+"""
+Benchmark scenarios run by `manage.py benchmark`.
+
+Each scenario runs against a throwaway test database and returns rows of
+(label, timings) where timings come from `measure`.
+"""
+import random
+import statistics
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+
+from django.contrib.auth import get_user_model
+from django.db import close_old_connections, connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core import models
+from core.db.pool import pool_stats
+from offers import engine
+from shopping import cart
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    """Register a benchmark scenario under the name"""
+    def register(fn):
+        SCENARIOS[name] = fn
+        return fn
+    return register
+
+
+def measure(fn, iterations):
+    """Call fn repeatedly and return latency statistics in milliseconds"""
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(1000 * (time.perf_counter() - start))
+    samples.sort()
+    return {
+        'iterations': iterations,
+        'mean_ms': statistics.mean(samples),
+        'p50_ms': samples[len(samples) // 2],
+        'p95_ms': samples[int(len(samples) * 0.95) - 1],
+        'per_sec': 1000 * iterations / sum(samples),
+    }
+
+
+def staff_client(email='benchmark@example.com'):
+    """Return an API client authenticated as a new staff user"""
+    user = get_user_model().objects.create_user(
+        email=email, password='benchmark', is_staff=True)
+    client = APIClient()
+    client.force_authenticate(user)
+    return user, client
+
+
+@scenario('paymentmode')
+def paymentmode(iterations):
+    """GET /api/order/paymentmode/ with and without persistent connections"""
+    user, client = staff_client()
+    for index in range(5):
+        models.PaymentMode.objects.create(
+            user=user, title=f'Mode {index}', desc='desc', charges=index, enabled=True)
+    url = reverse('order:paymentmode-list')
+
+    def request():
+        # The test client disconnects Django's per-request connection
+        # handling, so run it around each request like the real handler.
+        close_old_connections()
+        client.get(url)
+        close_old_connections()
+
+    rows = []
+    original = connection.settings_dict['CONN_MAX_AGE']
+    try:
+        for label, max_age in (('new connection per request', 0),
+                               ('persistent connection', None)):
+            connection.settings_dict['CONN_MAX_AGE'] = max_age
+            connection.close()
+            rows.append((label, measure(request, iterations)))
+    finally:
+        connection.settings_dict['CONN_MAX_AGE'] = original
+        connection.close()
+
+    for alias, stats in pool_stats().items():
+        rows.append((f'pool {alias}', stats))
+    return rows
+
+
+@scenario('checkout')
+def checkout(iterations):
+    """POST /api/order/order/ with five cart lines, priced and stocked in one transaction"""
+    user, client = staff_client('checkout@example.com')
+    category = models.Category.objects.create(user=user, name='Benchmark', desc='desc')
+    items = [
+        models.ShoppingCart.objects.create(
+            user=user,
+            product=models.Product.objects.create(
+                user=user, category=category, title=f'Product {index}', desc='desc',
+                price=10.0 + index, quantity=10 ** 9),
+            count=index + 1,
+        )
+        for index in range(5)
+    ]
+    payment_mode = models.PaymentMode.objects.create(
+        user=user, title='Benchmark mode', desc='desc', charges=5, enabled=True)
+    url = reverse('order:order-list')
+    payload = {
+        'cartItems': [item.id for item in items],
+        'offers_applied': [],
+        'shipping_address': 'Address',
+        'billing_address': 'Address',
+        'payment_mode': payment_mode.id,
+    }
+
+    def request():
+        response = client.post(url, payload, format='json')
+        assert response.status_code == 201, response.data
+
+    with CaptureQueriesContext(connection) as queries:
+        request()
+    rows = [('queries per checkout', {'queries': len(queries)})]
+    rows.append(('checkout', measure(request, iterations)))
+    return rows
+
+
+@scenario('offers')
+def offers(iterations):
+    """Best offer combination for a 100 line cart among 300 active offers"""
+    user, client = staff_client('offers@example.com')
+    generator = random.Random(50)
+    categories = [
+        models.Category.objects.create(user=user, name=f'Category {index}', desc='desc')
+        for index in range(20)
+    ]
+    for index in range(100):
+        product = models.Product.objects.create(
+            user=user, category=categories[index % 20], title=f'Product {index}', desc='desc',
+            price=5.0 + index, quantity=10 ** 9)
+        models.ShoppingCart.objects.create(user=user, product=product, count=1 + index % 3)
+    expiry = timezone.now() + timedelta(days=1)
+    for index in range(300):
+        offer = models.Offer.objects.create(
+            user=user, title=f'Offer {index}', desc='desc', expiry_date=expiry,
+            percentage=generator.choice([5, 10, 15, 20, 25]),
+            min_cart_value=generator.choice([0, 500, 5000, 50000]),
+            per_user_limit=generator.choice([0, 0, 1]),
+            stackable=generator.random() < 0.3)
+        offer.categories.set(generator.sample(categories, generator.randint(0, 3)))
+
+    lines = [
+        SimpleNamespace(count=item.count, unit_price=item.product.price,
+                        category_id=item.product.category_id)
+        for item in models.ShoppingCart.objects.filter(user=user).select_related('product')
+    ]
+    active = list(models.Offer.objects.prefetch_related('categories'))
+    compiled = engine.OfferEngine(active)
+
+    def per_offer_scan():
+        # Each offer checked against every line, the approach the engine replaces.
+        subtotal = sum(line.count * line.unit_price for line in lines)
+        best = 0.0
+        for offer in active:
+            scope = {category.id for category in offer.categories.all()}
+            amount = sum(
+                line.count * line.unit_price for line in lines
+                if not scope or line.category_id in scope)
+            if subtotal >= offer.min_cart_value:
+                best = max(best, offer.percentage * amount / 100)
+        return best
+
+    url = reverse('shopping:shopping-summary')
+
+    def summary():
+        cart.invalidate_summary(user.id)
+        client.get(url)
+
+    return [
+        ('compile 300 offers', measure(lambda: engine.OfferEngine(active), iterations)),
+        ('best deal, compiled', measure(
+            lambda: compiled.best(engine.category_amounts(lines)), iterations)),
+        ('best single offer, per offer line scan', measure(per_offer_scan, iterations)),
+        ('cart summary, uncached', measure(summary, iterations)),
+    ]
@@ -0,0 +1,139 @@
+"""
+Capture the queries an application runs and explain how they use indexes.
+
+Used by `manage.py index_advisor`.
+"""
+import json
+import re
+from collections import defaultdict
+
+from django.db import transaction
+
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE', 'WITH')
+
+SQLITE_PLAN = re.compile(
+    r'^(?P<access>SCAN|SEARCH)(?: TABLE)? (?P<table>\S+)(?: AS \S+)?'
+    r'(?: USING (?:COVERING )?INDEX (?P<index>\S+))?'
+)
+
+
+class QueryCapture:
+    """Execute wrapper remembering each distinct statement and its parameters"""
+
+    def __init__(self):
+        self.queries = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        entry = self.queries.get(sql)
+        if entry is None:
+            self.queries[sql] = {'params': params, 'many': many, 'count': 1}
+        else:
+            entry['count'] += 1
+        return execute(sql, params, many, context)
+
+
+def explain(connection, sql, params):
+    """
+    Return the table accesses of the statement's plan.
+
+    Each access is a (table, index) tuple where index is None for a
+    sequential scan. On PostgreSQL sequential scans are disabled while
+    explaining, so one still showing up means no usable index exists
+    rather than that the planner preferred a scan of a small test table.
+    """
+    if connection.vendor == 'postgresql':
+        return _explain_postgresql(connection, sql, params)
+    if connection.vendor == 'sqlite':
+        return _explain_sqlite(connection, sql, params)
+    return []
+
+
+def _explain_postgresql(connection, sql, params):
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute('SET LOCAL enable_seqscan = off')
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    accesses = []
+
+    def walk(node):
+        node_type = node.get('Node Type', '')
+        if node_type == 'Seq Scan':
+            accesses.append((node['Relation Name'], None))
+        elif 'Index Name' in node:
+            accesses.append((node.get('Relation Name'), node['Index Name']))
+        for child in node.get('Plans', []):
+            walk(child)
+
+    walk(plan[0]['Plan'])
+    return accesses
+
+
+def _explain_sqlite(connection, sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        rows = cursor.fetchall()
+
+    accesses = []
+    for row in rows:
+        match = SQLITE_PLAN.match(row[-1])
+        if match is None:
+            continue
+        index = match.group('index')
+        if index is None and 'INTEGER PRIMARY KEY' in row[-1]:
+            index = 'PRIMARY KEY'
+        accesses.append((match.group('table'), index))
+    return accesses
+
+
+def defined_indexes(connection, tables):
+    """Return {table: set of index names} for the non-primary-key indexes"""
+    indexes = defaultdict(set)
+    with connection.cursor() as cursor:
+        for table in tables:
+            constraints = connection.introspection.get_constraints(cursor, table)
+            for name, info in constraints.items():
+                if info['index'] and not info['primary_key']:
+                    indexes[table].add(name)
+    return indexes
+
+
+def analyze(connection, queries, tables):
+    """
+    Explain the captured queries and summarize index usage per table.
+
+    Sequential scans are only reported for statements with a WHERE clause;
+    scanning a whole table for an unfiltered statement is expected. Returns
+    {'seq_scans': {table: [(sql, count)]}, 'used': {table: set},
+    'unused': {table: set}, 'errors': [(sql, error)]}.
+    """
+    seq_scans = defaultdict(list)
+    used = defaultdict(set)
+    errors = []
+    for sql, entry in queries.items():
+        if not sql.lstrip().upper().startswith(EXPLAINABLE) or entry['many']:
+            continue
+        try:
+            accesses = explain(connection, sql, entry['params'])
+        except Exception as exc:
+            errors.append((sql, str(exc)))
+            continue
+        for table, index in accesses:
+            if table not in tables:
+                continue
+            if index is None:
+                if ' WHERE ' not in sql.upper():
+                    continue
+                seq_scans[table].append((sql, entry['count']))
+            else:
+                used[table].add(index)
+
+    unused = {}
+    for table, names in defined_indexes(connection, tables).items():
+        names = names - used.get(table, set())
+        if names:
+            unused[table] = names
+    return {'seq_scans': dict(seq_scans), 'used': dict(used),
+            'unused': unused, 'errors': errors}
@@ -0,0 +1,71 @@
+"""
+PostgreSQL backend that keeps connections in a per-worker pool.
+
+Select it with POSTGRES_ENGINE=core.db.backends.postgresql. Closing a
+Django connection returns it to the pool, so even with CONN_MAX_AGE=0
+requests stop paying for a new Postgres connection. Pool sizing, lifetime
+and health checks come from the DATABASE_POOL setting.
+"""
+import time
+
+from django.db.backends.postgresql import base
+from psycopg2 import extensions
+
+from core.db.pool import get_pool, pool_settings
+
+# A connection used this recently is not pinged again.
+HEALTH_CHECK_SECONDS = 1.0
+
+
+def reset_connection(conn):
+    """Roll back anything left open before a connection goes back to the pool"""
+    if conn.closed:
+        raise ValueError('Connection is closed')
+    if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+        conn.rollback()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    used_at = None
+
+    def get_new_connection(self, conn_params):
+        pool = get_pool(self.alias, reset=reset_connection)
+        connection = pool.checkout(
+            lambda: super(DatabaseWrapper, self).get_new_connection(conn_params)
+        )
+        # A reused connection was configured by another wrapper.
+        options = self.settings_dict['OPTIONS']
+        self.isolation_level = options.get('isolation_level', connection.isolation_level)
+        return connection
+
+    def create_cursor(self, name=None):
+        self.used_at = time.monotonic()
+        return super().create_cursor(name)
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                get_pool(self.alias).checkin(
+                    self.connection, discard=bool(self.errors_occurred))
+
+    def close_if_unusable_or_obsolete(self):
+        """
+        Also drop persistent connections that fail a health check.
+
+        Django calls this at the start and at the end of each request. A
+        connection that ran a query within HEALTH_CHECK_SECONDS, as it
+        usually has at the end of a request, is known to work and is not
+        pinged.
+        """
+        super().close_if_unusable_or_obsolete()
+        if (self.connection is not None and
+                not self.in_atomic_block and
+                pool_settings()['HEALTH_CHECKS'] and
+                not self.recently_used() and
+                not self.is_usable()):
+            self.close()
+
+    def recently_used(self):
+        """Return whether the connection ran a query within HEALTH_CHECK_SECONDS"""
+        return (self.used_at is not None and
+                time.monotonic() - self.used_at < HEALTH_CHECK_SECONDS)
@@ -0,0 +1,217 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'SIZE': 10,
+    'MAX_LIFETIME': 1800,
+    'HEALTH_CHECKS': True,
+    'TIMEOUT': 10,
+    'LOG_EVERY': 1000,
+}
+
+
+def pool_settings():
+    """Return the DATABASE_POOL settings merged over the defaults"""
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'DATABASE_POOL', {}))
+    return options
+
+
+class PoolTimeout(Exception):
+    """No connection became available within the checkout timeout"""
+
+
+class PoolStats:
+    """Counters describing how a pool serves checkouts"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.reuses = 0
+        self.created = 0
+        self.recycled = 0
+        self.failed_checks = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_checkout(self, wait, reused):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            if reused:
+                self.reuses += 1
+            else:
+                self.created += 1
+            return self.checkouts
+
+    def record_discard(self, failed_check=False):
+        with self._lock:
+            if failed_check:
+                self.failed_checks += 1
+            else:
+                self.recycled += 1
+
+    def snapshot(self):
+        """Return the counters with derived reuse rate and wait times"""
+        with self._lock:
+            checkouts = self.checkouts
+            return {
+                'checkouts': checkouts,
+                'reuses': self.reuses,
+                'created': self.created,
+                'recycled': self.recycled,
+                'failed_checks': self.failed_checks,
+                'reuse_rate': self.reuses / checkouts if checkouts else 0.0,
+                'wait_avg_ms': 1000 * self.wait_total / checkouts if checkouts else 0.0,
+                'wait_max_ms': 1000 * self.wait_max,
+            }
+
+
+def ping(conn):
+    """Run a trivial query to check that the connection still works"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT 1')
+    finally:
+        cursor.close()
+
+
+class ConnectionPool:
+    """
+    Bounded pool of DB-API connections for one worker process.
+
+    At most `size` connections are checked out at a time; further
+    checkouts wait up to `timeout` seconds. Idle connections older than
+    `max_lifetime` are closed instead of reused, and when `health_check`
+    is set every reused connection is pinged first.
+    """
+
+    def __init__(self, size=10, max_lifetime=1800, health_check=True,
+                 timeout=10, reset=None, log_every=1000, name='default'):
+        self.size = size
+        self.max_lifetime = max_lifetime
+        self.health_check = health_check
+        self.timeout = timeout
+        self.reset = reset
+        self.log_every = log_every
+        self.name = name
+        self.stats = PoolStats()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle = []
+        self._born = {}
+
+    def checkout(self, connect):
+        """Return an idle healthy connection, or open one with connect()"""
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(
+                f'No connection available in pool {self.name!r} after {self.timeout}s')
+        try:
+            conn, reused = self._take(), True
+            if conn is None:
+                conn, reused = connect(), False
+                with self._lock:
+                    self._born[id(conn)] = time.monotonic()
+        except Exception:
+            self._slots.release()
+            raise
+
+        count = self.stats.record_checkout(time.monotonic() - start, reused)
+        if self.log_every and count % self.log_every == 0:
+            logger.info('connection pool %s: %s', self.name, self.stats.snapshot())
+        return conn
+
+    def checkin(self, conn, discard=False):
+        """Return a connection to the pool, closing it when unusable"""
+        try:
+            if not discard and self.reset is not None:
+                try:
+                    self.reset(conn)
+                except Exception:
+                    discard = True
+            if discard or self._expired(conn):
+                self._close(conn)
+                self.stats.record_discard()
+            else:
+                with self._lock:
+                    self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    def close_all(self):
+        """Close every idle connection"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._close(conn)
+
+    def _take(self):
+        """Pop the most recently used idle connection that passes the checks"""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                conn = self._idle.pop()
+            if self._expired(conn):
+                self._close(conn)
+                self.stats.record_discard()
+                continue
+            if self.health_check:
+                try:
+                    ping(conn)
+                except Exception:
+                    self._close(conn)
+                    self.stats.record_discard(failed_check=True)
+                    continue
+            return conn
+
+    def _expired(self, conn):
+        born = self._born.get(id(conn))
+        return (
+            self.max_lifetime is not None and
+            born is not None and
+            time.monotonic() - born >= self.max_lifetime
+        )
+
+    def _close(self, conn):
+        with self._lock:
+            self._born.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, reset=None):
+    """Return the pool of the database alias, creating it on first use"""
+    with _pools_lock:
+        pool = _pools.get(alias)
+        if pool is None:
+            options = pool_settings()
+            pool = _pools[alias] = ConnectionPool(
+                size=options['SIZE'],
+                max_lifetime=options['MAX_LIFETIME'],
+                health_check=options['HEALTH_CHECKS'],
+                timeout=options['TIMEOUT'],
+                reset=reset,
+                log_every=options['LOG_EVERY'],
+                name=alias,
+            )
+        return pool
+
+
+def pool_stats():
+    """Return a stats snapshot of every pool in this worker"""
+    with _pools_lock:
+        return {alias: pool.stats.snapshot() for alias, pool in _pools.items()}
@@ -0,0 +1,137 @@
+"""
+INSERT ... ON CONFLICT DO UPDATE for models.
+
+PostgreSQL and SQLite run a single statement for all rows. Other backends
+fall back to a conditional F() update followed by an insert for rows that
+did not exist yet.
+
+Like Model.save(), auto_now fields are set on insert and update and
+auto_now_add fields on insert, unless the rows give them a value.
+"""
+import sqlite3
+
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+
+def supports_upsert(connection):
+    """Return whether the backend understands ON CONFLICT ... RETURNING"""
+    if connection.vendor == 'postgresql':
+        return True
+    return connection.vendor == 'sqlite' and sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+def merge_rows(rows, conflict_fields, update_fields, increment):
+    """Combine rows sharing a conflict key, one statement may not touch a row twice"""
+    merged = {}
+    for row in rows:
+        key = tuple(row[name] for name in conflict_fields)
+        if key in merged and increment:
+            for name in update_fields:
+                merged[key][name] += row[name]
+        else:
+            merged[key] = dict(row)
+    return list(merged.values())
+
+
+def timestamp_rows(model, rows):
+    """Fill the auto_now and auto_now_add fields missing from the rows, return the auto_now names"""
+    now = timezone.now()
+    touched = []
+    for field in model._meta.concrete_fields:
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+            for row in rows:
+                if field.name not in row and field.attname not in row:
+                    row[field.name] = now
+            if field.auto_now:
+                touched.append(field.name)
+    return touched
+
+
+def upsert(model, rows, conflict_fields, update_fields, increment=False,
+           returning=(), using=None):
+    """
+    Insert rows, updating update_fields of rows whose conflict_fields exist.
+
+    Rows are dicts keyed by field name or attname, e.g. 'user_id'. With
+    `increment` the update adds the new values to the stored ones instead
+    of replacing them. Returns a list of dicts holding the `returning`
+    fields (plus the conflict fields) of every inserted or updated row.
+    """
+    if not rows:
+        return []
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    rows = merge_rows(rows, conflict_fields, update_fields, increment)
+    touched = [name for name in timestamp_rows(model, rows) if name not in update_fields]
+    if supports_upsert(connection):
+        return _upsert_sql(connection, model, rows, conflict_fields,
+                           update_fields, increment, returning, touched)
+    return _upsert_orm(model, rows, conflict_fields, update_fields,
+                       increment, returning, using, touched)
+
+
+def _upsert_sql(connection, model, rows, conflict_fields, update_fields,
+                increment, returning, touched=()):
+    meta = model._meta
+    qn = connection.ops.quote_name
+    table = qn(meta.db_table)
+    fields = [meta.get_field(name) for name in rows[0]]
+    columns = ', '.join(qn(field.column) for field in fields)
+    placeholders = '(' + ', '.join(['%s'] * len(fields)) + ')'
+    conflict = ', '.join(qn(meta.get_field(name).column) for name in conflict_fields)
+
+    assignments = []
+    for name in update_fields:
+        column = qn(meta.get_field(name).column)
+        if increment:
+            assignments.append(f'{column} = {table}.{column} + EXCLUDED.{column}')
+        else:
+            assignments.append(f'{column} = EXCLUDED.{column}')
+    for name in touched:
+        column = qn(meta.get_field(name).column)
+        assignments.append(f'{column} = EXCLUDED.{column}')
+
+    returned = list(conflict_fields) + [name for name in returning if name not in conflict_fields]
+    returned_fields = [meta.get_field(name) for name in returned]
+
+    sql = (
+        f'INSERT INTO {table} ({columns}) VALUES '
+        f'{", ".join([placeholders] * len(rows))} '
+        f'ON CONFLICT ({conflict}) DO UPDATE SET {", ".join(assignments)} '
+        f'RETURNING {", ".join(qn(field.column) for field in returned_fields)}'
+    )
+    params = [
+        field.get_db_prep_save(row[name], connection)
+        for row in rows
+        for name, field in zip(rows[0], fields)
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        results = cursor.fetchall()
+    return [dict(zip(returned, result)) for result in results]
+
+
+def _upsert_orm(model, rows, conflict_fields, update_fields, increment,
+                returning, using, touched=()):
+    manager = model._default_manager.db_manager(using)
+    returned = list(conflict_fields) + [name for name in returning if name not in conflict_fields]
+    results = []
+    for row in rows:
+        lookup = {name: row[name] for name in conflict_fields}
+        if increment:
+            changes = {name: F(name) + row[name] for name in update_fields}
+        else:
+            changes = {name: row[name] for name in update_fields}
+        changes.update((name, row[name]) for name in touched)
+        with transaction.atomic(using=using):
+            if not manager.filter(**lookup).update(**changes):
+                try:
+                    with transaction.atomic(using=using):
+                        manager.create(**row)
+                except IntegrityError:
+                    # Inserted concurrently, apply the update instead.
+                    manager.filter(**lookup).update(**changes)
+            results.append(manager.filter(**lookup).values(*returned).get())
+    return results
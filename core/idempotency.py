@@ -0,0 +1,163 @@
+"""
+Idempotency-Key support for create actions.
+
+A client retrying a POST sends the same Idempotency-Key header. The first
+request inserts an IdempotencyKey row for the key and its owner before the
+view runs; the unique constraint on (scope, key) lets exactly one of any
+concurrent duplicates in, the others see the row instead of running the
+view. Once the view answers, its response is stored on the row and
+replayed to every retry until the row expires after TTL_SECONDS. Expired
+rows are deleted by the `idempotency_keys` retention policy.
+
+A row left pending for PENDING_SECONDS, by a worker that died mid-request,
+is claimed again by the next retry with a conditional UPDATE.
+"""
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from core import models
+
+DEFAULTS = {
+    'TTL_SECONDS': 24 * 60 * 60,
+    'PENDING_SECONDS': 60,
+}
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+
+
+def idempotency_settings():
+    """Return the IDEMPOTENCY settings merged over the defaults"""
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'IDEMPOTENCY', {}))
+    return options
+
+
+def request_scope(request):
+    """Owner and path of a request, keys of different owners never collide"""
+    if request.user and request.user.is_authenticated:
+        owner = f'user:{request.user.pk}'
+    else:
+        if not request.session.session_key:
+            request.session.save()
+        owner = f'session:{request.session.session_key}'
+    return f'{owner} {request.path}'[:255]
+
+
+def fingerprint(data):
+    """Hash of the request payload, a key reused with another payload is refused"""
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    payload = json.dumps(data, cls=JSONEncoder, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def claim(scope, key, digest, options):
+    """
+    Insert the pending row of a key and return (row, None).
+
+    If the key was already used, return (row, response) with the response
+    to send instead of running the view: the stored response, or an error
+    when the first request is still running or had another payload.
+    """
+    now = timezone.now()
+    fields = {
+        'fingerprint': digest,
+        'status_code': None,
+        'response': '',
+        'created_on': now,
+        'expires_at': now + timedelta(seconds=options['TTL_SECONDS']),
+    }
+    try:
+        with transaction.atomic():
+            return models.IdempotencyKey.objects.create(scope=scope, key=key, **fields), None
+    except IntegrityError:
+        pass
+
+    row = models.IdempotencyKey.objects.filter(scope=scope, key=key).first()
+    if row is None:
+        return None, in_progress()
+    abandoned = now - timedelta(seconds=options['PENDING_SECONDS'])
+    stale = Q(expires_at__lte=now) | Q(status_code__isnull=True, created_on__lte=abandoned)
+    expired = row.expires_at <= now or (row.status_code is None and row.created_on <= abandoned)
+    if expired and models.IdempotencyKey.objects.filter(stale, pk=row.pk).update(**fields):
+        for name, value in fields.items():
+            setattr(row, name, value)
+        return row, None
+    if row.fingerprint != digest:
+        return row, Response(
+            {'detail': 'Idempotency-Key was already used with another request.'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    if row.status_code is None:
+        return row, in_progress()
+    return row, replay(row)
+
+
+def in_progress():
+    """Response to a duplicate sent while the first request is running"""
+    return Response(
+        {'detail': 'A request with this Idempotency-Key is in progress.'},
+        status=status.HTTP_409_CONFLICT,
+        headers={'Retry-After': '1'}
+    )
+
+
+def replay(row):
+    """Response stored on a row"""
+    data = json.loads(row.response) if row.response else None
+    return Response(data, status=row.status_code, headers={'Idempotent-Replayed': 'true'})
+
+
+def store(row, response):
+    """
+    Store the response on the row of its key.
+
+    Server errors are not stored, the row is deleted so a retry runs the
+    view again.
+    """
+    rows = models.IdempotencyKey.objects.filter(pk=row.pk, status_code__isnull=True)
+    if response.status_code >= 500:
+        rows.delete()
+        return
+    rows.update(
+        status_code=response.status_code,
+        response=json.dumps(response.data, cls=JSONEncoder) if response.data is not None else '',
+    )
+
+
+def idempotent(create):
+    """Run the decorated create action once per Idempotency-Key header"""
+    @functools.wraps(create)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.META.get(HEADER)
+        if not key:
+            return create(view, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'detail': f'Idempotency-Key is longer than {MAX_KEY_LENGTH} characters.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        row, response = claim(
+            request_scope(request), key, fingerprint(request.data), idempotency_settings())
+        if response is not None:
+            return response
+        try:
+            response = create(view, request, *args, **kwargs)
+        except Exception:
+            models.IdempotencyKey.objects.filter(pk=row.pk, status_code__isnull=True).delete()
+            raise
+        store(row, response)
+        return response
+    return wrapper
@@ -0,0 +1,202 @@
+"""
+Stock reservation for checkout.
+
+reserve() takes all the units of a checkout from Product.quantity with one
+conditional UPDATE ... SET quantity = quantity - n WHERE quantity >= n over
+every line, and records them in a Reservation held for HOLD_SECONDS. The
+reservation is either committed to an order or released, which puts the
+units back; `manage.py release_reservations` releases expired holds. Both
+are recorded in the stock ledger of core.stock. release_committed() puts
+back the units of cancelled orders and exchange() those of an order whose
+items change, taking the new ones.
+
+On PostgreSQL the product rows are locked in id order before the update,
+so checkouts sharing products never wait on each other in a cycle.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core import models, stock
+
+DEFAULTS = {
+    'HOLD_SECONDS': 15 * 60,
+    'SWEEP_BATCH': 500,
+}
+
+
+def inventory_settings():
+    """Return the INVENTORY settings merged over the defaults"""
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'INVENTORY', {}))
+    return options
+
+
+class OutOfStock(Exception):
+    """Raised when a product has fewer units than asked for"""
+
+    def __init__(self, products):
+        super().__init__(f'Not enough stock for products {products}')
+        self.products = products
+
+
+class ReservationExpired(Exception):
+    """Raised when committing a reservation that is no longer held"""
+
+
+def cart_lines(cart_items):
+    """Return {product id: count} summed over shopping cart rows"""
+    lines = {}
+    for item in cart_items:
+        lines[item.product_id] = lines.get(item.product_id, 0) + item.count
+    return lines
+
+
+def adjust_stock(lines, sign):
+    """
+    Add sign * count units to every product of lines in one statement.
+
+    Taking stock (sign -1) only touches products with enough units. Returns
+    the number of updated products.
+    """
+    if not lines:
+        return 0
+    product_ids = sorted(lines)
+    qn = connection.ops.quote_name
+    table = qn(models.Product._meta.db_table)
+    quantity = qn('quantity')
+    case = 'CASE ' + qn('id') + ' ' + ' '.join(['WHEN %s THEN %s'] * len(product_ids)) + ' END'
+    case_params = [value for product in product_ids for value in (product, lines[product])]
+    in_list = ', '.join(['%s'] * len(product_ids))
+
+    if connection.vendor == 'postgresql':
+        prefix = (
+            f'WITH locked AS (SELECT {qn("id")} FROM {table} WHERE {qn("id")} IN ({in_list}) '
+            f'ORDER BY {qn("id")} FOR UPDATE) '
+        )
+        rows = f'SELECT {qn("id")} FROM locked'
+    else:
+        prefix, rows = '', in_list
+    sql = (
+        f'{prefix}UPDATE {table} SET {quantity} = {quantity} {"-" if sign < 0 else "+"} {case} '
+        f'WHERE {qn("id")} IN ({rows})'
+    )
+    params = product_ids + case_params if prefix else case_params + product_ids
+    if sign < 0:
+        sql += f' AND {quantity} >= {case}'
+        params += case_params
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def reserve(user, lines, hold_seconds=None):
+    """
+    Take the units of lines from stock and return the held Reservation.
+
+    Raises OutOfStock, leaving the stock untouched, if any product has
+    fewer units than asked for.
+    """
+    if hold_seconds is None:
+        hold_seconds = inventory_settings()['HOLD_SECONDS']
+    with transaction.atomic():
+        taken = adjust_stock(lines, -1) == len(lines)
+        if taken:
+            reservation = models.Reservation.objects.create(
+                user=user, expires_at=timezone.now() + timedelta(seconds=hold_seconds))
+            models.ReservationLine.objects.bulk_create(
+                models.ReservationLine(reservation=reservation, product_id=product, count=count)
+                for product, count in sorted(lines.items())
+            )
+            stock.record_reservation(reservation, models.StockMovement.SALE, lines)
+        else:
+            transaction.set_rollback(True)
+    if not taken:
+        available = dict(models.Product.objects.filter(id__in=lines).values_list('id', 'quantity'))
+        short = sorted(
+            product for product, count in lines.items() if available.get(product, 0) < count)
+        raise OutOfStock(short or sorted(lines))
+    return reservation
+
+
+def commit(reservation, order):
+    """Attach a held reservation to the order, raise ReservationExpired if not held"""
+    updated = models.Reservation.objects.filter(
+        pk=reservation.pk, status=models.Reservation.HELD
+    ).update(status=models.Reservation.COMMITTED, order=order)
+    if not updated:
+        raise ReservationExpired(reservation.pk)
+    reservation.status, reservation.order = models.Reservation.COMMITTED, order
+
+
+def release(reservation):
+    """Put the units of a held reservation back in stock, return whether it was held"""
+    with transaction.atomic():
+        updated = models.Reservation.objects.filter(
+            pk=reservation.pk, status=models.Reservation.HELD
+        ).update(status=models.Reservation.RELEASED)
+        if updated:
+            lines = dict(reservation.lines.values_list('product_id', 'count'))
+            adjust_stock(lines, +1)
+            stock.record_reservation(reservation, models.StockMovement.RELEASE, lines)
+    if updated:
+        reservation.status = models.Reservation.RELEASED
+    return bool(updated)
+
+
+def release_committed(order_ids, detach=False):
+    """
+    Put the units committed to orders back in stock, return how many reservations were released.
+
+    One RELEASE movement is recorded per reservation line. With detach the
+    released reservations no longer point at their orders.
+    """
+    reservations = list(models.Reservation.objects.filter(
+        order_id__in=order_ids, status=models.Reservation.COMMITTED).prefetch_related('lines'))
+    if not reservations:
+        return 0
+    totals, movements = {}, []
+    for reservation in reservations:
+        for line in sorted(reservation.lines.all(), key=lambda line: line.product_id):
+            totals[line.product_id] = totals.get(line.product_id, 0) + line.count
+            movements.append(models.StockMovement(
+                product_id=line.product_id, kind=models.StockMovement.RELEASE, delta=line.count,
+                reservation=reservation, user_id=reservation.user_id))
+    with transaction.atomic():
+        adjust_stock(totals, +1)
+        models.StockMovement.objects.bulk_create(movements)
+        changes = {'status': models.Reservation.RELEASED}
+        if detach:
+            changes['order'] = None
+        models.Reservation.objects.filter(
+            id__in=[reservation.id for reservation in reservations]).update(**changes)
+    return len(reservations)
+
+
+def exchange(order, lines):
+    """
+    Swap the stock committed to an order for lines, when its items change.
+
+    The units of its committed reservation go back to stock and lines are
+    reserved and committed in their place. Raises OutOfStock, to be rolled
+    back by the caller's transaction, if they cannot all be taken.
+    """
+    with transaction.atomic():
+        release_committed([order.id], detach=True)
+        if lines:
+            commit(reserve(order.user, lines), order)
+
+
+def release_expired(now=None, batch_size=None):
+    """Release held reservations past their expiry, return how many were released"""
+    now = now or timezone.now()
+    batch_size = batch_size or inventory_settings()['SWEEP_BATCH']
+    expired = models.Reservation.objects.filter(
+        status=models.Reservation.HELD, expires_at__lte=now).order_by('expires_at')
+    released = 0
+    for reservation in expired[:batch_size]:
+        released += release(reservation)
+    return released
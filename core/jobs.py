@@ -0,0 +1,232 @@
+"""
+Background jobs kept in the database and run by `manage.py worker`.
+
+Apps register task functions with @task in their `tasks` module and queue
+them with enqueue(), in the transaction of the request if there is one, so
+a job exists exactly when the data it works on was committed. Workers claim
+due jobs, highest priority first, with SELECT ... FOR UPDATE SKIP LOCKED on
+PostgreSQL and with a conditional UPDATE per job elsewhere; either way a
+job is claimed by one worker only. A failing job is retried after an
+exponential backoff until it has run max_attempts times, a job left
+running by a dead worker is queued again after LOCK_TIMEOUT_SECONDS, or
+failed when that was its last attempt.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+from rest_framework.utils.encoders import JSONEncoder
+
+from core.models import Job
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'THREADS': 4,
+    'POLL_SECONDS': 1.0,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_SECONDS': 10,
+    'MAX_BACKOFF_SECONDS': 60 * 60,
+    'LOCK_TIMEOUT_SECONDS': 10 * 60,
+}
+
+TASKS = {}
+
+
+def jobs_settings():
+    """Return the JOBS settings merged over the defaults"""
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'JOBS', {}))
+    return options
+
+
+class UnknownTask(Exception):
+    """Raised when a job names a task no app registered"""
+
+
+def task(name):
+    """Register the decorated function as the task of the jobs named name"""
+    def register(function):
+        TASKS[name] = function
+        return function
+    return register
+
+
+def discover():
+    """Import the tasks module of every installed app"""
+    autodiscover_modules('tasks')
+
+
+def enqueue(name, priority=0, run_at=None, delay=None, max_attempts=None, **kwargs):
+    """
+    Queue a job running task name with kwargs and return it.
+
+    The job runs at run_at, or delay seconds from now, or as soon as a
+    worker is free. Jobs of higher priority are claimed first.
+    """
+    if run_at is None:
+        run_at = timezone.now() + timedelta(seconds=delay or 0)
+    return Job.objects.create(
+        name=name,
+        payload=json.dumps(kwargs, cls=JSONEncoder),
+        priority=priority,
+        run_at=run_at,
+        max_attempts=max_attempts or jobs_settings()['MAX_ATTEMPTS'],
+    )
+
+
+def claim(worker, limit=1, now=None):
+    """Mark up to limit due jobs running for the worker and return them"""
+    now = now or timezone.now()
+    due = Job.objects.filter(
+        status=Job.QUEUED, run_at__lte=now).order_by('-priority', 'run_at', 'id')
+    running = {
+        'status': Job.RUNNING,
+        'locked_by': worker,
+        'locked_at': now,
+        'attempts': F('attempts') + 1,
+    }
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            jobs = list(due.select_for_update(skip_locked=True)[:limit])
+            Job.objects.filter(id__in=[job.id for job in jobs]).update(**running)
+    else:
+        jobs = []
+        for job in due[:limit * 4]:
+            if Job.objects.filter(id=job.id, status=Job.QUEUED).update(**running):
+                jobs.append(job)
+            if len(jobs) == limit:
+                break
+    for job in jobs:
+        job.status, job.locked_by, job.locked_at = Job.RUNNING, worker, now
+        job.attempts += 1
+    return jobs
+
+
+def backoff(attempts, options):
+    """Seconds to wait before retrying a job that failed attempts times"""
+    return min(options['BACKOFF_SECONDS'] * 2 ** (attempts - 1), options['MAX_BACKOFF_SECONDS'])
+
+
+def run(job, options=None):
+    """Run a claimed job and record its outcome, return whether it succeeded"""
+    options = options or jobs_settings()
+    mine = Job.objects.filter(id=job.id, status=Job.RUNNING, locked_by=job.locked_by)
+    try:
+        function = TASKS.get(job.name)
+        if function is None:
+            raise UnknownTask(job.name)
+        function(**json.loads(job.payload))
+    except Exception as exc:
+        now = timezone.now()
+        if job.attempts < job.max_attempts and not isinstance(exc, UnknownTask):
+            job.status = Job.QUEUED
+            job.run_at = now + timedelta(seconds=backoff(job.attempts, options))
+        else:
+            job.status, job.finished_on = Job.FAILED, now
+        job.last_error = traceback.format_exc()
+        logger.warning(
+            'Job %s %s failed on attempt %s, now %s', job.id, job.name, job.attempts, job.status,
+            exc_info=True)
+        mine.update(
+            status=job.status, run_at=job.run_at, finished_on=job.finished_on,
+            last_error=job.last_error, locked_by='', locked_at=None)
+        return False
+    job.status, job.finished_on = Job.DONE, timezone.now()
+    mine.update(status=job.status, finished_on=job.finished_on, locked_by='', locked_at=None)
+    return True
+
+
+def requeue_stale(options=None, now=None):
+    """
+    Queue again the jobs left running past the lock timeout, return how many.
+
+    A stale job that already ran max_attempts times fails instead, like a
+    job whose last attempt raised, so a job killing its worker is not
+    retried forever.
+    """
+    options = options or jobs_settings()
+    now = now or timezone.now()
+    stale = Job.objects.filter(
+        status=Job.RUNNING,
+        locked_at__lt=now - timedelta(seconds=options['LOCK_TIMEOUT_SECONDS']),
+    )
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, finished_on=now, locked_by='', locked_at=None,
+        last_error='Worker lost the job on its last attempt')
+    if failed:
+        logger.warning('Failed %s stale jobs out of attempts', failed)
+    return stale.filter(attempts__lt=F('max_attempts')).update(
+        status=Job.QUEUED, locked_by='', locked_at=None)
+
+
+class Worker:
+    """Run due jobs in a pool of threads until stopped"""
+
+    def __init__(self, threads=None, options=None, name=None):
+        self.options = dict(options or jobs_settings())
+        self.threads = threads or self.options['THREADS']
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.stop = threading.Event()
+        self.done = 0
+        self.lock = threading.Lock()
+
+    def work(self, name):
+        """Claim and run one job, return whether there was one"""
+        jobs = claim(name)
+        for job in jobs:
+            run(job, self.options)
+            with self.lock:
+                self.done += 1
+        return bool(jobs)
+
+    def loop(self, once, name):
+        """Run jobs until stopped, or until none is due if once is set"""
+        while not self.stop.is_set():
+            if not self.work(name):
+                if once:
+                    break
+                self.stop.wait(self.options['POLL_SECONDS'])
+
+    def thread(self, once, index):
+        try:
+            self.loop(once, f'{self.name}/{index}')
+        finally:
+            connection.close()
+
+    def run(self, once=False):
+        """Run the pool, return the number of jobs run"""
+        discover()
+        requeue_stale(self.options)
+        if self.threads == 1:
+            self.loop(once, f'{self.name}/0')
+            return self.done
+
+        threads = [
+            threading.Thread(target=self.thread, args=(once, index), daemon=True)
+            for index in range(self.threads)
+        ]
+        for thread in threads:
+            thread.start()
+        checked = time.monotonic()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                self.stop.wait(self.options['POLL_SECONDS'])
+                if time.monotonic() - checked > self.options['LOCK_TIMEOUT_SECONDS'] / 2:
+                    requeue_stale(self.options)
+                    checked = time.monotonic()
+        except KeyboardInterrupt:
+            self.stop.set()
+        for thread in threads:
+            thread.join()
+        return self.done
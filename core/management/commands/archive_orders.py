@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from core import archive, jobs
+
+
+class Command(BaseCommand):
+    """Move cold orders to the archive tables, see core.archive"""
+
+    help = 'Archive orders in a final status older than ARCHIVE["DAYS"], in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Archive orders older than this many days')
+        parser.add_argument('--batch-size', type=int)
+        parser.add_argument('--max-batches', type=int, help='Stop after this many batches')
+        parser.add_argument('--enqueue', action='store_true',
+                            help='Queue an order.archive job for the worker instead')
+
+    def handle(self, *args, **options):
+        before = archive.cutoff(options['days'])
+        if options['enqueue']:
+            jobs.enqueue('order.archive', before=before.isoformat())
+            self.stdout.write(f'Queued archiving of orders before {before:%Y-%m-%d %H:%M}')
+            return
+        moved, finished = archive.archive(before, options['batch_size'], options['max_batches'])
+        state = 'done' if finished else 'stopped, run again to resume'
+        self.stdout.write(f'Archived {moved} orders, {state}')
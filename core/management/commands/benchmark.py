@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import get_runner, setup_test_environment, teardown_test_environment
+
+from core.benchmarks import SCENARIOS
+
+
+class Command(BaseCommand):
+    """Run benchmark scenarios against a throwaway test database"""
+
+    help = 'Run benchmark scenarios against a test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*',
+                            help='Scenarios to run (default: all)')
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--list', action='store_true',
+                            help='List the available scenarios')
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for name, fn in sorted(SCENARIOS.items()):
+                self.stdout.write(f'{name}: {fn.__doc__}')
+            return
+
+        names = options['scenarios'] or sorted(SCENARIOS)
+        unknown = [name for name in names if name not in SCENARIOS]
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {", ".join(unknown)}')
+
+        setup_test_environment()
+        runner = get_runner(settings)(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        try:
+            for name in names:
+                self.stdout.write(self.style.MIGRATE_HEADING(
+                    f'{name}: {SCENARIOS[name].__doc__}'))
+                for label, stats in SCENARIOS[name](options['iterations']):
+                    self.stdout.write(f'  {label}: {self.format(stats)}')
+        finally:
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+
+    @staticmethod
+    def format(stats):
+        return ', '.join(
+            f'{key}={value:.3f}' if isinstance(value, float) else f'{key}={value}'
+            for key, value in stats.items()
+        )
@@ -0,0 +1,85 @@
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import get_runner
+
+from core.benchmarks import SCENARIOS
+from core.db.advisor import QueryCapture, analyze
+
+
+class Command(BaseCommand):
+    """
+    Run the test and benchmark suites, capture their queries, EXPLAIN them
+    and report sequential scans and indexes that were never used.
+    """
+
+    help = 'Report sequential scans and unused indexes of the captured queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('test_labels', nargs='*',
+                            help='Test labels to run (default: all tests)')
+        parser.add_argument('--benchmark', action='append', default=None,
+                            help='Benchmark scenario to run, may be repeated (default: all)')
+        parser.add_argument('--no-benchmarks', action='store_true',
+                            help='Only capture the queries of the test suite')
+        parser.add_argument('--iterations', type=int, default=10,
+                            help='Iterations per benchmark scenario')
+
+    def handle(self, *args, **options):
+        scenarios = [] if options['no_benchmarks'] else (options['benchmark'] or sorted(SCENARIOS))
+        unknown = [name for name in scenarios if name not in SCENARIOS]
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {", ".join(unknown)}')
+
+        runner = get_runner(settings)(verbosity=0, interactive=False)
+        runner.setup_test_environment()
+        suite = runner.build_suite(options['test_labels'])
+        old_config = runner.setup_databases()
+        capture = QueryCapture()
+        try:
+            connection.execute_wrappers.append(capture)
+            try:
+                result = runner.run_suite(suite)
+                for name in scenarios:
+                    SCENARIOS[name](options['iterations'])
+            finally:
+                connection.execute_wrappers.remove(capture)
+
+            if not result.wasSuccessful():
+                self.stderr.write('Some tests failed; the report covers the queries they ran.')
+            tables = {model._meta.db_table for model in apps.get_models()}
+            report = analyze(connection, capture.queries, tables)
+        finally:
+            runner.teardown_databases(old_config)
+            runner.teardown_test_environment()
+
+        self.write_report(len(capture.queries), report)
+
+    def write_report(self, captured, report):
+        self.stdout.write(f'Captured {captured} distinct statements.\n')
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Sequential scans'))
+        if not report['seq_scans']:
+            self.stdout.write('  none')
+        for table, queries in sorted(report['seq_scans'].items()):
+            executions = sum(count for _, count in queries)
+            self.stdout.write(self.style.WARNING(
+                f'  {table}: {len(queries)} statements, {executions} executions'))
+            for sql, count in sorted(queries, key=lambda query: -query[1])[:3]:
+                self.stdout.write(f'    [{count}x] {sql[:200]}')
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Indexes used'))
+        for table, names in sorted(report['used'].items()):
+            self.stdout.write(f'  {table}: {", ".join(sorted(names))}')
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Indexes never used'))
+        if not report['unused']:
+            self.stdout.write('  none')
+        for table, names in sorted(report['unused'].items()):
+            self.stdout.write(f'  {table}: {", ".join(sorted(names))}')
+
+        if report['errors']:
+            self.stdout.write(self.style.MIGRATE_HEADING('Statements that could not be explained'))
+            for sql, error in report['errors']:
+                self.stdout.write(f'  {error}: {sql[:200]}')
@@ -0,0 +1,39 @@
+import pstats
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import profiling
+
+
+class Command(BaseCommand):
+    """List, show and compare the profiles saved by the request profiler"""
+
+    help = 'List, show or compare saved request profiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--show', metavar='ID', help='Print the report of a cProfile profile')
+        parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                            help='Compare cumulative times of two cProfile profiles')
+        parser.add_argument('--limit', type=int, default=20)
+
+    def handle(self, *args, **options):
+        config = profiling.profiler_settings()
+        store = profiling.ProfileStore(config['STORE_DIR'], config['MAX_PROFILES'])
+
+        try:
+            if options['show']:
+                stats = pstats.Stats(f'{store.directory}/{options["show"]}.prof', stream=self.stdout)
+                stats.sort_stats('cumulative').print_stats(options['limit'])
+            elif options['compare']:
+                before, after = (store.load_stats(profile_id) for profile_id in options['compare'])
+                self.stdout.write(f'{"before":>10} {"after":>10} {"delta":>10}  function')
+                for label, old, new, delta in profiling.compare(before, after, options['limit']):
+                    self.stdout.write(f'{old:10.4f} {new:10.4f} {delta:+10.4f}  {label}')
+            else:
+                for meta in store.list():
+                    self.stdout.write(
+                        f'{meta["id"]}  {meta["kind"]:9}  {meta["status"]}  '
+                        f'{meta["duration_ms"]:9.1f}ms  {meta["method"]} {meta["path"]}'
+                    )
+        except FileNotFoundError as exc:
+            raise CommandError(f'Profile not found: {exc.filename}')
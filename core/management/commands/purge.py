@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import retention
+
+
+class Command(BaseCommand):
+    """Delete rows past their retention, see core.retention"""
+
+    help = 'Delete stale session carts, expired sessions and unused tokens in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('policies', nargs='*', metavar='POLICY',
+                            help=f'Policies to run, default all of {", ".join(retention.POLICIES)}')
+        parser.add_argument('--batch-size', type=int)
+        parser.add_argument('--rows-per-second', type=int, help='Throttle, 0 to disable')
+        parser.add_argument('--max-batches', type=int, help='Stop each policy after this many batches')
+        parser.add_argument('--restart', action='store_true', help='Ignore saved checkpoints')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the rows to delete')
+
+    def handle(self, *args, **options):
+        names = options['policies'] or list(retention.POLICIES)
+        unknown = [name for name in names if name not in retention.POLICIES]
+        if unknown:
+            raise CommandError(f'Unknown policy: {", ".join(unknown)}')
+
+        config = retention.retention_settings()
+        if options['batch_size']:
+            config['BATCH_SIZE'] = options['batch_size']
+        if options['rows_per_second'] is not None:
+            config['ROWS_PER_SECOND'] = options['rows_per_second']
+
+        for name in names:
+            purger = retention.Purger(retention.POLICIES[name], config)
+            if options['dry_run']:
+                self.stdout.write(f'{name}: {purger.count()} rows to delete')
+                continue
+            deleted, finished = purger.run(options['restart'], options['max_batches'])
+            state = 'done' if finished else 'stopped, run again to resume'
+            self.stdout.write(f'{name}: deleted {deleted} rows, {state}')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from core import rollups
+
+
+class Command(BaseCommand):
+    """Recompute the daily sales rollups from the orders, see core.rollups"""
+
+    help = 'Rebuild the sales rollups of every day, or of the days from --since'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', metavar='YYYY-MM-DD', help='First day to rebuild')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_date(options['since'])
+            if since is None:
+                raise CommandError(f'Invalid date {options["since"]}')
+        categories, payment_modes = rollups.rebuild(since)
+        self.stdout.write(
+            f'Rebuilt {categories} category rows and {payment_modes} payment mode rows')
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import outbox
+
+
+class Command(BaseCommand):
+    """Deliver outbox events to the configured sinks, see core.outbox"""
+
+    help = 'Deliver pending outbox events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Events read per batch')
+        parser.add_argument('--interval', type=float,
+                            help='Keep running, polling every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        relay = outbox.Relay()
+        while True:
+            delivered = relay.drain(batch_size=options['batch_size'])
+            self.stdout.write(f'Delivered {delivered} events')
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import inventory
+
+
+class Command(BaseCommand):
+    """Put the stock of expired checkout reservations back, see core.inventory"""
+
+    help = 'Release expired stock reservations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Reservations released per pass')
+        parser.add_argument('--interval', type=float,
+                            help='Keep running, sweeping every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            released = inventory.release_expired(batch_size=options['batch_size'])
+            self.stdout.write(f'Released {released} reservations')
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
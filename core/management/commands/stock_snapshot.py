@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from core import stock
+
+
+class Command(BaseCommand):
+    """Fold recent stock movements into snapshots, see core.stock"""
+
+    help = 'Take stock snapshots of the products with new ledger movements'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lag', type=int,
+                            help='Leave movements younger than LAG seconds for the next run')
+
+    def handle(self, *args, **options):
+        taken = stock.take_snapshots(options['lag'])
+        self.stdout.write(f'Took {taken} snapshots')
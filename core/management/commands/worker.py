@@ -0,0 +1,22 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from core import jobs
+
+
+class Command(BaseCommand):
+    """Run the background jobs of core.jobs"""
+
+    help = 'Run queued background jobs in a pool of threads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, help='Jobs run at the same time')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once no job is due instead of waiting for more')
+
+    def handle(self, *args, **options):
+        worker = jobs.Worker(threads=options['threads'])
+        signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop.set())
+        done = worker.run(once=options['once'])
+        self.stdout.write(f'Ran {done} jobs')
@@ -1,3 +1,15 @@
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse, JsonResponse
+
+from core import profiling, routers
+from core.slowlog import SlowQueryLogger, slow_query_settings
+
+
 class CORSMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
@@ -13,4 +25,112 @@ class CORSMiddleware:
         # Code to be executed for each request/response after
         # the view is called.
 
-        return response
\ No newline at end of file
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Expose the request to the replica router and pin writers to the primary
+
+    Views opt in to replica reads with a `replica_reads = True` attribute.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        routers.start_request(request)
+        try:
+            with ExitStack() as stack:
+                if getattr(settings, 'DATABASE_REPLICA_SELECTION', None) == 'least_latency':
+                    for alias in routers.replicas():
+                        stack.enter_context(
+                            connections[alias].execute_wrapper(LatencyRecorder(alias))
+                        )
+                response = self.get_response(request)
+        finally:
+            routers.end_request()
+
+        if request.method not in routers.SAFE_METHODS and response.status_code < 400:
+            routers.pin(request, response)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'cls', None)
+        routers.enable_replica_reads(getattr(view_class, 'replica_reads', False))
+
+
+class LatencyRecorder:
+    """Execute wrapper feeding query durations to the replica selector"""
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.monotonic()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            routers.selector.record_latency(self.alias, time.monotonic() - start)
+
+
+class SlowQueryLogMiddleware:
+    """Log slow queries of each request, see core.slowlog"""
+
+    def __init__(self, get_response):
+        self.options = slow_query_settings()
+        if not self.options['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(
+                    SlowQueryLogger(connection, request, self.options)
+                ))
+            return self.get_response(request)
+
+
+class ProfilerMiddleware:
+    """Profile staff requests that ask for it, see core.profiling"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.options = profiling.profiler_settings()
+        self.store = profiling.ProfileStore(
+            self.options['STORE_DIR'], self.options['MAX_PROFILES'])
+
+    def __call__(self, request):
+        report_format = profiling.requested_format(request)
+        if report_format is None or not profiling.is_staff_request(request):
+            return self.get_response(request)
+
+        if report_format == 'collapsed':
+            profiler = profiling.SamplingProfiler(self.options['SAMPLE_INTERVAL'])
+        else:
+            profiler = profiling.CProfiler()
+        start = time.perf_counter()
+        profiler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.stop()
+        duration_ms = 1000 * (time.perf_counter() - start)
+
+        profile_id = self.store.save(profiler, {
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'duration_ms': duration_ms,
+        })
+        if report_format == 'json':
+            report = JsonResponse(profiler.callgraph())
+        elif report_format == 'collapsed':
+            report = HttpResponse(profiler.collapsed(), content_type='text/plain')
+        else:
+            report = HttpResponse(
+                profiler.text(self.options['TEXT_LIMIT']), content_type='text/plain')
+        report['X-Profile-Id'] = profile_id
+        report['X-Profiled-Status'] = response.status_code
+        return report
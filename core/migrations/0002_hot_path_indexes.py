@@ -0,0 +1,33 @@
+# Generated by Django 2.2 on 2026-10-18 23:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-id'], name='core_order_user_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'id'], name='core_product_cat_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sessionshoppingcart',
+            index=models.Index(fields=['aUser', 'id'], name='core_scart_auser_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shoppingcart',
+            index=models.Index(fields=['user', 'id'], name='core_cart_user_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='useraddress',
+            index=models.Index(fields=['user', '-id'], name='core_address_user_id_idx'),
+        ),
+    ]
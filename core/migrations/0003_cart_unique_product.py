@@ -0,0 +1,47 @@
+# Generated by Django 2.2 on 2026-10-18 23:53
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_cart_rows(apps, schema_editor):
+    """Fold duplicate (owner, product) rows into the oldest one, summing counts"""
+    Order = apps.get_model('core', 'Order')
+    OrderItems = Order.cartItems.through
+
+    for model_name, owner in (('ShoppingCart', 'user'), ('SessionShoppingCart', 'aUser')):
+        model = apps.get_model('core', model_name)
+        duplicates = (
+            model.objects.values(owner, 'product')
+            .annotate(rows=Count('id'), keep=Min('id'), total=Sum('count'))
+            .filter(rows__gt=1)
+        )
+        for group in duplicates:
+            rows = model.objects.filter(**{owner: group[owner], 'product': group['product']})
+            others = rows.exclude(id=group['keep'])
+            if model_name == 'ShoppingCart':
+                # Orders referencing a duplicate now reference the kept row.
+                linked = OrderItems.objects.filter(shoppingcart_id=group['keep']).values('order_id')
+                OrderItems.objects.filter(shoppingcart__in=others, order_id__in=linked).delete()
+                OrderItems.objects.filter(shoppingcart__in=others).update(shoppingcart_id=group['keep'])
+            others.delete()
+            rows.update(count=group['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_cart_rows, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='sessionshoppingcart',
+            constraint=models.UniqueConstraint(fields=('aUser', 'product'), name='core_scart_auser_product_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcart',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='core_cart_user_product_uniq'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2 on 2026-10-19 00:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_cart_unique_product'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PurgeCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('policy', models.CharField(max_length=100, unique=True)),
+                ('last_pk', models.CharField(max_length=255)),
+                ('cutoff', models.DateTimeField()),
+                ('deleted', models.BigIntegerField(default=0)),
+                ('updated_on', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='sessionshoppingcart',
+            name='updated_on',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 2.2 on 2026-10-19 00:05
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def record_opening_stock(apps, schema_editor):
+    """Start the ledger of existing products with their current quantity"""
+    Product = apps.get_model('core', 'Product')
+    StockMovement = apps.get_model('core', 'StockMovement')
+    StockMovement.objects.bulk_create(
+        StockMovement(product_id=product_id, kind='receipt', delta=quantity, note='opening stock')
+        for product_id, quantity in Product.objects.exclude(quantity=0).values_list('id', 'quantity')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_reservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('last_movement_id', models.BigIntegerField()),
+                ('taken_on', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Product')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('receipt', 'receipt'), ('sale', 'sale'), ('return', 'return'), ('release', 'release'), ('adjustment', 'adjustment')], max_length=10)),
+                ('delta', models.IntegerField()),
+                ('note', models.CharField(blank=True, max_length=255)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Product')),
+                ('reservation', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.Reservation')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='stocksnapshot',
+            index=models.Index(fields=['product', '-id'], name='core_stocksnap_product_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['product', 'id'], name='core_stockmv_product_id_idx'),
+        ),
+        migrations.RunPython(record_opening_stock, migrations.RunPython.noop),
+    ]
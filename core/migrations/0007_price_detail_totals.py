@@ -0,0 +1,33 @@
+# Generated by Django 2.2 on 2026-10-19 00:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pricedetail',
+            name='discount',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='pricedetail',
+            name='grand_total',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='pricedetail',
+            name='payment_charges',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='pricedetail',
+            name='subtotal',
+            field=models.FloatField(default=0),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 2.2 on 2026-10-19 00:11
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import F, FloatField, Max, Sum
+import django.db.models.deletion
+
+
+def snapshot_order_lines(apps, schema_editor):
+    """Write lines for existing orders from their cart items as they are now"""
+    Order = apps.get_model('core', 'Order')
+    OrderLine = apps.get_model('core', 'OrderLine')
+    OrderItems = Order.cartItems.through
+    items = OrderItems.objects.select_related('shoppingcart__product').order_by('order_id', 'id')
+    OrderLine.objects.bulk_create(
+        OrderLine(
+            order_id=item.order_id,
+            product_id=item.shoppingcart.product_id,
+            category_id=item.shoppingcart.product.category_id,
+            title=item.shoppingcart.product.title,
+            unit=item.shoppingcart.product.unit,
+            unit_price=item.shoppingcart.product.price,
+            count=item.shoppingcart.count,
+        )
+        for item in items.iterator()
+    )
+
+
+def price_orders(apps, schema_editor):
+    """Price the existing orders from their lines, their totals were added as zeros in 0007"""
+    OrderLine = apps.get_model('core', 'OrderLine')
+    PriceDetail = apps.get_model('core', 'PriceDetail')
+    OrderOffers = apps.get_model('core', 'Order').offers_applied.through
+    amounts = dict(OrderLine.objects.values('order_id').annotate(
+        amount=Sum(F('count') * F('unit_price'), output_field=FloatField())
+    ).order_by().values_list('order_id', 'amount'))
+    # The best offer applied, as checkout priced orders at the time.
+    percentages = dict(OrderOffers.objects.values('order_id').annotate(
+        percentage=Max('offer__percentage')
+    ).order_by().values_list('order_id', 'percentage'))
+    details = list(PriceDetail.objects.select_related('order__payment_mode'))
+    for detail in details:
+        detail.subtotal = round(amounts.get(detail.order_id) or 0.0, 2)
+        detail.discount = round(detail.subtotal * percentages.get(detail.order_id, 0) / 100, 2)
+        detail.payment_charges = float(detail.order.payment_mode.charges) if detail.subtotal else 0.0
+        detail.grand_total = round(
+            detail.subtotal - detail.discount + detail.delievery_charges + detail.payment_charges, 2)
+    PriceDetail.objects.bulk_update(
+        details, ['subtotal', 'discount', 'payment_charges', 'grand_total'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_price_detail_totals'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='shoppingcart',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Product'),
+        ),
+        migrations.CreateModel(
+            name='OrderLine',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category_id', models.IntegerField(null=True)),
+                ('title', models.CharField(max_length=255)),
+                ('unit', models.IntegerField(choices=[(0, 'unit'), (1, 'kg'), (2, 'ltr'), (3, 'g')], default=0)),
+                ('unit_price', models.FloatField()),
+                ('count', models.IntegerField(validators=[django.core.validators.MinValueValidator(1)])),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='core.Order')),
+                ('product', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='core.Product')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='orderline',
+            index=models.Index(fields=['order', 'id'], name='core_orderline_order_id_idx'),
+        ),
+        migrations.RunPython(snapshot_order_lines, migrations.RunPython.noop),
+        migrations.RunPython(price_orders, migrations.RunPython.noop),
+    ]
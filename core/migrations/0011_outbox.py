@@ -0,0 +1,31 @@
+# Generated by Django 2.2 on 2026-10-19 00:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('aggregate_type', models.CharField(max_length=50)),
+                ('aggregate_id', models.CharField(max_length=50)),
+                ('event_type', models.CharField(max_length=100)),
+                ('payload', models.TextField(default='{}')),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('delivered_on', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='outboxevent',
+            index=models.Index(fields=['delivered_on', 'id'], name='core_outbox_pending_idx'),
+        ),
+    ]
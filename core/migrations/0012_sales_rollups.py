@@ -0,0 +1,43 @@
+# Generated by Django 2.2 on 2026-10-19 00:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategorySales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('category_id', models.IntegerField()),
+                ('orders', models.IntegerField(default=0)),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PaymentModeSales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('payment_mode_id', models.IntegerField()),
+                ('orders', models.IntegerField(default=0)),
+                ('discount', models.FloatField(default=0)),
+                ('revenue', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='paymentmodesales',
+            constraint=models.UniqueConstraint(fields=('day', 'payment_mode_id'), name='core_paysales_day_mode_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='categorysales',
+            constraint=models.UniqueConstraint(fields=('day', 'category_id'), name='core_catsales_day_cat_uniq'),
+        ),
+    ]
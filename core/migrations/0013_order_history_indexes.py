@@ -0,0 +1,29 @@
+# Generated by Django 2.2 on 2026-10-19 00:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='order',
+            name='core_order_user_id_idx',
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-ordered_on', '-id'], name='core_order_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-ordered_on', '-id'], name='core_order_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['payment_mode', '-ordered_on', '-id'], name='core_order_pmode_date_idx'),
+        ),
+    ]
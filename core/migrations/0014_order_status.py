@@ -0,0 +1,70 @@
+# Generated by Django 2.2 on 2026-10-19 00:28
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_orders(apps, schema_editor):
+    """Count the existing orders, all of them placed, in shard 0"""
+    Order = apps.get_model('core', 'Order')
+    OrderStatusCount = apps.get_model('core', 'OrderStatusCount')
+    placed = Order.objects.count()
+    if placed:
+        OrderStatusCount.objects.create(status='placed', shard=0, count=placed)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_order_history_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderStatusCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('placed', 'placed'), ('packed', 'packed'), ('shipped', 'shipped'), ('delivered', 'delivered'), ('cancelled', 'cancelled')], max_length=10)),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OrderStatusLog',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_status', models.CharField(blank=True, max_length=10)),
+                ('to_status', models.CharField(choices=[('placed', 'placed'), ('packed', 'packed'), ('shipped', 'shipped'), ('delivered', 'delivered'), ('cancelled', 'cancelled')], max_length=10)),
+                ('note', models.CharField(blank=True, max_length=255)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('placed', 'placed'), ('packed', 'packed'), ('shipped', 'shipped'), ('delivered', 'delivered'), ('cancelled', 'cancelled')], default='placed', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', '-ordered_on', '-id'], name='core_order_status_date_idx'),
+        ),
+        migrations.AddField(
+            model_name='orderstatuslog',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_log', to='core.Order'),
+        ),
+        migrations.AddField(
+            model_name='orderstatuslog',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='orderstatuscount',
+            constraint=models.UniqueConstraint(fields=('status', 'shard'), name='core_orderstatus_shard_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='orderstatuslog',
+            index=models.Index(fields=['order', 'id'], name='core_orderlog_order_id_idx'),
+        ),
+        migrations.RunPython(count_orders, migrations.RunPython.noop),
+    ]
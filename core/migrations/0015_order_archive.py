@@ -0,0 +1,100 @@
+# Generated by Django 2.2 on 2026-10-19 00:32
+
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def partition_archive(apps, schema_editor):
+    """
+    Recreate the empty archive tables partitioned by range of ordered_on on PostgreSQL.
+
+    The primary key of a partitioned table has to hold the partition key,
+    so it becomes (id, ordered_on). Monthly partitions are created by
+    core.archive before orders are moved into them.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    qn = connection.ops.quote_name
+    ArchivedOrder = apps.get_model('core', 'ArchivedOrder')
+    for model in (ArchivedOrder, apps.get_model('core', 'ArchivedOrderLine')):
+        table = model._meta.db_table
+        schema_editor.execute(
+            f'CREATE TABLE {qn(table + "_new")} (LIKE {qn(table)} INCLUDING DEFAULTS) '
+            f'PARTITION BY RANGE ({qn("ordered_on")})')
+        schema_editor.execute(f'DROP TABLE {qn(table)}')
+        schema_editor.execute(f'ALTER TABLE {qn(table + "_new")} RENAME TO {qn(table)}')
+        schema_editor.execute(f'ALTER TABLE {qn(table)} ADD PRIMARY KEY ({qn("id")}, {qn("ordered_on")})')
+        for index in model._meta.indexes:
+            schema_editor.add_index(model, index)
+    for field in ('user', 'payment_mode'):
+        field = ArchivedOrder._meta.get_field(field)
+        schema_editor.execute(
+            f'ALTER TABLE {qn(ArchivedOrder._meta.db_table)} '
+            f'ADD CONSTRAINT {qn(f"core_arcorder_{field.column}_fk")} FOREIGN KEY ({qn(field.column)}) '
+            f'REFERENCES {qn(field.related_model._meta.db_table)} ({qn("id")}) '
+            f'DEFERRABLE INITIALLY DEFERRED')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_order_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('ordered_on', models.DateTimeField()),
+                ('status', models.CharField(choices=[('placed', 'placed'), ('packed', 'packed'), ('shipped', 'shipped'), ('delivered', 'delivered'), ('cancelled', 'cancelled')], max_length=10)),
+                ('shipping_address', models.CharField(max_length=255)),
+                ('billing_address', models.CharField(max_length=255)),
+                ('cart_item_ids', models.TextField(default='[]')),
+                ('offer_ids', models.TextField(default='[]')),
+                ('status_log', models.TextField(default='[]')),
+                ('subtotal', models.FloatField(null=True)),
+                ('discount', models.FloatField(null=True)),
+                ('payment_charges', models.FloatField(null=True)),
+                ('delievery_charges', models.FloatField(null=True)),
+                ('grand_total', models.FloatField(null=True)),
+                ('archived_on', models.DateTimeField(auto_now_add=True)),
+                ('payment_mode', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='core.PaymentMode')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderLine',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('ordered_on', models.DateTimeField()),
+                ('product_id', models.IntegerField(null=True)),
+                ('category_id', models.IntegerField(null=True)),
+                ('title', models.CharField(max_length=255)),
+                ('unit', models.IntegerField(choices=[(0, 'unit'), (1, 'kg'), (2, 'ltr'), (3, 'g')], default=0)),
+                ('unit_price', models.FloatField()),
+                ('count', models.IntegerField(validators=[django.core.validators.MinValueValidator(1)])),
+                ('order', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='core.ArchivedOrder')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedorderline',
+            index=models.Index(fields=['order', 'id'], name='core_arcline_order_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['user', '-ordered_on', '-id'], name='core_arcorder_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['-ordered_on', '-id'], name='core_arcorder_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['payment_mode', '-ordered_on', '-id'], name='core_arcorder_pmode_date_idx'),
+        ),
+        migrations.RunPython(partition_archive, migrations.RunPython.noop),
+    ]
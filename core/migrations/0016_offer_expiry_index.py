@@ -0,0 +1,17 @@
+# Generated by Django 2.2 on 2026-10-19 00:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_order_archive'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(fields=['expiry_date'], name='core_offer_expiry_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2 on 2026-10-19 00:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_offer_expiry_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='offer',
+            name='categories',
+            field=models.ManyToManyField(blank=True, related_name='offers', to='core.Category'),
+        ),
+        migrations.AddField(
+            model_name='offer',
+            name='min_cart_value',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='offer',
+            name='per_user_limit',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='offer',
+            name='stackable',
+            field=models.BooleanField(default=False),
+        ),
+    ]
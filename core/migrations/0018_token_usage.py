@@ -0,0 +1,32 @@
+# Generated by Django 2.2 on 2026-10-19 00:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def record_usage(apps, schema_editor):
+    """Take the last login of the user, or the creation, as the last use of existing tokens"""
+    Token = apps.get_model('authtoken', 'Token')
+    TokenUsage = apps.get_model('core', 'TokenUsage')
+    TokenUsage.objects.bulk_create(
+        TokenUsage(token_id=key, last_used=max(filter(None, (created, last_login))))
+        for key, created, last_login in Token.objects.values_list('key', 'created', 'user__last_login')
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authtoken', '0002_auto_20160226_1747'),
+        ('core', '0017_offer_rules'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TokenUsage',
+            fields=[
+                ('token', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='usage', serialize=False, to='authtoken.Token')),
+                ('last_used', models.DateTimeField()),
+            ],
+        ),
+        migrations.RunPython(record_usage, migrations.RunPython.noop),
+    ]
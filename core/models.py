@@ -8,8 +8,11 @@ import re
 
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 from django.db.models.fields.related import ManyToManyField
 
+from core.db.upsert import upsert
+
 
 def uploaded_images_for_products(instance, filepath):
     """Generate new path for upoaded images to products"""
@@ -57,6 +60,32 @@ class UserManager(BaseUserManager):
         return user
 
 
+class CartManager(models.Manager):
+    """Manager for cart rows holding one row per OWNER_FIELD and product"""
+
+    def add_item(self, owner, product, count):
+        """
+        Add count units of the product to the owner's cart and return the row.
+
+        Runs a single INSERT ... ON CONFLICT DO UPDATE count = count + n, so
+        repeated or concurrent adds of a product never duplicate rows or
+        lose updates.
+        """
+        owner_attname = self.model._meta.get_field(self.model.OWNER_FIELD).attname
+        owner_value = getattr(owner, 'pk', owner)
+        product_id = getattr(product, 'pk', product)
+        row = upsert(
+            self.model,
+            [{owner_attname: owner_value, 'product_id': product_id, 'count': count}],
+            conflict_fields=(owner_attname, 'product_id'),
+            update_fields=('count',),
+            increment=True,
+            returning=('id', 'count'),
+            using=self.db,
+        )[0]
+        return self.model(**row)
+
+
 class User(AbstractBaseUser, PermissionsMixin):
     """Model for user object"""
 
@@ -100,6 +129,11 @@ class UserAddress(models.Model):
     addressType = models.IntegerField(
         default=HOME, choices=ADDRESS_TYPE_CHOICES)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-id'], name='core_address_user_id_idx'),
+        ]
+
     def __str__(self):
         return f'name: {self.name}, district: {self.district}, state: {self.state}, pincode: {self.pincode}'
 
@@ -158,11 +192,83 @@ class Product(models.Model):
     image = models.ImageField(
         blank=True, upload_to=uploaded_images_for_products)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['category', 'id'], name='core_product_cat_id_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        """Record the stock of a new product as its opening ledger movement"""
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if adding and self.quantity:
+            StockMovement.objects.using(self._state.db).create(
+                product=self, kind=StockMovement.RECEIPT, delta=self.quantity, note='opening stock')
+
     def __str__(self):
         """String representation of Product object"""
         return self.title
 
 
+class StockMovement(models.Model):
+    """Append-only ledger entry of a change to the stock of a product"""
+
+    RECEIPT = 'receipt'
+    SALE = 'sale'
+    RETURN = 'return'
+    RELEASE = 'release'
+    ADJUSTMENT = 'adjustment'
+
+    KIND_CHOICES = (
+        (RECEIPT, 'receipt'),
+        (SALE, 'sale'),
+        (RETURN, 'return'),
+        (RELEASE, 'release'),
+        (ADJUSTMENT, 'adjustment'),
+    )
+
+    # Kept as a plain id, the ledger outlives the products it records.
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    delta = models.IntegerField()
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL
+    )
+    reservation = models.ForeignKey(
+        'Reservation', null=True, blank=True, on_delete=models.SET_NULL)
+    note = models.CharField(max_length=255, blank=True)
+    created_on = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'id'], name='core_stockmv_product_id_idx'),
+        ]
+
+    def __str__(self):
+        """String representation of Stock movement"""
+        return f'{self.product_id} {self.kind} {self.delta:+d}'
+
+
+class StockSnapshot(models.Model):
+    """Stock of a product folded from the ledger up to last_movement_id"""
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False)
+    quantity = models.IntegerField()
+    last_movement_id = models.BigIntegerField()
+    taken_on = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', '-id'], name='core_stocksnap_product_idx'),
+        ]
+
+    def __str__(self):
+        """String representation of Stock snapshot"""
+        return f'{self.product_id} {self.quantity}'
+
+
 class UserDetails(models.Model):
     """User details object"""
 
@@ -182,6 +288,19 @@ class SessionShoppingCart(models.Model):
     aUser = models.CharField(max_length=255)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     count = models.IntegerField(blank=False, validators=[MinValueValidator(1)])
+    updated_on = models.DateTimeField(auto_now=True)
+
+    OWNER_FIELD = 'aUser'
+
+    objects = CartManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['aUser', 'id'], name='core_scart_auser_id_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['aUser', 'product'], name='core_scart_auser_product_uniq'),
+        ]
 
     def __str__(self):
         """String representation of Session Shopping Cart"""
@@ -195,9 +314,21 @@ class ShoppingCart(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE
     )
-    product = models.ForeignKey(Product, on_delete=models.PROTECT)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
     count = models.IntegerField(blank=False, validators=[MinValueValidator(1)])
 
+    OWNER_FIELD = 'user'
+
+    objects = CartManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id'], name='core_cart_user_id_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='core_cart_user_product_uniq'),
+        ]
+
     def __str__(self):
         """String representation of Shopping Cart"""
         return f'{str(self.product)}, {self.count}'
@@ -231,6 +362,17 @@ class Offer(models.Model):
     desc = models.CharField(max_length=255)
     created_on = models.DateTimeField(auto_now_add=True)
     expiry_date = models.DateTimeField()
+    # Eligibility rules, see offers.engine.
+    min_cart_value = models.FloatField(default=0)
+    categories = models.ManyToManyField(Category, blank=True, related_name='offers')
+    per_user_limit = models.PositiveIntegerField(default=0)
+    stackable = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # Active offers, see offers.active.
+            models.Index(fields=['expiry_date'], name='core_offer_expiry_idx'),
+        ]
 
     def __str__(self):
         """String representation of Offer object"""
@@ -240,6 +382,27 @@ class Offer(models.Model):
 class Order(models.Model):
     """Model for Order object"""
 
+    PLACED = 'placed'
+    PACKED = 'packed'
+    SHIPPED = 'shipped'
+    DELIVERED = 'delivered'
+    CANCELLED = 'cancelled'
+
+    STATUS_CHOICES = (
+        (PLACED, 'placed'),
+        (PACKED, 'packed'),
+        (SHIPPED, 'shipped'),
+        (DELIVERED, 'delivered'),
+        (CANCELLED, 'cancelled'),
+    )
+
+    # Statuses an order may move to from each status, see order.status.
+    TRANSITIONS = {
+        PLACED: (PACKED, CANCELLED),
+        PACKED: (SHIPPED, CANCELLED),
+        SHIPPED: (DELIVERED,),
+    }
+
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE
@@ -250,6 +413,122 @@ class Order(models.Model):
     shipping_address = models.CharField(max_length=255)
     billing_address = models.CharField(max_length=255)
     payment_mode = models.ForeignKey(PaymentMode, on_delete=models.PROTECT)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PLACED)
+
+    class Meta:
+        indexes = [
+            # Keyset pages of OrderView, see core.pagination.
+            models.Index(fields=['user', '-ordered_on', '-id'], name='core_order_user_date_idx'),
+            models.Index(fields=['-ordered_on', '-id'], name='core_order_date_idx'),
+            models.Index(fields=['payment_mode', '-ordered_on', '-id'], name='core_order_pmode_date_idx'),
+            models.Index(fields=['status', '-ordered_on', '-id'], name='core_order_status_date_idx'),
+        ]
+
+
+class OrderStatusLog(models.Model):
+    """Status change of an order"""
+    order = models.ForeignKey(Order, related_name='status_log', on_delete=models.CASCADE)
+    from_status = models.CharField(max_length=10, blank=True)
+    to_status = models.CharField(max_length=10, choices=Order.STATUS_CHOICES)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    note = models.CharField(max_length=255, blank=True)
+    created_on = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['order', 'id'], name='core_orderlog_order_id_idx'),
+        ]
+
+    def __str__(self):
+        """String representation of Order status log"""
+        return f'{self.order_id} {self.from_status} > {self.to_status}'
+
+
+class OrderStatusCount(models.Model):
+    """
+    Number of orders in a status, split over shards.
+
+    Status changes add to a random shard so concurrent checkouts rarely
+    wait on the same row; the count of a status is the sum of its shards.
+    """
+    status = models.CharField(max_length=10, choices=Order.STATUS_CHOICES)
+    shard = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['status', 'shard'], name='core_orderstatus_shard_uniq'),
+        ]
+
+    def __str__(self):
+        """String representation of Order status count"""
+        return f'{self.status}/{self.shard} {self.count}'
+
+
+class OrderLine(models.Model):
+    """Product, price and count of an order line as they were at checkout"""
+    order = models.ForeignKey(Order, related_name='lines', on_delete=models.CASCADE)
+    # Kept as plain ids, an order outlives the products and categories it lists.
+    product = models.ForeignKey(
+        Product, null=True, related_name='+', on_delete=models.DO_NOTHING, db_constraint=False)
+    category_id = models.IntegerField(null=True)
+    title = models.CharField(max_length=255)
+    unit = models.IntegerField(choices=Product.UNIT_CHOICES, default=Product.UNIT)
+    unit_price = models.FloatField()
+    count = models.IntegerField(validators=[MinValueValidator(1)])
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['order', 'id'], name='core_orderline_order_id_idx'),
+        ]
+
+    def __str__(self):
+        """String representation of Order line"""
+        return f'{self.title}, {self.count}'
+
+
+class Reservation(models.Model):
+    """Stock held for a checkout until it is committed or expires"""
+
+    HELD = 'held'
+    COMMITTED = 'committed'
+    RELEASED = 'released'
+
+    STATUS_CHOICES = (
+        (HELD, 'held'),
+        (COMMITTED, 'committed'),
+        (RELEASED, 'released'),
+    )
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    order = models.OneToOneField(Order, null=True, blank=True, on_delete=models.SET_NULL)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=HELD)
+    created_on = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at'], name='core_resv_status_exp_idx'),
+        ]
+
+    def __str__(self):
+        """String representation of Reservation"""
+        return f'{self.id} {self.status}'
+
+
+class ReservationLine(models.Model):
+    """Units of a product held by a reservation"""
+    reservation = models.ForeignKey(Reservation, related_name='lines', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    count = models.IntegerField(validators=[MinValueValidator(1)])
+
+    def __str__(self):
+        """String representation of Reservation line"""
+        return f'{str(self.product)}, {self.count}'
 
 
 class PriceDetail(models.Model):
@@ -262,4 +541,218 @@ class PriceDetail(models.Model):
         Order,
         on_delete=models.CASCADE
     )
+    subtotal = models.FloatField(default=0)
+    discount = models.FloatField(default=0)
+    payment_charges = models.FloatField(default=0)
     delievery_charges = models.FloatField()
+    grand_total = models.FloatField(default=0)
+
+
+class PurgeCheckpoint(models.Model):
+    """Progress of an interrupted run of a retention policy"""
+    policy = models.CharField(max_length=100, unique=True)
+    last_pk = models.CharField(max_length=255)
+    cutoff = models.DateTimeField()
+    deleted = models.BigIntegerField(default=0)
+    updated_on = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        """String representation of Purge checkpoint"""
+        return f'{self.policy} > {self.last_pk}'
+
+
+class TokenUsage(models.Model):
+    """Last time an auth token authenticated a request"""
+    token = models.OneToOneField(
+        'authtoken.Token',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='usage'
+    )
+    last_used = models.DateTimeField()
+
+    def __str__(self):
+        """String representation of Token usage"""
+        return f'{self.token_id} {self.last_used}'
+
+
+class IdempotencyKey(models.Model):
+    """First response of a create request, replayed to retries with its key"""
+    scope = models.CharField(max_length=255)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.TextField(blank=True)
+    created_on = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='core_idem_scope_key_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='core_idem_expires_idx'),
+        ]
+
+    def __str__(self):
+        """String representation of Idempotency key"""
+        return f'{self.scope} {self.key}'
+
+
+class Job(models.Model):
+    """Background job run by `manage.py worker`"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    name = models.CharField(max_length=100)
+    payload = models.TextField(default='{}')
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_on = models.DateTimeField(auto_now_add=True)
+    finished_on = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', '-priority', 'run_at'], name='core_job_claim_idx'),
+        ]
+
+    def __str__(self):
+        """String representation of Job"""
+        return f'{self.id} {self.name} {self.status}'
+
+
+class OutboxEvent(models.Model):
+    """Event written with the change it describes, delivered by `manage.py relay_outbox`"""
+    aggregate_type = models.CharField(max_length=50)
+    aggregate_id = models.CharField(max_length=50)
+    event_type = models.CharField(max_length=100)
+    payload = models.TextField(default='{}')
+    created_on = models.DateTimeField(auto_now_add=True)
+    delivered_on = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['delivered_on', 'id'], name='core_outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        """String representation of Outbox event"""
+        return f'{self.id} {self.event_type} {self.aggregate_id}'
+
+
+class CategorySales(models.Model):
+    """Orders, units and revenue of a category on a day, kept by core.rollups"""
+    day = models.DateField()
+    # A plain id like OrderLine.category_id, sales outlive their categories.
+    category_id = models.IntegerField()
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'category_id'], name='core_catsales_day_cat_uniq'),
+        ]
+
+    def __str__(self):
+        """String representation of Category sales"""
+        return f'{self.day} {self.category_id}'
+
+
+class PaymentModeSales(models.Model):
+    """Orders and totals paid with a payment mode on a day, kept by core.rollups"""
+    day = models.DateField()
+    payment_mode_id = models.IntegerField()
+    orders = models.IntegerField(default=0)
+    discount = models.FloatField(default=0)
+    revenue = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'payment_mode_id'], name='core_paysales_day_mode_uniq'),
+        ]
+
+    def __str__(self):
+        """String representation of Payment mode sales"""
+        return f'{self.day} {self.payment_mode_id}'
+
+
+class ArchivedOrder(models.Model):
+    """
+    Order older than the archive window, moved out of the hot tables by core.archive.
+
+    Keeps the id of the order it was, its totals in place of the PriceDetail
+    row and its cart items, offers and status log as JSON lists. On
+    PostgreSQL the table is partitioned by month of ordered_on.
+    """
+    id = models.IntegerField(primary_key=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    ordered_on = models.DateTimeField()
+    status = models.CharField(max_length=10, choices=Order.STATUS_CHOICES)
+    shipping_address = models.CharField(max_length=255)
+    billing_address = models.CharField(max_length=255)
+    payment_mode = models.ForeignKey(PaymentMode, on_delete=models.PROTECT)
+    cart_item_ids = models.TextField(default='[]')
+    offer_ids = models.TextField(default='[]')
+    status_log = models.TextField(default='[]')
+    # Totals of the PriceDetail, null if the order was never priced.
+    subtotal = models.FloatField(null=True)
+    discount = models.FloatField(null=True)
+    payment_charges = models.FloatField(null=True)
+    delievery_charges = models.FloatField(null=True)
+    grand_total = models.FloatField(null=True)
+    archived_on = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-ordered_on', '-id'], name='core_arcorder_user_date_idx'),
+            models.Index(fields=['-ordered_on', '-id'], name='core_arcorder_date_idx'),
+            models.Index(fields=['payment_mode', '-ordered_on', '-id'], name='core_arcorder_pmode_date_idx'),
+        ]
+
+    def __str__(self):
+        """String representation of Archived order"""
+        return f'{self.id} {self.ordered_on:%Y-%m-%d}'
+
+
+class ArchivedOrderLine(models.Model):
+    """Line of an archived order, partitioned like its order on PostgreSQL"""
+    id = models.IntegerField(primary_key=True)
+    # No database constraint, a partitioned order table has no unique id to refer to.
+    order = models.ForeignKey(
+        ArchivedOrder, related_name='lines', on_delete=models.CASCADE, db_constraint=False)
+    ordered_on = models.DateTimeField()
+    product_id = models.IntegerField(null=True)
+    category_id = models.IntegerField(null=True)
+    title = models.CharField(max_length=255)
+    unit = models.IntegerField(choices=Product.UNIT_CHOICES, default=Product.UNIT)
+    unit_price = models.FloatField()
+    count = models.IntegerField(validators=[MinValueValidator(1)])
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['order', 'id'], name='core_arcline_order_id_idx'),
+        ]
+
+    def __str__(self):
+        """String representation of Archived order line"""
+        return f'{self.title}, {self.count}'
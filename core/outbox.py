@@ -0,0 +1,207 @@
+"""
+Transactional outbox of order and catalog events.
+
+publish() writes an OutboxEvent row in the transaction of the change it
+describes, so an event exists exactly when its change was committed and a
+rolled back request leaves none. `manage.py relay_outbox` reads pending
+events in id order, in batches of BATCH_SIZE, and delivers them to the
+sinks of OUTBOX['SINKS']: a JSON lines file, an HTTP endpoint or an
+in-process callback.
+
+Delivery is at least once: an event is marked delivered only after every
+sink took it, consumers drop repeats by event id. When a batch fails its
+events are sent one by one and the first failure of an aggregate holds
+back its later events until the next run, so the events of one order or
+product always arrive in the order they were written while other
+aggregates carry on.
+"""
+import json
+import logging
+import os
+import urllib.request
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework.utils.encoders import JSONEncoder
+
+from core.models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'SINKS': [],
+    'BATCH_SIZE': 100,
+}
+
+
+def outbox_settings():
+    """Return the OUTBOX settings merged over the defaults"""
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'OUTBOX', {}))
+    return options
+
+
+def publish(aggregate_type, aggregate_id, event, payload):
+    """Write an event of an aggregate, call it inside the transaction of the change"""
+    return OutboxEvent.objects.create(
+        aggregate_type=aggregate_type,
+        aggregate_id=str(aggregate_id),
+        event_type=f'{aggregate_type}.{event}',
+        payload=json.dumps(payload, cls=JSONEncoder),
+    )
+
+
+def publish_many(aggregate_type, event, items):
+    """Write one event per (aggregate id, payload) of items in a single insert"""
+    return OutboxEvent.objects.bulk_create(
+        OutboxEvent(
+            aggregate_type=aggregate_type,
+            aggregate_id=str(aggregate_id),
+            event_type=f'{aggregate_type}.{event}',
+            payload=json.dumps(payload, cls=JSONEncoder),
+        )
+        for aggregate_id, payload in items
+    )
+
+
+def message(event):
+    """The message of an event as sent to the sinks"""
+    return {
+        'id': event.id,
+        'type': event.event_type,
+        'aggregate_type': event.aggregate_type,
+        'aggregate_id': event.aggregate_id,
+        'created_on': event.created_on,
+        'payload': json.loads(event.payload),
+    }
+
+
+def aggregate(event):
+    """Key of the aggregate of an event, its events are delivered in order"""
+    return event.aggregate_type, event.aggregate_id
+
+
+class FileSink:
+    """Append events as JSON lines to a file"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, messages):
+        with open(self.path, 'a') as out:
+            for item in messages:
+                out.write(json.dumps(item, cls=JSONEncoder) + '\n')
+            out.flush()
+            os.fsync(out.fileno())
+
+
+class HttpSink:
+    """POST batches of events as JSON to an endpoint, any non 2xx answer fails"""
+
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, messages):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps({'events': messages}, cls=JSONEncoder).encode(),
+            headers={'Content-Type': 'application/json'},
+            method='POST',
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class CallbackSink:
+    """Call a function, or the dotted path of one, with each batch of events"""
+
+    def __init__(self, callback):
+        self.callback = import_string(callback) if isinstance(callback, str) else callback
+
+    def send(self, messages):
+        self.callback(messages)
+
+
+BACKENDS = {
+    'file': FileSink,
+    'http': HttpSink,
+    'callback': CallbackSink,
+}
+
+
+def get_sinks(options=None):
+    """Build the sinks of the OUTBOX settings"""
+    options = options or outbox_settings()
+    return [
+        BACKENDS[config['BACKEND']](**{
+            name.lower(): value for name, value in config.items() if name != 'BACKEND'
+        })
+        for config in options['SINKS']
+    ]
+
+
+class Relay:
+    """Deliver pending outbox events to sinks"""
+
+    def __init__(self, sinks=None, options=None):
+        self.options = options or outbox_settings()
+        self.sinks = get_sinks(self.options) if sinks is None else sinks
+
+    def send(self, events):
+        messages = [message(event) for event in events]
+        for sink in self.sinks:
+            sink.send(messages)
+
+    def run(self, batch_size=None, after=0, held=None):
+        """
+        Deliver one batch of the pending events after id `after`.
+
+        Events of the aggregates in held are skipped and the aggregates
+        failing now are added to it. Returns (delivered, last id read),
+        (0, None) once no event is left.
+        """
+        batch_size = batch_size or self.options['BATCH_SIZE']
+        held = set() if held is None else held
+        pending = OutboxEvent.objects.filter(delivered_on__isnull=True, id__gt=after).order_by('id')
+        events = list(pending[:batch_size])
+        if not events:
+            return 0, None
+        ready = [event for event in events if aggregate(event) not in held]
+        try:
+            if ready:
+                self.send(ready)
+            delivered = ready
+        except Exception:
+            delivered = self.send_each(ready, held)
+        OutboxEvent.objects.filter(id__in=[event.id for event in delivered]).update(
+            delivered_on=timezone.now())
+        return len(delivered), events[-1].id
+
+    def send_each(self, events, held):
+        """Send events one at a time, holding back the aggregates that fail"""
+        delivered = []
+        for event in events:
+            if aggregate(event) in held:
+                continue
+            try:
+                self.send([event])
+            except Exception as exc:
+                held.add(aggregate(event))
+                logger.warning('Outbox event %s not delivered: %s', event.id, exc)
+                OutboxEvent.objects.filter(id=event.id).update(
+                    attempts=F('attempts') + 1, last_error=repr(exc))
+            else:
+                delivered.append(event)
+        return delivered
+
+    def drain(self, batch_size=None):
+        """Deliver every pending event that can be, return how many were delivered"""
+        total, after, held = 0, 0, set()
+        while True:
+            delivered, after = self.run(batch_size, after, held)
+            if after is None:
+                return total
+            total += delivered
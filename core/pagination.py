@@ -0,0 +1,86 @@
+"""
+Keyset pagination.
+
+Pages are read in a fixed descending order of a unique key, such as
+(ordered_on, id), and the cursor of the next page holds the key of the
+last row shown. A page is then one index range scan from that key,
+whatever its depth, where OFFSET would read and skip every earlier row.
+"""
+import base64
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginate by a (timestamp, id) key in descending order.
+
+    Responses hold `results` and the `next` page url, None on the last page.
+    """
+    keyset = ('ordered_on', 'id')
+    page_size = 20
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        """Return the (timestamp, id) of the cursor of the request, or None"""
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            stamp, pk = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit('|', 1)
+            position = parse_datetime(stamp), int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if position[0] is None:
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def encode_cursor(self, row):
+        stamp, pk = (getattr(row, field) for field in self.keyset)
+        return base64.urlsafe_b64encode(f'{stamp.isoformat()}|{pk}'.encode()).decode()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+        stamp_field, pk_field = self.keyset
+        if position is not None:
+            stamp, pk = position
+            # The first condition bounds the index scan, the second skips the
+            # rows of the same timestamp already shown.
+            queryset = queryset.filter(
+                Q(**{f'{stamp_field}__lte': stamp}),
+                Q(**{f'{stamp_field}__lt': stamp}) | Q(**{f'{pk_field}__lt': pk}),
+            )
+        rows = list(queryset.order_by(f'-{stamp_field}', f'-{pk_field}')[:size + 1])
+        self.next_row = rows[size - 1] if len(rows) > size else None
+        return rows[:size]
+
+    def get_next_link(self):
+        if self.next_row is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param,
+            self.encode_cursor(self.next_row))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
@@ -0,0 +1,27 @@
+from django.conf import settings
+
+DEFAULTS = {
+    'CHARGE': 40.0,
+    'FREE_ABOVE': 500.0,
+    'DAYS': 3,
+}
+
+
+def delivery_settings():
+    """Return the DELIVERY settings merged over the defaults"""
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'DELIVERY', {}))
+    return options
+
+
+def delivery_charges(amount):
+    """Return the delivery charge for an order worth amount"""
+    options = delivery_settings()
+    if amount <= 0 or amount >= options['FREE_ABOVE']:
+        return 0.0
+    return float(options['CHARGE'])
+
+
+def percentage_of(amount, percentage):
+    """Return percentage % of amount rounded to paise"""
+    return round(amount * percentage / 100, 2)
@@ -0,0 +1,228 @@
+"""
+On-demand request profiling for staff users.
+
+A staff request carrying `?_profile=<format>` or an `X-Profile: <format>`
+header is profiled and answered with the report instead of the normal
+response. Formats are `text` (cProfile summary, also used for `1`), `json`
+(cProfile call graph) and `collapsed` (sampled stacks in the collapsed
+format read by flamegraph tools). Every profile is also saved to a bounded
+on-disk store so profiles can be compared afterwards with
+`manage.py profiles`.
+"""
+import cProfile
+import io
+import json
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+FORMATS = ('text', 'json', 'collapsed')
+
+DEFAULTS = {
+    'STORE_DIR': os.path.join(settings.BASE_DIR, 'profiles'),
+    'MAX_PROFILES': 50,
+    'SAMPLE_INTERVAL': 0.001,
+    'TEXT_LIMIT': 60,
+}
+
+
+def profiler_settings():
+    """Return the PROFILER settings merged over the defaults"""
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'PROFILER', {}))
+    return options
+
+
+def requested_format(request):
+    """Return the report format asked for by the request, or None"""
+    value = request.GET.get('_profile') or request.META.get('HTTP_X_PROFILE')
+    if not value:
+        return None
+    value = value.lower()
+    if value in FORMATS:
+        return value
+    return 'text' if value in ('1', 'true', 'yes') else None
+
+
+def is_staff_request(request):
+    """Return whether the session or token user of the request is staff"""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user.is_staff
+    try:
+        result = TokenAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return False
+    return bool(result and result[0].is_staff)
+
+
+def function_label(func):
+    """Return 'file:line(function)' for a pstats function key"""
+    filename, line, name = func
+    return f'{filename}:{line}({name})'
+
+
+class CProfiler:
+    """Deterministic profiler built on cProfile"""
+
+    kind = 'prof'
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        self.profile.create_stats()
+
+    def dump(self):
+        return marshal.dumps(self.profile.stats)
+
+    def text(self, limit):
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=stream)
+        stats.sort_stats('cumulative').print_stats(limit)
+        return stream.getvalue()
+
+    def callgraph(self):
+        return callgraph(self.profile.stats)
+
+
+def callgraph(stats):
+    """Return the nodes and edges of a cProfile stats dict"""
+    ids = {func: index for index, func in enumerate(stats)}
+    nodes = []
+    edges = []
+    for func, (primitive_calls, calls, total, cumulative, callers) in stats.items():
+        nodes.append({
+            'id': ids[func],
+            'function': func[2],
+            'file': func[0],
+            'line': func[1],
+            'calls': calls,
+            'primitive_calls': primitive_calls,
+            'total_time': total,
+            'cumulative_time': cumulative,
+        })
+        for caller, caller_stats in callers.items():
+            if caller not in ids:
+                continue
+            edges.append({
+                'caller': ids[caller],
+                'callee': ids[func],
+                'calls': caller_stats[1],
+                'total_time': caller_stats[2],
+                'cumulative_time': caller_stats[3],
+            })
+    return {'nodes': nodes, 'edges': edges}
+
+
+class SamplingProfiler:
+    """Statistical profiler sampling the stack of the profiled thread"""
+
+    kind = 'collapsed'
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.samples = Counter()
+        self._thread_id = None
+        self._running = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        self._running.set()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self._running.clear()
+        self._sampler.join()
+
+    def _sample(self):
+        while self._running.is_set():
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_filename}:{code.co_name}')
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
+
+    def dump(self):
+        return self.collapsed().encode()
+
+
+class ProfileStore:
+    """Directory keeping the most recent profiles and their metadata"""
+
+    def __init__(self, directory, max_profiles=50):
+        self.directory = directory
+        self.max_profiles = max_profiles
+
+    def save(self, profiler, meta):
+        """Save the profile and return its id"""
+        os.makedirs(self.directory, exist_ok=True)
+        profile_id = f'{time.strftime("%Y%m%d%H%M%S")}-{uuid.uuid4().hex[:8]}'
+        meta = dict(meta, id=profile_id, kind=profiler.kind, created=time.time())
+        with open(os.path.join(self.directory, f'{profile_id}.{profiler.kind}'), 'wb') as data:
+            data.write(profiler.dump())
+        with open(os.path.join(self.directory, f'{profile_id}.json'), 'w') as info:
+            json.dump(meta, info)
+        self.prune()
+        return profile_id
+
+    def list(self):
+        """Return the metadata of the stored profiles, oldest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                with open(os.path.join(self.directory, name)) as info:
+                    profiles.append(json.load(info))
+        return sorted(profiles, key=lambda meta: (meta['created'], meta['id']))
+
+    def prune(self):
+        """Delete the oldest profiles beyond the limit"""
+        profiles = self.list()
+        for meta in profiles[:max(0, len(profiles) - self.max_profiles)]:
+            for extension in ('json', meta['kind']):
+                path = os.path.join(self.directory, f'{meta["id"]}.{extension}')
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def load_stats(self, profile_id):
+        """Return the cProfile stats dict of a stored profile"""
+        with open(os.path.join(self.directory, f'{profile_id}.prof'), 'rb') as data:
+            return marshal.loads(data.read())
+
+
+def compare(before, after, limit=20):
+    """
+    Return the functions whose cumulative time changed the most between
+    two cProfile stats dicts, as (label, before, after, delta) rows.
+    """
+    rows = []
+    for func in set(before) | set(after):
+        old = before[func][3] if func in before else 0.0
+        new = after[func][3] if func in after else 0.0
+        rows.append((function_label(func), old, new, new - old))
+    rows.sort(key=lambda row: abs(row[3]), reverse=True)
+    return rows[:limit]
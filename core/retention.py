@@ -0,0 +1,160 @@
+"""
+Retention policies run by `manage.py purge`.
+
+A policy names a model and the condition of the rows it may delete. Rows
+are deleted in batches of BATCH_SIZE primary keys, walking the primary key
+index upwards, each batch in its own short transaction that checks the
+condition again, so rows touched since they were selected survive. Runs
+are throttled to ROWS_PER_SECOND and record their position in a
+PurgeCheckpoint, an interrupted run resumes where it stopped.
+"""
+import time
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core.models import Job, PurgeCheckpoint
+
+DEFAULTS = {
+    'SESSION_CART_DAYS': 30,
+    'TOKEN_DAYS': 180,
+    'TOKEN_TOUCH_SECONDS': 3600,
+    'JOB_DAYS': 7,
+    'OUTBOX_DAYS': 7,
+    'BATCH_SIZE': 500,
+    'ROWS_PER_SECOND': 2000,
+}
+
+POLICIES = {}
+
+
+def retention_settings():
+    """Return the RETENTION settings merged over the defaults"""
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'RETENTION', {}))
+    return options
+
+
+class Policy:
+    """Rows of a model that may be deleted once condition(now, options) holds"""
+
+    def __init__(self, name, model, condition):
+        self.name = name
+        self.model_label = model
+        self.condition = condition
+        self.description = (condition.__doc__ or '').strip()
+
+    @property
+    def model(self):
+        return apps.get_model(self.model_label)
+
+    def queryset(self, now, options):
+        return self.model._default_manager.filter(self.condition(now, options))
+
+
+def policy(name, model):
+    """Register the decorated condition as the retention policy of a model"""
+    def register(condition):
+        POLICIES[name] = Policy(name, model, condition)
+        return condition
+    return register
+
+
+@policy('session_carts', 'core.SessionShoppingCart')
+def stale_session_carts(now, options):
+    """Anonymous cart rows not changed for SESSION_CART_DAYS"""
+    return Q(updated_on__lt=now - timedelta(days=options['SESSION_CART_DAYS']))
+
+
+@policy('sessions', 'sessions.Session')
+def expired_sessions(now, options):
+    """Sessions past their expiry date"""
+    return Q(expire_date__lt=now)
+
+
+@policy('tokens', 'authtoken.Token')
+def unused_tokens(now, options):
+    """Tokens not used to authenticate a request for TOKEN_DAYS"""
+    cutoff = now - timedelta(days=options['TOKEN_DAYS'])
+    return Q(usage__last_used__lt=cutoff) | Q(usage__isnull=True, created__lt=cutoff)
+
+
+@policy('jobs', 'core.Job')
+def finished_jobs(now, options):
+    """Background jobs done or failed more than JOB_DAYS ago"""
+    cutoff = now - timedelta(days=options['JOB_DAYS'])
+    return Q(status__in=[Job.DONE, Job.FAILED], finished_on__lt=cutoff)
+
+
+@policy('outbox', 'core.OutboxEvent')
+def delivered_outbox_events(now, options):
+    """Outbox events delivered more than OUTBOX_DAYS ago"""
+    return Q(delivered_on__lt=now - timedelta(days=options['OUTBOX_DAYS']))
+
+
+@policy('idempotency_keys', 'core.IdempotencyKey')
+def expired_idempotency_keys(now, options):
+    """Stored responses of Idempotency-Key requests past their expiry"""
+    return Q(expires_at__lt=now)
+
+
+class Purger:
+    """Delete the rows of a policy in throttled, resumable batches"""
+
+    def __init__(self, policy, options=None, sleep=time.sleep):
+        self.policy = policy
+        self.options = options or retention_settings()
+        self.sleep = sleep
+
+    def count(self):
+        """Return the number of rows the policy would delete now"""
+        return self.policy.queryset(timezone.now(), self.options).count()
+
+    def run(self, restart=False, max_batches=None):
+        """
+        Delete the rows of the policy and return (deleted, finished).
+
+        The run stops early after max_batches batches, leaving a checkpoint
+        the next run resumes from.
+        """
+        checkpoint = PurgeCheckpoint.objects.filter(policy=self.policy.name).first()
+        if checkpoint is not None and restart:
+            checkpoint.delete()
+            checkpoint = None
+        if checkpoint is None:
+            checkpoint = PurgeCheckpoint(policy=self.policy.name, last_pk='', cutoff=timezone.now())
+
+        pk_field = self.policy.model._meta.pk
+        last_pk = pk_field.to_python(checkpoint.last_pk) if checkpoint.last_pk else None
+        queryset = self.policy.queryset(checkpoint.cutoff, self.options)
+        batch_size = self.options['BATCH_SIZE']
+        rows_per_second = self.options['ROWS_PER_SECOND']
+        deleted = batches = 0
+
+        while max_batches is None or batches < max_batches:
+            candidates = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            pks = list(candidates.order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                if checkpoint.pk is not None:
+                    checkpoint.delete()
+                return deleted, True
+
+            start = time.monotonic()
+            with transaction.atomic():
+                count = queryset.filter(pk__in=pks).delete()[1].get(self.policy.model._meta.label, 0)
+                last_pk = pks[-1]
+                checkpoint.last_pk = str(last_pk)
+                checkpoint.deleted += count
+                checkpoint.save()
+            deleted += count
+            batches += 1
+
+            if rows_per_second:
+                remaining = len(pks) / rows_per_second - (time.monotonic() - start)
+                if remaining > 0:
+                    self.sleep(remaining)
+        return deleted, False
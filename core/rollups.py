@@ -0,0 +1,166 @@
+"""
+Daily sales rollups for reporting.
+
+CategorySales and PaymentModeSales hold one row per day and category or
+payment mode. Checkout adds every order to them with an incrementing
+upsert in its own transaction, and an order update takes its old lines
+and totals out before adding the new ones, so reports read a few rows per
+day instead of scanning orders. `manage.py rebuild_rollups` recomputes
+them from the order lines and price details, archived orders included.
+
+Days are local dates of Order.ordered_on in the current time zone.
+"""
+from django.db import connection, transaction
+from django.db.models import Count, F, FloatField, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from core import models
+from core.db.upsert import upsert
+
+# Lines whose category is unknown, such as lines backfilled from deleted products.
+NO_CATEGORY = 0
+
+
+def order_totals(order):
+    """Return (grand total, discount) of an order, zeros if it was never priced"""
+    try:
+        detail = order.pricedetail
+    except models.PriceDetail.DoesNotExist:
+        return 0.0, 0.0
+    return detail.grand_total, detail.discount
+
+
+def add_order(order, lines, sign=1):
+    """Add the lines and totals of an order to the rollups, or take them out with sign -1"""
+    day = timezone.localdate(order.ordered_on)
+    categories = {}
+    for line in lines:
+        category = line.category_id or NO_CATEGORY
+        row = categories.setdefault(category, {
+            'day': day, 'category_id': category, 'orders': sign, 'units': 0, 'revenue': 0.0,
+        })
+        row['units'] += sign * line.count
+        row['revenue'] += sign * line.count * line.unit_price
+    if categories:
+        upsert(models.CategorySales, list(categories.values()),
+               ['day', 'category_id'], ['orders', 'units', 'revenue'], increment=True)
+
+    grand_total, discount = order_totals(order)
+    upsert(models.PaymentModeSales, [{
+        'day': day,
+        'payment_mode_id': order.payment_mode_id,
+        'orders': sign,
+        'discount': sign * discount,
+        'revenue': sign * grand_total,
+    }], ['day', 'payment_mode_id'], ['orders', 'discount', 'revenue'], increment=True)
+
+
+def remove_order(order, lines):
+    """Take the lines and totals of an order out of the rollups"""
+    add_order(order, lines, sign=-1)
+
+
+def category_totals(lines, ordered_on):
+    """Orders, units and revenue of order lines per day and category"""
+    return lines.annotate(day=TruncDate(ordered_on)).values(
+        'day', category=Coalesce('category_id', Value(NO_CATEGORY))).annotate(
+        orders=Count('order_id', distinct=True),
+        units=Sum('count'),
+        revenue=Sum(F('count') * F('unit_price'), output_field=FloatField()),
+    ).order_by()
+
+
+def payment_totals(orders, discount, grand_total):
+    """Orders, discounts and grand totals of orders per day and payment mode"""
+    return orders.annotate(day=TruncDate('ordered_on')).values(
+        'day', 'payment_mode_id').annotate(
+        orders=Count('id'),
+        discount=Coalesce(Sum(discount), Value(0.0)),
+        revenue=Coalesce(Sum(grand_total), Value(0.0)),
+    ).order_by()
+
+
+def merge(rows, key, totals):
+    """Sum rows sharing a (day, key), an order is either hot or archived so none is counted twice"""
+    merged = {}
+    for row in rows:
+        found = merged.setdefault((row['day'], row[key]), dict(row, **dict.fromkeys(totals, 0)))
+        for name in totals:
+            found[name] += row[name]
+    return list(merged.values())
+
+
+def rebuild(since=None):
+    """
+    Recompute the rollups of the days from `since`, or of every day.
+
+    Both the hot and the archived orders of core.archive are read.
+    Returns the number of (category, payment mode) rows written. On
+    PostgreSQL the rollup tables are locked until the rebuild commits, so
+    an order placed meanwhile is added after the rebuilt rows, not lost.
+    """
+    lines = models.OrderLine.objects.all()
+    orders = models.Order.objects.all()
+    archived_lines = models.ArchivedOrderLine.objects.all()
+    archived_orders = models.ArchivedOrder.objects.all()
+    if since is not None:
+        lines = lines.filter(order__ordered_on__date__gte=since)
+        orders = orders.filter(ordered_on__date__gte=since)
+        archived_lines = archived_lines.filter(ordered_on__date__gte=since)
+        archived_orders = archived_orders.filter(ordered_on__date__gte=since)
+
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('LOCK TABLE {}, {} IN SHARE ROW EXCLUSIVE MODE'.format(
+                    connection.ops.quote_name(models.CategorySales._meta.db_table),
+                    connection.ops.quote_name(models.PaymentModeSales._meta.db_table)))
+        for model in (models.CategorySales, models.PaymentModeSales):
+            stale = model.objects.all()
+            if since is not None:
+                stale = stale.filter(day__gte=since)
+            stale.delete()
+
+        category_rows = [
+            models.CategorySales(
+                day=row['day'], category_id=row['category'],
+                orders=row['orders'], units=row['units'], revenue=row['revenue'])
+            for row in merge(
+                list(category_totals(lines, 'order__ordered_on')) +
+                list(category_totals(archived_lines, 'ordered_on')),
+                'category', ('orders', 'units', 'revenue'))
+        ]
+        models.CategorySales.objects.bulk_create(category_rows)
+
+        payment_rows = [
+            models.PaymentModeSales(**row)
+            for row in merge(
+                list(payment_totals(orders, 'pricedetail__discount', 'pricedetail__grand_total')) +
+                list(payment_totals(archived_orders, 'discount', 'grand_total')),
+                'payment_mode_id', ('orders', 'discount', 'revenue'))
+        ]
+        models.PaymentModeSales.objects.bulk_create(payment_rows)
+    return len(category_rows), len(payment_rows)
+
+
+def report(model, key, start, end, by_day=True):
+    """
+    Rows of a rollup model between two days, inclusive.
+
+    One row per day and key, or with by_day unset one row per key summed
+    over the days.
+    """
+    totals = [
+        field.name for field in model._meta.concrete_fields
+        if field.name not in ('id', 'day', key)
+    ]
+    rows = model.objects.filter(day__range=(start, end))
+    if by_day:
+        rows = rows.order_by('day', key).values('day', key, *totals)
+    else:
+        rows = rows.values(key).annotate(**{name: Sum(name) for name in totals}).order_by(key)
+    return [
+        dict(row, **{name: round(row[name], 2) for name in ('revenue', 'discount') if name in row})
+        for row in rows
+    ]
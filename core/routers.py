@@ -0,0 +1,174 @@
+"""
+Read replica routing.
+
+Safe-method reads of views with `replica_reads = True` go to a replica.
+A client that wrote is pinned to the primary for the pin window, by a
+cookie and, for token clients that keep no cookies, by a key in the
+default cache. That key only reaches every worker when CACHES names a
+cache shared by the processes; the `core.W001` check warns when replicas
+are configured over the process-local LocMemCache. Reads of the models
+authenticating a request always go to the primary, so a token or session
+created a moment ago is found under replication lag.
+"""
+import itertools
+import threading
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PIN_COOKIE = 'db_pinned'
+
+# Models read to authenticate a request, never read from a replica.
+PRIMARY_MODELS = ('authtoken.token', 'core.tokenusage', 'sessions.session')
+
+LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+_state = threading.local()
+
+
+def replicas():
+    """Return the aliases of the configured read replicas"""
+    return list(getattr(settings, 'DATABASE_REPLICAS', []))
+
+
+def pin_seconds():
+    """Return how long a writer's reads stick to the primary"""
+    return getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', 15)
+
+
+def pin_key(user_id):
+    """Cache key marking a user as pinned to the primary"""
+    return f'replica-pin:{user_id}'
+
+
+def primary_only(model):
+    """Return whether reads of the model must use the primary"""
+    label = model._meta.label_lower
+    return label in PRIMARY_MODELS or label == settings.AUTH_USER_MODEL.lower()
+
+
+def check_pin_cache(app_configs, **kwargs):
+    """Warn when replicas are used with a cache the workers do not share"""
+    if replicas() and settings.CACHES['default']['BACKEND'] in LOCAL_CACHES:
+        return [checks.Warning(
+            'Read replicas are configured but the default cache is local to each process, '
+            'token clients are only pinned to the primary on the worker that took their write.',
+            hint='Set CACHE_BACKEND and CACHE_LOCATION to a cache shared by the workers.',
+            id='core.W001',
+        )]
+    return []
+
+
+def start_request(request):
+    """Attach the current request to the routing state of this thread"""
+    _state.request = request
+    _state.replica_reads = False
+
+
+def end_request():
+    """Forget the request of this thread"""
+    _state.request = None
+    _state.replica_reads = False
+
+
+def enable_replica_reads(enabled=True):
+    """Mark whether the view handling this request may read from replicas"""
+    _state.replica_reads = enabled
+
+
+def pin(request, response):
+    """Stick reads of the writer to the primary for the pin window"""
+    seconds = pin_seconds()
+    response.set_cookie(PIN_COOKIE, '1', max_age=seconds)
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        cache.set(pin_key(user.pk), True, seconds)
+
+
+def is_pinned(request):
+    """Return whether the request must read from the primary"""
+    if request.COOKIES.get(PIN_COOKIE):
+        return True
+    if getattr(_state, 'checking_pin', False):
+        # Resolving the user queries the database, which asks the router
+        # again; those lookups go to the primary.
+        return True
+    _state.checking_pin = True
+    try:
+        user = getattr(request, 'user', None)
+        return bool(
+            user is not None and
+            user.is_authenticated and
+            cache.get(pin_key(user.pk))
+        )
+    finally:
+        _state.checking_pin = False
+
+
+class ReplicaSelector:
+    """Choose a replica by round-robin or by the lowest observed latency"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cycle = None
+        self._aliases = None
+        self.latency = {}
+
+    def record_latency(self, alias, seconds, weight=0.2):
+        """Fold a query duration into the moving average of the replica"""
+        with self._lock:
+            previous = self.latency.get(alias)
+            if previous is None:
+                self.latency[alias] = seconds
+            else:
+                self.latency[alias] = previous + weight * (seconds - previous)
+
+    def choose(self, aliases, strategy='round_robin'):
+        """Return the replica alias to read from"""
+        if strategy == 'least_latency':
+            # Replicas without samples yet are tried first.
+            return min(aliases, key=lambda alias: self.latency.get(alias, 0.0))
+        with self._lock:
+            if self._aliases != aliases:
+                self._aliases = aliases
+                self._cycle = itertools.cycle(aliases)
+            return next(self._cycle)
+
+
+selector = ReplicaSelector()
+
+
+class ReplicaRouter:
+    """
+    Route safe-method reads of replica-enabled views to a read replica.
+
+    Writes, reads outside such views, reads of the authentication models
+    and reads of users who wrote within DATABASE_REPLICA_PIN_SECONDS go to
+    the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if primary_only(model):
+            return None
+        request = getattr(_state, 'request', None)
+        if request is None or not getattr(_state, 'replica_reads', False):
+            return None
+        if request.method not in SAFE_METHODS:
+            return None
+        aliases = replicas()
+        if not aliases or is_pinned(request):
+            return None
+        strategy = getattr(settings, 'DATABASE_REPLICA_SELECTION', 'round_robin')
+        return selector.choose(aliases, strategy)
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Primary and replicas hold the same data"""
+        return True
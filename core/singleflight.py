@@ -0,0 +1,110 @@
+import threading
+import time
+import uuid
+
+from django.core.cache import caches
+
+
+class _Call:
+    """In-flight computation shared by concurrent callers of the same key"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key into one computation.
+
+    Inside a worker, callers arriving while a computation for their key is
+    running wait for it and share its result (or exception). When a
+    `cache_alias` is given, the leader of each worker additionally takes a
+    lock in that cache backend so only one worker computes and the others
+    pick up the result it publishes.
+    """
+
+    def __init__(self, cache_alias=None, lock_timeout=5, wait_timeout=5,
+                 poll_interval=0.01, prefix='singleflight'):
+        self.cache_alias = cache_alias
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """Return fn() for the key, computing it once for concurrent callers"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run(key, fn)
+        except Exception as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def _run(self, key, fn):
+        """Compute the value, coordinating with other workers through the cache"""
+        if self.cache_alias is None:
+            return fn()
+
+        cache = caches[self.cache_alias]
+        lock_key = f'{self.prefix}:lock:{key}'
+        deadline = time.monotonic() + self.wait_timeout
+
+        while time.monotonic() < deadline:
+            token = uuid.uuid4().hex
+            if cache.add(lock_key, token, self.lock_timeout):
+                try:
+                    result = fn()
+                    cache.set(f'{self.prefix}:result:{key}:{token}',
+                              result, self.lock_timeout)
+                    return result
+                finally:
+                    cache.delete(lock_key)
+
+            token = cache.get(lock_key)
+            if token is None:
+                continue
+            result_key = f'{self.prefix}:result:{key}:{token}'
+            while time.monotonic() < deadline:
+                found, result = self._lookup(cache, result_key)
+                if found:
+                    return result
+                if cache.get(lock_key) != token:
+                    # The other worker finished (or failed) without
+                    # publishing a result we could see; try again.
+                    found, result = self._lookup(cache, result_key)
+                    if found:
+                        return result
+                    break
+                time.sleep(self.poll_interval)
+
+        # Waited too long for another worker, compute it ourselves.
+        return fn()
+
+    @staticmethod
+    def _lookup(cache, result_key):
+        """Return (found, value) for a published result"""
+        missing = object()
+        result = cache.get(result_key, missing)
+        if result is missing:
+            return False, None
+        return True, result
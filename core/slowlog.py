@@ -0,0 +1,145 @@
+"""
+Slow-query log.
+
+SlowQueryLogger is a database execute wrapper that logs statements slower
+than SLOW_QUERY_LOG['THRESHOLD_MS'] to the `core.slowlog` logger, together
+with their parameters, the originating view, the application frame that
+ran them and their EXPLAIN plan. A SAMPLE_RATE fraction of slow queries is
+logged and an ANALYZE_RATE fraction of those is explained with EXPLAIN
+ANALYZE, so it is safe to leave on under load.
+"""
+import json
+import logging
+import os
+import random
+import time
+import traceback
+
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'THRESHOLD_MS': 200,
+    'SAMPLE_RATE': 1.0,
+    'EXPLAIN': True,
+    'ANALYZE_RATE': 0.0,
+}
+
+_THIS_FILE = os.path.abspath(__file__)
+
+
+def slow_query_settings():
+    """Return the SLOW_QUERY_LOG settings merged over the defaults"""
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'SLOW_QUERY_LOG', {}))
+    return options
+
+
+def application_frame():
+    """Return 'file:line in function' of the innermost project frame"""
+    base_dir = os.path.abspath(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if filename == _THIS_FILE or not filename.startswith(base_dir):
+            continue
+        if 'site-packages' in filename:
+            continue
+        return f'{os.path.relpath(filename, base_dir)}:{frame.lineno} in {frame.name}'
+    return None
+
+
+class SlowQueryLogger:
+    """Execute wrapper logging statements over the configured threshold"""
+
+    def __init__(self, connection, request=None, options=None):
+        self.connection = connection
+        self.request = request
+        self.options = options or slow_query_settings()
+        self._explaining = False
+
+    def __call__(self, execute, sql, params, many, context):
+        if self._explaining:
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = execute(sql, params, many, context)
+            failed = False
+            return result
+        finally:
+            duration_ms = 1000 * (time.perf_counter() - start)
+            if (duration_ms >= self.options['THRESHOLD_MS'] and
+                    random.random() < self.options['SAMPLE_RATE']):
+                self.log(sql, params, many, duration_ms, failed)
+
+    def log(self, sql, params, many, duration_ms, failed):
+        entry = {
+            'duration_ms': round(duration_ms, 3),
+            'alias': self.connection.alias,
+            'sql': sql,
+            'params': params,
+            'many': many,
+            'failed': failed,
+            'frame': application_frame(),
+        }
+        entry.update(self.request_info())
+        if self.options['EXPLAIN'] and not many and not failed:
+            analyze = random.random() < self.options['ANALYZE_RATE']
+            entry['analyzed'], entry['plan'] = self.explain(sql, params, analyze)
+        logger.warning('slow query %.1fms', duration_ms, extra={'slow_query': entry})
+
+    def request_info(self):
+        if self.request is None:
+            return {}
+        match = getattr(self.request, 'resolver_match', None)
+        return {
+            'method': self.request.method,
+            'path': self.request.path,
+            'view': match._func_path if match else None,
+        }
+
+    def explain(self, sql, params, analyze):
+        """Return (analyzed, plan lines) for the statement, or (False, None)"""
+        vendor = self.connection.vendor
+        statement = sql.lstrip().upper()
+        if analyze and (not statement.startswith('SELECT') or 'FOR UPDATE' in statement):
+            # EXPLAIN ANALYZE runs the statement again.
+            analyze = False
+        if vendor == 'postgresql':
+            prefix = 'EXPLAIN ANALYZE ' if analyze else 'EXPLAIN '
+        elif vendor == 'sqlite':
+            prefix, analyze = 'EXPLAIN QUERY PLAN ', False
+        else:
+            return False, None
+
+        self._explaining = True
+        try:
+            # A savepoint keeps a failing EXPLAIN from aborting the
+            # transaction of the request.
+            with transaction.atomic(using=self.connection.alias):
+                with self.connection.cursor() as cursor:
+                    cursor.execute(prefix + sql, params)
+                    rows = cursor.fetchall()
+        except Exception as exc:
+            return False, [f'EXPLAIN failed: {exc}']
+        finally:
+            self._explaining = False
+        return analyze, [' '.join(str(column) for column in row) for row in rows]
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as one JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'slow_query', {}))
+        return json.dumps(entry, default=str)
@@ -0,0 +1,145 @@
+"""
+Append-only stock ledger.
+
+Every change to the stock of a product is a StockMovement row: receipts,
+sales and released holds of checkout reservations, customer returns and
+manual adjustments. `manage.py stock_snapshot` periodically folds the
+movements into StockSnapshot rows, so the stock of a product, now or at
+any past time, is its latest snapshot plus the few movements after it.
+
+Product.quantity stays the sellable counter checked by the conditional
+update of core.inventory. Movements are plain inserts, never updates of
+a shared row; only receipts, returns and adjustments also add their delta
+to Product.quantity with one relative UPDATE.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from core import models
+
+DEFAULTS = {
+    'SNAPSHOT_LAG_SECONDS': 60,
+}
+
+
+def stock_settings():
+    """Return the STOCK settings merged over the defaults"""
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'STOCK', {}))
+    return options
+
+
+class InsufficientStock(Exception):
+    """Raised when a negative movement would take the stock below zero"""
+
+
+def record(product_id, kind, delta, user=None, note=''):
+    """
+    Append a movement and apply its delta to the sellable quantity.
+
+    Negative deltas only apply while enough units are left, otherwise
+    InsufficientStock is raised and nothing is recorded.
+    """
+    with transaction.atomic():
+        products = models.Product.objects.filter(id=product_id)
+        if delta < 0:
+            products = products.filter(quantity__gte=-delta)
+        if not products.update(quantity=F('quantity') + delta):
+            raise InsufficientStock(product_id)
+        return models.StockMovement.objects.create(
+            product_id=product_id, kind=kind, delta=delta, user=user, note=note)
+
+
+def record_reservation(reservation, kind, lines):
+    """Append one movement per line of a reservation, sales negative"""
+    sign = -1 if kind == models.StockMovement.SALE else 1
+    models.StockMovement.objects.bulk_create(
+        models.StockMovement(
+            product_id=product, kind=kind, delta=sign * count,
+            reservation=reservation, user_id=reservation.user_id)
+        for product, count in sorted(lines.items())
+    )
+
+
+def latest_snapshot(at=None):
+    """Subquery of the latest snapshot of the outer product, taken by `at` if given"""
+    snapshots = models.StockSnapshot.objects.filter(product_id=OuterRef('product_id'))
+    if at is not None:
+        snapshots = snapshots.filter(taken_on__lte=at)
+    return snapshots.order_by('-id')
+
+
+def unfolded_movements(at=None):
+    """Movements made after the latest snapshot of their product"""
+    last_movement = Subquery(latest_snapshot(at).values('last_movement_id')[:1])
+    return models.StockMovement.objects.annotate(
+        folded=Coalesce(last_movement, Value(0))
+    ).filter(id__gt=F('folded'))
+
+
+def snapshot_quantities(product_ids, at=None):
+    """Return {product id: quantity} of the latest snapshots of the products"""
+    snapshots = models.StockSnapshot.objects.filter(product_id__in=product_ids)
+    if at is not None:
+        snapshots = snapshots.filter(taken_on__lte=at)
+    latest = snapshots.values('product_id').annotate(latest=Max('id')).values('latest')
+    return dict(models.StockSnapshot.objects.filter(
+        id__in=latest).values_list('product_id', 'quantity'))
+
+
+def stock_levels(product_ids, at=None):
+    """
+    Return {product id: stock} from the ledger, now or at a past time.
+
+    Reads the latest snapshot of each product and sums the movements made
+    after it, a bounded number of rows whatever the age of the product.
+    """
+    product_ids = list(product_ids)
+    snapshots = snapshot_quantities(product_ids, at)
+    movements = unfolded_movements(at).filter(product_id__in=product_ids)
+    if at is not None:
+        movements = movements.filter(created_on__lte=at)
+    deltas = dict(movements.values('product_id').annotate(
+        total=Sum('delta')).values_list('product_id', 'total'))
+    return {
+        product: snapshots.get(product, 0) + deltas.get(product, 0)
+        for product in product_ids
+    }
+
+
+def take_snapshots(lag_seconds=None):
+    """
+    Fold the movements since the latest snapshots into new snapshots.
+
+    Movements younger than lag_seconds are left for the next run, so a
+    movement whose transaction commits late is not skipped. Returns the
+    number of snapshots taken.
+    """
+    if lag_seconds is None:
+        lag_seconds = stock_settings()['SNAPSHOT_LAG_SECONDS']
+    boundary = models.StockMovement.objects.filter(
+        created_on__lt=timezone.now() - timedelta(seconds=lag_seconds)
+    ).aggregate(last=Max('id'))['last']
+    if boundary is None:
+        return 0
+
+    deltas = dict(
+        unfolded_movements().filter(id__lte=boundary)
+        .values('product_id').annotate(total=Sum('delta'))
+        .values_list('product_id', 'total')
+    )
+    previous = snapshot_quantities(deltas)
+    models.StockSnapshot.objects.bulk_create(
+        models.StockSnapshot(
+            product_id=product,
+            quantity=previous.get(product, 0) + total,
+            last_movement_id=boundary,
+        )
+        for product, total in deltas.items()
+    )
+    return len(deltas)
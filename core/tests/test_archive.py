@@ -0,0 +1,125 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import archive, jobs, models, rollups
+from order import status as order_status
+from order.tests.test_order_api import (ORDER_URL, detail_url, sample_category,
+                                        sample_payment_mode, sample_product,
+                                        sample_shipping_address, sample_shopping_item,
+                                        sample_user)
+from order.tests.test_order_status import log_url
+
+
+class ArchiveTests(TestCase):
+    """Test moving cold orders to the archive and reading them back"""
+
+    def setUp(self):
+        self.staff = sample_user()
+        self.buyer = sample_user(email = 'buyer@example.com', is_staff = False)
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+        category = sample_category(self.staff)
+        self.products = [
+            sample_product(self.staff, category, title = f'Loaf {index}', quantity = 20)
+            for index in range(4)
+        ]
+        self.address = sample_shipping_address(self.buyer).printable()
+        self.payment_mode = sample_payment_mode(self.staff)
+        self.now = timezone.now()
+
+    def place(self, product, days_ago, final = True):
+        res = self.client.post(ORDER_URL, {
+            'cartItems': [sample_shopping_item(self.buyer, product).id],
+            'shipping_address': self.address,
+            'billing_address': self.address,
+            'payment_mode': self.payment_mode.id,
+        })
+        order_id = res.data['id']
+        if final:
+            order_status.transition([order_id], models.Order.CANCELLED, user = self.staff)
+        models.Order.objects.filter(id = order_id).update(
+            ordered_on = self.now - timedelta(days = days_ago))
+        return order_id
+
+    def test_archive_moves_cold_final_orders(self):
+        """Test that only old orders in a final status are moved, with their rows"""
+        cold = self.place(self.products[0], 400)
+        open_order = self.place(self.products[1], 400, final = False)
+        recent = self.place(self.products[2], 10)
+        detail = models.PriceDetail.objects.get(order_id = cold)
+
+        moved, finished = archive.archive(archive.cutoff(now = self.now))
+        self.assertEqual((moved, finished), (1, True))
+        self.assertEqual(
+            set(models.Order.objects.values_list('id', flat = True)), {open_order, recent})
+        self.assertFalse(models.PriceDetail.objects.filter(order_id = cold).exists())
+        self.assertFalse(models.OrderLine.objects.filter(order_id = cold).exists())
+
+        archived = models.ArchivedOrder.objects.get(id = cold)
+        self.assertEqual(archived.grand_total, detail.grand_total)
+        self.assertEqual(archived.status, models.Order.CANCELLED)
+        self.assertEqual(archived.lines.get().title, 'Loaf 0')
+
+    def test_archive_is_batched_and_resumable(self):
+        """Test that a run stopped after some batches leaves the rest for the next run"""
+        ids = [self.place(product, 400 + index) for index, product in enumerate(self.products)]
+        before = archive.cutoff(now = self.now)
+        self.assertEqual(archive.archive(before, batch_size = 3, max_batches = 1), (3, False))
+        # The oldest orders go first.
+        self.assertEqual(list(models.Order.objects.values_list('id', flat = True)), ids[:1])
+        self.assertEqual(archive.archive(before, batch_size = 3), (1, True))
+        self.assertEqual(models.ArchivedOrder.objects.count(), 4)
+
+    def test_archive_job_queues_the_rest(self):
+        """Test that the archive job queues itself again until no cold order is left"""
+        for index, product in enumerate(self.products):
+            self.place(product, 400 + index)
+        out = StringIO()
+        call_command('archive_orders', '--enqueue', stdout = out)
+        self.assertIn('Queued archiving', out.getvalue())
+        models.Job.objects.all().delete()
+
+        jobs.enqueue('order.archive', before = archive.cutoff(now = self.now).isoformat(), batches = 1)
+        with self.settings(ARCHIVE = {'BATCH_SIZE': 2}):
+            runs = jobs.Worker(threads = 1, name = 'test').run(once = True)
+        self.assertEqual(models.ArchivedOrder.objects.count(), 4)
+        self.assertEqual(runs, 3)
+
+    def test_archived_order_read_through_api(self):
+        """Test that archived orders are served by the order detail and ?archived=true"""
+        cold = self.place(self.products[0], 400)
+        hot_detail = self.client.get(detail_url(cold)).data
+        hot_log = self.client.get(log_url(cold)).data
+        call_command('archive_orders', stdout = StringIO())
+
+        res = self.client.get(detail_url(cold))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, hot_detail)
+        self.assertEqual(self.client.get(log_url(cold)).data, hot_log)
+
+        res = self.client.get(ORDER_URL)
+        self.assertEqual(res.data['results'], [])
+        res = self.client.get(ORDER_URL, {'archived': 'true', 'status': 'cancelled'})
+        self.assertEqual([order['id'] for order in res.data['results']], [cold])
+
+        self.client.force_authenticate(sample_user(email = 'other@example.com', is_staff = False))
+        res = self.client.get(detail_url(cold))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_rollup_rebuild_reads_archive(self):
+        """Test that rebuilt rollups still count archived orders"""
+        self.place(self.products[0], 400)
+        self.place(self.products[1], 10)
+        rollups.rebuild()
+        before = list(models.PaymentModeSales.objects.order_by('day').values_list('day', 'orders'))
+        archive.archive(archive.cutoff(now = self.now))
+        rollups.rebuild()
+        after = list(models.PaymentModeSales.objects.order_by('day').values_list('day', 'orders'))
+        self.assertEqual(len(after), 2)
+        self.assertEqual(after, before)
@@ -0,0 +1,125 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import models, retention
+from order.tests.test_order_api import (ORDER_URL, sample_payment_mode,
+                                        sample_shipping_address, sample_user)
+from shopping.tests.test_shopping_api import (SESSION_SHOPPING_URL, SHOPPING_URL,
+                                              sample_category, sample_product)
+
+
+class IdempotencyTests(TestCase):
+    """Test create actions sent with an Idempotency-Key header"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = sample_user(is_staff = False)
+        self.client.force_authenticate(self.user)
+        address = sample_shipping_address(self.user).printable()
+        self.order = {
+            'shipping_address': address,
+            'billing_address': address,
+            'payment_mode': sample_payment_mode(self.user).id,
+        }
+        self.product = sample_product(self.user, sample_category(self.user))
+
+    def post(self, url, payload, key = 'retry-1', client = None):
+        return (client or self.client).post(url, payload, HTTP_IDEMPOTENCY_KEY = key)
+
+    def test_order_retry_replays_first_response(self):
+        """Test that a retried order is created once and gets the same answer"""
+        first = self.post(ORDER_URL, self.order)
+        retry = self.post(ORDER_URL, self.order)
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(models.Order.objects.count(), 1)
+
+    def test_replay_does_not_run_view(self):
+        """Test that a replay reads the stored response only"""
+        self.post(ORDER_URL, self.order)
+        with self.assertNumQueries(5):
+            self.post(ORDER_URL, self.order)
+
+    def test_key_reused_with_other_payload(self):
+        """Test that a key sent again with another payload is refused"""
+        self.post(ORDER_URL, self.order)
+        res = self.post(ORDER_URL, dict(self.order, billing_address = 'Elsewhere'))
+        self.assertEqual(res.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(models.Order.objects.count(), 1)
+
+    def test_duplicate_while_first_is_running(self):
+        """Test that a duplicate of a pending request gets a conflict"""
+        self.post(ORDER_URL, self.order)
+        models.IdempotencyKey.objects.update(status_code = None, response = '')
+        res = self.post(ORDER_URL, self.order)
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(models.Order.objects.count(), 1)
+
+    def test_abandoned_pending_key_is_claimed(self):
+        """Test that a key left pending by a dead request runs again"""
+        self.post(ORDER_URL, self.order)
+        models.IdempotencyKey.objects.update(
+            status_code = None, response = '', created_on = timezone.now() - timedelta(minutes = 5))
+        res = self.post(ORDER_URL, self.order)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('Idempotent-Replayed', res)
+        self.assertEqual(models.Order.objects.count(), 2)
+
+    def test_expired_key_runs_again(self):
+        """Test that a key past its expiry creates a new order"""
+        self.post(ORDER_URL, self.order)
+        models.IdempotencyKey.objects.update(expires_at = timezone.now() - timedelta(seconds = 1))
+        res = self.post(ORDER_URL, self.order)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(models.Order.objects.count(), 2)
+
+    def test_keys_are_scoped_to_user(self):
+        """Test that the same key of two users creates two orders"""
+        other = sample_user(email = 'other@example.com', is_staff = False)
+        client = APIClient()
+        client.force_authenticate(other)
+        self.post(ORDER_URL, self.order)
+        res = self.post(ORDER_URL, self.order, client = client)
+        self.assertNotIn('Idempotent-Replayed', res)
+        self.assertEqual(models.Order.objects.count(), 2)
+
+    def test_failed_validation_is_not_stored(self):
+        """Test that a request rejected by validation can be retried fixed"""
+        res = self.post(ORDER_URL, dict(self.order, payment_mode = 0))
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(models.IdempotencyKey.objects.exists())
+
+    def test_cart_retry_adds_once(self):
+        """Test that a retried add to cart does not add the count twice"""
+        payload = {'product': self.product.id, 'count': 3}
+        self.post(SHOPPING_URL, payload)
+        res = self.post(SHOPPING_URL, payload)
+        self.assertEqual(res.data['count'], 3)
+        self.assertEqual(models.ShoppingCart.objects.get(user = self.user).count, 3)
+
+    def test_session_cart_retry_adds_once(self):
+        """Test that a retried add to an anonymous cart adds once"""
+        client = APIClient()
+        payload = {'product': self.product.id, 'count': 2}
+        self.post(SESSION_SHOPPING_URL, payload, client = client)
+        res = self.post(SESSION_SHOPPING_URL, payload, client = client)
+        self.assertEqual(res.data['count'], 2)
+        self.assertEqual(models.SessionShoppingCart.objects.get().count, 2)
+
+    def test_purge_expired_keys(self):
+        """Test that the retention policy deletes expired keys only"""
+        self.post(ORDER_URL, self.order, key = 'old')
+        self.post(ORDER_URL, self.order, key = 'new')
+        models.IdempotencyKey.objects.filter(key = 'old').update(
+            expires_at = timezone.now() - timedelta(seconds = 1))
+        purger = retention.Purger(retention.POLICIES['idempotency_keys'], dict(
+            retention.DEFAULTS, ROWS_PER_SECOND = 0))
+        self.assertEqual(purger.run(), (1, True))
+        self.assertEqual(
+            list(models.IdempotencyKey.objects.values_list('key', flat = True)), ['new'])
@@ -0,0 +1,43 @@
+from django.db import connection
+from django.test import TestCase
+
+from core import models
+from core.db.advisor import QueryCapture, analyze
+
+
+class IndexAdvisorTest(TestCase):
+    """Test capturing and explaining queries"""
+
+    def capture(self, *querysets):
+        """Run the querysets under a capture and return the captured queries"""
+        capture = QueryCapture()
+        with connection.execute_wrapper(capture):
+            for queryset in querysets:
+                list(queryset)
+        return capture.queries
+
+    def test_capture_counts_repeated_statements(self):
+        """Test that repeated statements are captured once with a count"""
+        queries = self.capture(
+            models.ShoppingCart.objects.filter(user_id=1),
+            models.ShoppingCart.objects.filter(user_id=1),
+        )
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(list(queries.values())[0]['count'], 2)
+
+    def test_hot_filters_use_composite_indexes(self):
+        """Test that the hot filter paths are served by their indexes"""
+        queries = self.capture(
+            models.SessionShoppingCart.objects.filter(aUser='session').order_by('id'),
+            models.Product.objects.filter(category__in=[1, 2]).order_by('id'),
+        )
+        report = analyze(connection, queries, {'core_sessionshoppingcart', 'core_product'})
+        self.assertEqual(report['seq_scans'], {})
+        self.assertIn('core_scart_auser_id_idx', report['used']['core_sessionshoppingcart'])
+
+    def test_unindexed_filter_reports_seq_scan(self):
+        """Test that filtering on an unindexed column is reported"""
+        queries = self.capture(models.Product.objects.filter(title='Bread'))
+        report = analyze(connection, queries, {'core_product'})
+        self.assertIn('core_product', report['seq_scans'])
+        self.assertIn('core_product_cat_id_idx', report['unused']['core_product'])
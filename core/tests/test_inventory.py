@@ -0,0 +1,126 @@
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from core import inventory, models
+from shopping.tests.test_shopping_api import sample_category, sample_product
+
+
+class InventoryTests(TestCase):
+    """Test stock reservations"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('buyer@example.com', 'password')
+        category = sample_category(self.user)
+        self.bread = sample_product(self.user, category, quantity = 5)
+        self.mango = sample_product(self.user, category, title = 'Mango', quantity = 2)
+
+    def quantities(self):
+        return list(models.Product.objects.order_by('id').values_list('quantity', flat = True))
+
+    def test_reserve_takes_stock_of_all_lines(self):
+        """Test that a reservation takes every line from stock in one update"""
+        with self.assertNumQueries(6):
+            reservation = inventory.reserve(self.user, {self.mango.id: 2, self.bread.id: 3})
+        self.assertEqual(self.quantities(), [2, 0])
+        self.assertEqual(reservation.status, models.Reservation.HELD)
+        self.assertEqual(
+            dict(reservation.lines.values_list('product_id', 'count')),
+            {self.bread.id: 3, self.mango.id: 2})
+
+    def test_reserve_out_of_stock_takes_nothing(self):
+        """Test that one short line leaves the stock of every line untouched"""
+        with self.assertRaises(inventory.OutOfStock) as raised:
+            inventory.reserve(self.user, {self.bread.id: 3, self.mango.id: 3})
+        self.assertEqual(raised.exception.products, [self.mango.id])
+        self.assertEqual(self.quantities(), [5, 2])
+        self.assertFalse(models.Reservation.objects.exists())
+
+    def test_release_restocks_once(self):
+        """Test that releasing puts the units back only once"""
+        reservation = inventory.reserve(self.user, {self.bread.id: 4})
+        self.assertTrue(inventory.release(reservation))
+        self.assertFalse(inventory.release(reservation))
+        self.assertEqual(self.quantities(), [5, 2])
+        self.assertEqual(reservation.status, models.Reservation.RELEASED)
+
+    def test_release_expired_reservations(self):
+        """Test that the sweeper releases only expired holds"""
+        expired = inventory.reserve(self.user, {self.bread.id: 1}, hold_seconds = 0)
+        held = inventory.reserve(self.user, {self.mango.id: 1})
+        out = StringIO()
+        call_command('release_reservations', stdout = out)
+        self.assertIn('Released 1 reservations', out.getvalue())
+        expired.refresh_from_db()
+        held.refresh_from_db()
+        self.assertEqual(expired.status, models.Reservation.RELEASED)
+        self.assertEqual(held.status, models.Reservation.HELD)
+        self.assertEqual(self.quantities(), [5, 1])
+
+    def test_commit_released_reservation_fails(self):
+        """Test that a swept reservation cannot be committed"""
+        reservation = inventory.reserve(self.user, {self.bread.id: 1})
+        models.Reservation.objects.filter(id = reservation.id).update(
+            expires_at = timezone.now() - timedelta(seconds = 1))
+        inventory.release_expired()
+        with self.assertRaises(inventory.ReservationExpired):
+            inventory.commit(reservation, None)
+
+
+class InventoryStressTests(TransactionTestCase):
+    """Run many parallel checkouts against a small stock"""
+
+    BUYERS = 12
+    STOCK = 5
+
+    def checkout(self, user, lines, results):
+        for _ in range(200):
+            try:
+                results.append(inventory.reserve(user, lines))
+                break
+            except inventory.OutOfStock:
+                results.append(None)
+                break
+            except OperationalError as exc:
+                # SQLite locks the database instead of waiting for writers.
+                if 'locked' not in str(exc):
+                    raise
+                time.sleep(0.005)
+        connection.close()
+
+    def test_parallel_checkouts_never_oversell(self):
+        """Test that parallel checkouts sell exactly the stock"""
+        user = get_user_model().objects.create_user('buyer@example.com', 'password')
+        category = sample_category(user)
+        bread = sample_product(user, category, quantity = self.STOCK)
+        mango = sample_product(user, category, title = 'Mango', quantity = self.STOCK * 2)
+
+        results = []
+        threads = [
+            threading.Thread(target = self.checkout, args = (
+                user,
+                # Lines in both orders, the update locks them by product id.
+                {bread.id: 1, mango.id: 2} if index % 2 else {mango.id: 2, bread.id: 1},
+                results,
+            ))
+            for index in range(self.BUYERS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        sold = [reservation for reservation in results if reservation is not None]
+        self.assertEqual(len(results), self.BUYERS)
+        self.assertEqual(len(sold), self.STOCK)
+        bread.refresh_from_db()
+        mango.refresh_from_db()
+        self.assertEqual((bread.quantity, mango.quantity), (0, 0))
+        self.assertEqual(models.ReservationLine.objects.count(), 2 * self.STOCK)
@@ -0,0 +1,112 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from core import jobs, models
+
+OPTIONS = dict(jobs.DEFAULTS, BACKOFF_SECONDS = 10, MAX_BACKOFF_SECONDS = 30)
+
+calls = []
+
+
+@jobs.task('tests.record')
+def record(value):
+    calls.append(value)
+
+
+@jobs.task('tests.fail')
+def fail():
+    raise RuntimeError('boom')
+
+
+class JobTests(TestCase):
+    """Test the database job queue"""
+
+    def setUp(self):
+        calls.clear()
+
+    def work(self):
+        return jobs.Worker(threads = 1, options = OPTIONS, name = 'test').run(once = True)
+
+    def test_worker_runs_due_jobs_by_priority(self):
+        """Test that due jobs run once, highest priority first"""
+        jobs.enqueue('tests.record', value = 'low')
+        jobs.enqueue('tests.record', priority = 5, value = 'high')
+        self.assertEqual(self.work(), 2)
+        self.assertEqual(calls, ['high', 'low'])
+        self.assertEqual(
+            set(models.Job.objects.values_list('status', flat = True)), {models.Job.DONE})
+        self.assertEqual(self.work(), 0)
+
+    def test_scheduled_job_waits(self):
+        """Test that a job scheduled later is not run before its time"""
+        job = jobs.enqueue('tests.record', delay = 60, value = 'later')
+        self.assertEqual(self.work(), 0)
+        models.Job.objects.filter(id = job.id).update(run_at = timezone.now())
+        self.assertEqual(self.work(), 1)
+        self.assertEqual(calls, ['later'])
+
+    def test_claim_takes_each_job_once(self):
+        """Test that a claimed job is not handed to another worker"""
+        jobs.enqueue('tests.record', value = 1)
+        first = jobs.claim('one')
+        self.assertEqual(len(first), 1)
+        self.assertEqual(jobs.claim('two'), [])
+        job = models.Job.objects.get()
+        self.assertEqual((job.status, job.locked_by, job.attempts), (models.Job.RUNNING, 'one', 1))
+
+    def test_failed_job_is_retried_with_backoff(self):
+        """Test that failures are retried later, then given up"""
+        job = jobs.enqueue('tests.fail', max_attempts = 3)
+        delays = []
+        for attempt in range(3):
+            models.Job.objects.filter(id = job.id).update(run_at = timezone.now())
+            started = timezone.now()
+            with self.assertLogs('core.jobs', 'WARNING'):
+                self.work()
+            job.refresh_from_db()
+            delays.append(round((job.run_at - started).total_seconds()))
+        self.assertEqual(job.status, models.Job.FAILED)
+        self.assertEqual(job.attempts, 3)
+        self.assertIn('RuntimeError: boom', job.last_error)
+        self.assertEqual(delays[:2], [10, 20])
+
+    def test_unknown_task_fails_at_once(self):
+        """Test that a job of an unregistered task is not retried"""
+        job = jobs.enqueue('tests.missing')
+        with self.assertLogs('core.jobs', 'WARNING') as logs:
+            self.work()
+        self.assertIn('tests.missing failed on attempt 1, now failed', logs.output[0])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (models.Job.FAILED, 1))
+
+    def test_stale_running_job_is_queued_again(self):
+        """Test that a job left running by a dead worker runs again"""
+        jobs.enqueue('tests.record', value = 'again')
+        jobs.claim('dead')
+        models.Job.objects.update(locked_at = timezone.now() - timedelta(hours = 1))
+        self.assertEqual(self.work(), 1)
+        self.assertEqual(calls, ['again'])
+
+    def test_stale_job_out_of_attempts_fails(self):
+        """Test that a stale job which ran max_attempts times is failed, not queued"""
+        jobs.enqueue('tests.record', max_attempts = 1, value = 'lost')
+        jobs.claim('dead')
+        models.Job.objects.update(locked_at = timezone.now() - timedelta(hours = 1))
+        self.assertEqual(jobs.requeue_stale(), 0)
+        job = models.Job.objects.get()
+        self.assertEqual(job.status, models.Job.FAILED)
+        self.assertIsNotNone(job.finished_on)
+        self.assertEqual(self.work(), 0)
+        self.assertEqual(calls, [])
+
+    def test_worker_command(self):
+        """Test that the worker command drains the queue with --once"""
+        jobs.enqueue('tests.record', value = 'command')
+        out = StringIO()
+        call_command('worker', '--once', '--threads', '1', stdout = out)
+        self.assertIn('Ran 1 jobs', out.getvalue())
+        self.assertEqual(calls, ['command'])
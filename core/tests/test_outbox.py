@@ -0,0 +1,167 @@
+import json
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from core import models, outbox
+from order.tests.test_order_api import (ORDER_URL, sample_payment_mode,
+                                        sample_shipping_address, sample_shopping_item)
+from product.tests.test_product_api import PRODUCT_URL, detail_url
+from shopping.tests.test_shopping_api import sample_category, sample_product, sample_user
+
+received = []
+
+
+def collect(messages):
+    received.extend(messages)
+
+
+class FlakySink:
+    """Sink failing for the events of one aggregate"""
+
+    def __init__(self, failing):
+        self.failing = failing
+        self.messages = []
+
+    def send(self, messages):
+        if any(item['aggregate_id'] == self.failing for item in messages):
+            raise ConnectionError('sink down')
+        self.messages.extend(messages)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Local stand-in of a downstream HTTP endpoint"""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.batches.append(json.loads(body))
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class OutboxTests(TestCase):
+    """Test the transactional outbox and its relay"""
+
+    def setUp(self):
+        received.clear()
+        self.user = sample_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.category = sample_category(self.user)
+
+    def events(self):
+        return list(models.OutboxEvent.objects.order_by('id').values_list('event_type', 'aggregate_id'))
+
+    def test_catalog_changes_publish_events(self):
+        """Test that product writes through the api publish events"""
+        res = self.client.post(PRODUCT_URL, {
+            'category': self.category.id, 'title': 'Mango', 'desc': 'Mango',
+            'price': 40, 'quantity': 3, 'unit': models.Product.UNIT,
+        })
+        product_id = str(res.data['id'])
+        self.client.patch(detail_url(product_id), {'price': 45})
+        self.client.delete(detail_url(product_id))
+        self.assertEqual(self.events(), [
+            ('product.created', product_id),
+            ('product.updated', product_id),
+            ('product.deleted', product_id),
+        ])
+        updated = models.OutboxEvent.objects.get(event_type = 'product.updated')
+        self.assertEqual(json.loads(updated.payload)['price'], 45)
+
+    def test_placed_order_publishes_event(self):
+        """Test that checkout writes the order event with its lines"""
+        product = sample_product(self.user, self.category, quantity = 5)
+        item = sample_shopping_item(self.user, product)
+        address = sample_shipping_address(self.user).printable()
+        res = self.client.post(ORDER_URL, {
+            'cartItems': [item.id], 'shipping_address': address,
+            'billing_address': address, 'payment_mode': sample_payment_mode(self.user).id,
+        })
+        event = models.OutboxEvent.objects.get(event_type = 'order.placed')
+        payload = json.loads(event.payload)
+        self.assertEqual(payload['id'], res.data['id'])
+        self.assertEqual(payload['lines'], [{'product': product.id, 'count': 2, 'unit_price': 23.0}])
+
+    def test_rolled_back_change_leaves_no_event(self):
+        """Test that an event is written only if its change commits"""
+        try:
+            with transaction.atomic():
+                outbox.publish('product', 1, 'updated', {})
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertFalse(models.OutboxEvent.objects.exists())
+
+    def test_relay_delivers_in_order_once(self):
+        """Test that the relay sends pending events in order and marks them"""
+        for index in range(5):
+            outbox.publish('product', index % 2, 'updated', {'index': index})
+        relay = outbox.Relay(sinks = [outbox.CallbackSink(collect)])
+        self.assertEqual(relay.drain(batch_size = 2), 5)
+        self.assertEqual([item['payload']['index'] for item in received], [0, 1, 2, 3, 4])
+        self.assertEqual(relay.drain(), 0)
+        self.assertFalse(models.OutboxEvent.objects.filter(delivered_on__isnull = True).exists())
+
+    def test_failing_aggregate_is_held_back(self):
+        """Test that events after a failure of their aggregate wait, others go on"""
+        for aggregate in ['1', '2', '1', '2']:
+            outbox.publish('order', aggregate, 'updated', {})
+        sink = FlakySink(failing = '1')
+        with self.assertLogs('core.outbox', 'WARNING'):
+            self.assertEqual(outbox.Relay(sinks = [sink]).drain(batch_size = 3), 2)
+        self.assertEqual([item['aggregate_id'] for item in sink.messages], ['2', '2'])
+        failed = models.OutboxEvent.objects.filter(delivered_on__isnull = True).order_by('id')
+        self.assertEqual(len(failed), 2)
+        self.assertEqual(failed[0].attempts, 1)
+        self.assertEqual(failed[1].attempts, 0)
+
+        sink.failing = None
+        self.assertEqual(outbox.Relay(sinks = [sink]).drain(), 2)
+        self.assertEqual([item['aggregate_id'] for item in sink.messages], ['2', '2', '1', '1'])
+
+    def test_file_sink(self):
+        """Test that the file sink appends JSON lines"""
+        outbox.publish('offer', 7, 'created', {'title': 'Summer'})
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'events.jsonl')
+            outbox.Relay(sinks = [outbox.FileSink(path)]).drain()
+            with open(path) as events:
+                lines = [json.loads(line) for line in events]
+        self.assertEqual(len(lines), 1)
+        self.assertEqual((lines[0]['type'], lines[0]['payload']), ('offer.created', {'title': 'Summer'}))
+
+    def test_http_sink(self):
+        """Test that the http sink posts batches to a local endpoint"""
+        server = HTTPServer(('127.0.0.1', 0), StandInHandler)
+        server.batches = []
+        thread = threading.Thread(target = server.serve_forever, daemon = True)
+        thread.start()
+        try:
+            outbox.publish('product', 3, 'deleted', {'id': 3})
+            url = f'http://127.0.0.1:{server.server_port}/events'
+            self.assertEqual(outbox.Relay(sinks = [outbox.HttpSink(url)]).drain(), 1)
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(server.batches[0]['events'][0]['type'], 'product.deleted')
+
+    def test_relay_command(self):
+        """Test the relay command with sinks from the settings"""
+        outbox.publish('product', 1, 'created', {})
+        sinks = [{'BACKEND': 'callback', 'CALLBACK': 'core.tests.test_outbox.collect'}]
+        out = StringIO()
+        with override_settings(OUTBOX = {'SINKS': sinks}):
+            call_command('relay_outbox', stdout = out)
+        self.assertIn('Delivered 1 events', out.getvalue())
+        self.assertEqual(len(received), 1)
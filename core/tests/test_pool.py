@@ -0,0 +1,74 @@
+import sqlite3
+import threading
+import time
+
+from django.test import SimpleTestCase
+
+from core.db.pool import ConnectionPool, PoolTimeout
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    """Test the per-worker connection pool"""
+
+    def setUp(self):
+        self.opened = []
+
+    def connect(self):
+        """Open a new SQLite connection and remember it"""
+        conn = sqlite3.connect(':memory:', check_same_thread=False)
+        self.opened.append(conn)
+        return conn
+
+    def test_connections_are_reused(self):
+        """Test that a returned connection is handed out again"""
+        pool = ConnectionPool(size=2)
+        conn = pool.checkout(self.connect)
+        pool.checkin(conn)
+        self.assertIs(pool.checkout(self.connect), conn)
+        stats = pool.stats.snapshot()
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['reuses'], 1)
+        self.assertEqual(stats['reuse_rate'], 0.5)
+
+    def test_broken_connection_fails_health_check(self):
+        """Test that a connection failing the ping is replaced"""
+        pool = ConnectionPool(size=2)
+        conn = pool.checkout(self.connect)
+        pool.checkin(conn)
+        conn.close()
+        self.assertIsNot(pool.checkout(self.connect), conn)
+        self.assertEqual(pool.stats.snapshot()['failed_checks'], 1)
+
+    def test_old_connections_are_recycled(self):
+        """Test that connections past their lifetime are closed"""
+        pool = ConnectionPool(size=2, max_lifetime=0.01)
+        conn = pool.checkout(self.connect)
+        time.sleep(0.02)
+        pool.checkin(conn)
+        self.assertIsNot(pool.checkout(self.connect), conn)
+        self.assertEqual(pool.stats.snapshot()['recycled'], 1)
+
+    def test_failed_reset_discards_connection(self):
+        """Test that a connection that cannot be reset is not pooled"""
+        def reset(conn):
+            raise ValueError('broken')
+
+        pool = ConnectionPool(size=2, reset=reset)
+        conn = pool.checkout(self.connect)
+        pool.checkin(conn)
+        self.assertIsNot(pool.checkout(self.connect), conn)
+
+    def test_checkout_waits_for_free_slot(self):
+        """Test that checkouts beyond the pool size wait for a checkin"""
+        pool = ConnectionPool(size=1, timeout=2)
+        conn = pool.checkout(self.connect)
+        threading.Timer(0.05, pool.checkin, args=(conn,)).start()
+        self.assertIs(pool.checkout(self.connect), conn)
+        self.assertGreater(pool.stats.snapshot()['wait_max_ms'], 0)
+
+    def test_checkout_times_out(self):
+        """Test that an exhausted pool raises after the timeout"""
+        pool = ConnectionPool(size=1, timeout=0.01)
+        pool.checkout(self.connect)
+        with self.assertRaises(PoolTimeout):
+            pool.checkout(self.connect)
@@ -0,0 +1,81 @@
+import json
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core import profiling
+
+PAYMENT_MODE_URL = reverse('order:paymentmode-list')
+
+
+class RequestProfilerTest(TestCase):
+    """Test profiling of requests on demand"""
+
+    def setUp(self):
+        self.store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.store_dir)
+        override = override_settings(PROFILER={'STORE_DIR': self.store_dir, 'MAX_PROFILES': 2})
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.staff = get_user_model().objects.create_user(
+            email='staff@gmail.com', password='testpassword', is_staff=True)
+        self.user = get_user_model().objects.create_user(
+            email='user@gmail.com', password='testpassword')
+        self.client = APIClient()
+
+    def authenticate(self, user):
+        token = Token.objects.create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def store(self):
+        return profiling.ProfileStore(self.store_dir, 2)
+
+    def test_staff_gets_text_report(self):
+        """Test that a staff user receives a cProfile report"""
+        self.authenticate(self.staff)
+        res = self.client.get(PAYMENT_MODE_URL, {'_profile': '1'})
+        self.assertEqual(res['Content-Type'], 'text/plain')
+        self.assertEqual(res['X-Profiled-Status'], '200')
+        self.assertIn('function calls', res.content.decode())
+        self.assertEqual([meta['id'] for meta in self.store().list()], [res['X-Profile-Id']])
+
+    def test_callgraph_json_report(self):
+        """Test the call graph report requested through the header"""
+        self.authenticate(self.staff)
+        res = self.client.get(PAYMENT_MODE_URL, HTTP_X_PROFILE='json')
+        graph = json.loads(res.content)
+        self.assertTrue(graph['nodes'])
+        self.assertTrue(graph['edges'])
+
+    def test_collapsed_stack_report(self):
+        """Test the sampled collapsed-stack report"""
+        self.authenticate(self.staff)
+        res = self.client.get(PAYMENT_MODE_URL, {'_profile': 'collapsed'})
+        self.assertEqual(res['Content-Type'], 'text/plain')
+        for line in res.content.decode().splitlines():
+            _, count = line.rsplit(' ', 1)
+            self.assertTrue(int(count) > 0)
+
+    def test_non_staff_is_not_profiled(self):
+        """Test that the flag is ignored for normal users"""
+        self.authenticate(self.user)
+        res = self.client.get(PAYMENT_MODE_URL, {'_profile': '1'})
+        self.assertNotIn('X-Profile-Id', res)
+        self.assertEqual(self.store().list(), [])
+
+    def test_store_is_bounded_and_comparable(self):
+        """Test that old profiles are pruned and stats can be compared"""
+        self.authenticate(self.staff)
+        ids = [self.client.get(PAYMENT_MODE_URL, {'_profile': 'text'})['X-Profile-Id']
+               for _ in range(3)]
+        self.assertEqual([meta['id'] for meta in self.store().list()], ids[1:])
+
+        before, after = (self.store().load_stats(profile_id) for profile_id in ids[1:])
+        rows = profiling.compare(before, after, limit=5)
+        self.assertEqual(len(rows), 5)
@@ -0,0 +1,162 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core import models, retention
+from shopping.tests.test_shopping_api import sample_category, sample_product
+
+ME_URL = reverse('user:me')
+
+OPTIONS = {
+    'SESSION_CART_DAYS': 30,
+    'TOKEN_DAYS': 90,
+    'BATCH_SIZE': 2,
+    'ROWS_PER_SECOND': 0,
+}
+
+
+class RetentionTests(TestCase):
+    """Test the retention policies and the batched purger"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('staff@example.com', 'password')
+        category = sample_category(self.user)
+        self.products = [
+            sample_product(self.user, category, title = f'Product {index}')
+            for index in range(6)
+        ]
+        self.now = timezone.now()
+
+    def session_carts(self, stale, fresh):
+        """Create stale and fresh session cart rows, returning the fresh ones"""
+        rows = [
+            models.SessionShoppingCart.objects.create(
+                aUser = f'session {index}', product = product, count = 1)
+            for index, product in enumerate(self.products[:stale + fresh])
+        ]
+        models.SessionShoppingCart.objects.filter(
+            id__in = [row.id for row in rows[:stale]]
+        ).update(updated_on = self.now - timedelta(days = 31))
+        return rows[stale:]
+
+    def purger(self, name, **options):
+        sleeps = []
+        purger = retention.Purger(
+            retention.POLICIES[name], dict(OPTIONS, **options), sleep = sleeps.append)
+        return purger, sleeps
+
+    def test_session_cart_timestamp_follows_writes(self):
+        """Test that adding to a session cart refreshes updated_on"""
+        row = models.SessionShoppingCart.objects.add_item('session', self.products[0], 1)
+        models.SessionShoppingCart.objects.filter(id = row.id).update(
+            updated_on = self.now - timedelta(days = 31))
+        models.SessionShoppingCart.objects.add_item('session', self.products[0], 1)
+        row = models.SessionShoppingCart.objects.get(id = row.id)
+        self.assertEqual(row.count, 2)
+        self.assertGreaterEqual(row.updated_on, self.now)
+
+    def test_purge_deletes_stale_session_carts(self):
+        """Test that only rows past the retention are deleted, in batches"""
+        fresh = self.session_carts(stale = 5, fresh = 1)
+        purger, sleeps = self.purger('session_carts')
+        self.assertEqual(purger.count(), 5)
+
+        deleted, finished = purger.run()
+        self.assertEqual((deleted, finished), (5, True))
+        self.assertEqual(list(models.SessionShoppingCart.objects.all()), fresh)
+        self.assertFalse(models.PurgeCheckpoint.objects.exists())
+
+    def test_purge_resumes_from_checkpoint(self):
+        """Test that a stopped run resumes after its last deleted key"""
+        self.session_carts(stale = 5, fresh = 0)
+        purger, sleeps = self.purger('session_carts')
+
+        self.assertEqual(purger.run(max_batches = 2), (4, False))
+        checkpoint = models.PurgeCheckpoint.objects.get(policy = 'session_carts')
+        self.assertEqual(checkpoint.deleted, 4)
+
+        self.assertEqual(purger.run(), (1, True))
+        self.assertFalse(models.SessionShoppingCart.objects.exists())
+        self.assertFalse(models.PurgeCheckpoint.objects.exists())
+
+    def test_purge_rechecks_rows_touched_during_run(self):
+        """Test that a row written to since the checkpoint cutoff is kept"""
+        self.session_carts(stale = 3, fresh = 0)
+        purger, sleeps = self.purger('session_carts', BATCH_SIZE = 1)
+        purger.run(max_batches = 1)
+        touched = models.SessionShoppingCart.objects.order_by('id').last()
+        models.SessionShoppingCart.objects.add_item(touched.aUser, touched.product, 1)
+
+        self.assertEqual(purger.run(), (1, True))
+        self.assertEqual(list(models.SessionShoppingCart.objects.all()), [touched])
+
+    def test_purge_throttles_batches(self):
+        """Test that batches sleep to stay under the target rate"""
+        self.session_carts(stale = 4, fresh = 0)
+        purger, sleeps = self.purger('session_carts', ROWS_PER_SECOND = 1)
+        purger.run()
+        self.assertEqual(len(sleeps), 2)
+        self.assertTrue(all(0 < delay <= 2 for delay in sleeps))
+
+    def test_purge_expired_sessions(self):
+        """Test that expired sessions are deleted"""
+        Session.objects.create(
+            session_key = 'expired', session_data = '', expire_date = self.now - timedelta(days = 1))
+        Session.objects.create(
+            session_key = 'live', session_data = '', expire_date = self.now + timedelta(days = 1))
+        purger, sleeps = self.purger('sessions')
+        self.assertEqual(purger.run(), (1, True))
+        self.assertEqual(list(Session.objects.values_list('session_key', flat = True)), ['live'])
+
+    def test_purge_unused_tokens(self):
+        """Test that tokens not used for TOKEN_DAYS are deleted, whatever the last login"""
+        active = get_user_model().objects.create_user('active@example.com', 'password')
+        fresh = get_user_model().objects.create_user('fresh@example.com', 'password')
+        self.user.last_login = self.now
+        self.user.save()
+        Token.objects.create(user = self.user)
+        models.TokenUsage.objects.create(
+            token = self.user.auth_token, last_used = self.now - timedelta(days = 91))
+        kept = Token.objects.create(user = active)
+        models.TokenUsage.objects.create(token = kept, last_used = self.now - timedelta(days = 1))
+        unused = Token.objects.create(user = fresh)
+
+        purger, sleeps = self.purger('tokens')
+        self.assertEqual(purger.run(), (1, True))
+        self.assertEqual(set(Token.objects.all()), {kept, unused})
+
+    def test_token_authentication_touches_last_use(self):
+        """Test that authenticating with a token records its use, once per interval"""
+        token = Token.objects.create(user = self.user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION = f'Token {token.key}')
+        with self.settings(RETENTION = {'TOKEN_TOUCH_SECONDS': 60}):
+            cache.delete(f'token-used:{token.key}')
+            self.assertEqual(client.get(ME_URL).status_code, status.HTTP_200_OK)
+            first = models.TokenUsage.objects.get(token = token).last_used
+            self.assertGreaterEqual(first, self.now)
+            client.get(ME_URL)
+            self.assertEqual(models.TokenUsage.objects.get(token = token).last_used, first)
+        cache.delete(f'token-used:{token.key}')
+
+    def test_purge_command(self):
+        """Test the purge command output and dry run"""
+        self.session_carts(stale = 2, fresh = 1)
+        out = StringIO()
+        call_command('purge', 'session_carts', '--dry-run', stdout = out)
+        self.assertIn('session_carts: 2 rows to delete', out.getvalue())
+
+        out = StringIO()
+        call_command('purge', 'session_carts', '--rows-per-second', '0', stdout = out)
+        self.assertIn('session_carts: deleted 2 rows, done', out.getvalue())
+        self.assertEqual(models.SessionShoppingCart.objects.count(), 1)
@@ -0,0 +1,142 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import models
+from order.tests.test_order_api import (ORDER_URL, detail_url, sample_category,
+                                        sample_payment_mode, sample_product,
+                                        sample_shipping_address, sample_shopping_item,
+                                        sample_user)
+
+CATEGORIES_URL = reverse('order:report-categories')
+PAYMENT_MODES_URL = reverse('order:report-payment-modes')
+
+
+class RollupTests(TestCase):
+    """Test the daily sales rollups and the reports read from them"""
+
+    def setUp(self):
+        self.user = sample_user(is_staff = False)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.bread = sample_category(self.user)
+        self.fruit = sample_category(self.user, name = 'Fruit')
+        self.loaf = sample_product(self.user, self.bread, price = 20, quantity = 50)
+        self.rye = sample_product(self.user, self.bread, title = 'Rye', price = 20, quantity = 50)
+        self.mango = sample_product(self.user, self.fruit, title = 'Mango', price = 30, quantity = 50)
+        self.upi = sample_payment_mode(self.user)
+        self.card = sample_payment_mode(self.user, title = 'Card', charges = 5)
+        self.address = sample_shipping_address(self.user).printable()
+        self.today = timezone.localdate()
+
+    def order(self, items, payment_mode):
+        res = self.client.post(ORDER_URL, {
+            'cartItems': [item.id for item in items],
+            'shipping_address': self.address,
+            'billing_address': self.address,
+            'payment_mode': payment_mode.id,
+        })
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        return res.data['id']
+
+    def category_rows(self):
+        return list(models.CategorySales.objects.order_by('day', 'category_id').values_list(
+            'day', 'category_id', 'orders', 'units', 'revenue'))
+
+    def payment_rows(self):
+        return list(models.PaymentModeSales.objects.order_by('day', 'payment_mode_id').values_list(
+            'day', 'payment_mode_id', 'orders', 'revenue'))
+
+    def place_orders(self):
+        first = self.order([
+            sample_shopping_item(self.user, self.loaf, count = 2),
+            sample_shopping_item(self.user, self.mango, count = 1),
+        ], self.upi)
+        second = self.order([sample_shopping_item(self.user, self.rye, count = 3)], self.upi)
+        return first, second
+
+    def test_checkout_adds_orders_to_rollups(self):
+        """Test that placed orders are added to the day of their category and payment mode"""
+        self.place_orders()
+        self.assertEqual(self.category_rows(), [
+            (self.today, self.bread.id, 2, 5, 100.0),
+            (self.today, self.fruit.id, 1, 1, 30.0),
+        ])
+        grand_totals = sum(models.PriceDetail.objects.values_list('grand_total', flat = True))
+        self.assertEqual(self.payment_rows(), [(self.today, self.upi.id, 2, grand_totals)])
+
+    def test_order_update_moves_its_totals(self):
+        """Test that an updated order takes its old totals out of the rollups"""
+        first, second = self.place_orders()
+        res = self.client.patch(detail_url(second), {'payment_mode': self.card.id})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        upi_total = models.PriceDetail.objects.get(order_id = first).grand_total
+        card_total = models.PriceDetail.objects.get(order_id = second).grand_total
+        self.assertEqual(self.payment_rows(), [
+            (self.today, self.upi.id, 1, upi_total),
+            (self.today, self.card.id, 1, card_total),
+        ])
+        self.assertEqual(self.category_rows()[0], (self.today, self.bread.id, 2, 5, 100.0))
+
+    def test_rebuild_matches_incremental_rollups(self):
+        """Test that a rebuild from the orders gives the same rows"""
+        self.place_orders()
+        categories, payment_modes = self.category_rows(), self.payment_rows()
+        models.CategorySales.objects.update(units = 0)
+        models.PaymentModeSales.objects.all().delete()
+
+        out = StringIO()
+        call_command('rebuild_rollups', stdout = out)
+        self.assertIn('Rebuilt 2 category rows and 1 payment mode rows', out.getvalue())
+        self.assertEqual(self.category_rows(), categories)
+        self.assertEqual(self.payment_rows(), payment_modes)
+
+    def test_rebuild_since_keeps_older_days(self):
+        """Test that a rebuild from a day leaves the days before it alone"""
+        self.place_orders()
+        old = models.CategorySales.objects.create(
+            day = self.today - timedelta(days = 10), category_id = self.bread.id, orders = 7)
+        call_command('rebuild_rollups', '--since', str(self.today), stdout = StringIO())
+        self.assertTrue(models.CategorySales.objects.filter(id = old.id).exists())
+        self.assertEqual(models.CategorySales.objects.filter(day = self.today).count(), 2)
+
+    def test_category_report(self):
+        """Test that staff read the category report from the rollups only"""
+        self.place_orders()
+        staff = sample_user(email = 'staff@example.com')
+        self.client.force_authenticate(staff)
+        with self.assertNumQueries(2):
+            res = self.client.get(CATEGORIES_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(row['name'], row['units'], row['revenue']) for row in res.data['rows']],
+            [('Bread', 5, 100.0), ('Fruit', 1, 30.0)])
+        self.assertEqual(res.data['rows'][0]['day'], self.today)
+
+    def test_payment_mode_report_totals(self):
+        """Test that by=total sums the days of the range"""
+        self.place_orders()
+        models.PaymentModeSales.objects.create(
+            day = self.today - timedelta(days = 3), payment_mode_id = self.upi.id,
+            orders = 1, revenue = 10)
+        self.client.force_authenticate(sample_user(email = 'staff@example.com'))
+        res = self.client.get(PAYMENT_MODES_URL, {'by': 'total'})
+        self.assertEqual(len(res.data['rows']), 1)
+        self.assertEqual(res.data['rows'][0]['orders'], 3)
+        self.assertEqual(res.data['rows'][0]['name'], 'UPI Mode')
+
+    def test_report_requires_staff_and_dates(self):
+        """Test that reports are staff only and check their range"""
+        res = self.client.get(CATEGORIES_URL)
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(sample_user(email = 'staff@example.com'))
+        res = self.client.get(CATEGORIES_URL, {'from': '2024-02-30'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.client.get(CATEGORIES_URL, {'from': '2024-03-02', 'to': '2024-03-01'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,174 @@
+import os
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connections
+from django.test import RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core import models, routers
+from core.routers import ReplicaRouter, ReplicaSelector
+
+PRODUCT_URL = reverse('product:product-list')
+SHOPPING_URL = reverse('shopping:shopping-list')
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0', 'replica_1'])
+class ReplicaRouterTest(SimpleTestCase):
+    """Test routing decisions of the replica router"""
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        routers.end_request()
+
+    def route(self, request, replica_reads=True):
+        """Return the alias a read of Product would use for the request"""
+        routers.start_request(request)
+        routers.enable_replica_reads(replica_reads)
+        return self.router.db_for_read(models.Product)
+
+    def test_reads_outside_requests_use_primary(self):
+        """Test that reads without a request go to the primary"""
+        self.assertIsNone(self.router.db_for_read(models.Product))
+
+    def test_safe_reads_use_replicas_round_robin(self):
+        """Test that safe reads of enabled views rotate over replicas"""
+        request = self.factory.get('/')
+        aliases = {self.route(request) for _ in range(4)}
+        self.assertEqual(aliases, {'replica_0', 'replica_1'})
+
+    def test_views_without_replica_reads_use_primary(self):
+        """Test that only views opting in read from replicas"""
+        request = self.factory.get('/')
+        self.assertIsNone(self.route(request, replica_reads=False))
+
+    def test_unsafe_requests_use_primary(self):
+        """Test that reads inside a write request go to the primary"""
+        request = self.factory.post('/')
+        self.assertIsNone(self.route(request))
+
+    def test_pin_cookie_uses_primary(self):
+        """Test that a recent writer reads from the primary"""
+        request = self.factory.get('/')
+        request.COOKIES[routers.PIN_COOKIE] = '1'
+        self.assertIsNone(self.route(request))
+
+    def test_authentication_reads_use_primary(self):
+        """Test that tokens, sessions and users are read from the primary"""
+        request = self.factory.get('/')
+        routers.start_request(request)
+        routers.enable_replica_reads(True)
+        for model in (Token, models.TokenUsage, Session, get_user_model()):
+            self.assertIsNone(self.router.db_for_read(model), model)
+        self.assertIsNotNone(self.router.db_for_read(models.Product))
+
+    def test_local_cache_warning(self):
+        """Test that replicas over a process-local cache are reported"""
+        self.assertEqual([error.id for error in routers.check_pin_cache(None)], ['core.W001'])
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.memcached.PyLibMCCache'}}
+        with self.settings(CACHES = shared):
+            self.assertEqual(routers.check_pin_cache(None), [])
+
+    def test_writes_use_primary(self):
+        """Test that writes always go to the primary"""
+        self.assertIsNone(self.router.db_for_write(models.Product))
+
+
+class ReplicaSelectorTest(SimpleTestCase):
+    """Test replica selection strategies"""
+
+    def test_least_latency_prefers_fastest_replica(self):
+        """Test that the replica with the lowest latency is chosen"""
+        selector = ReplicaSelector()
+        selector.record_latency('replica_0', 0.05)
+        selector.record_latency('replica_1', 0.01)
+        self.assertEqual(
+            selector.choose(['replica_0', 'replica_1'], 'least_latency'),
+            'replica_1'
+        )
+
+    def test_least_latency_tries_unmeasured_replicas(self):
+        """Test that replicas without samples are tried first"""
+        selector = ReplicaSelector()
+        selector.record_latency('replica_0', 0.01)
+        self.assertEqual(
+            selector.choose(['replica_0', 'replica_1'], 'least_latency'),
+            'replica_1'
+        )
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingApiTest(TransactionTestCase):
+    """Test routing through the API with two SQLite databases"""
+
+    databases = {'default', 'replica'}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.replica_file = tempfile.NamedTemporaryFile(suffix='.sqlite3', delete=False)
+        cls.replica_file.close()
+        connections.databases['replica'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': cls.replica_file.name,
+            'TEST': {'NAME': cls.replica_file.name},
+        }
+        call_command('migrate', database='replica', verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections.databases['replica']
+        del connections._connections.replica
+        os.remove(cls.replica_file.name)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='test_user@gmail.com', password='testpassword')
+        self.user.save(using='replica')
+        self.client.force_authenticate(self.user)
+
+        for alias, title in (('default', 'Primary bread'), ('replica', 'Replica bread')):
+            category = models.Category(user=self.user, name='Bread', desc='Bread desc')
+            category.save(using=alias)
+            models.Product(
+                user=self.user, category=category, title=title, desc='desc',
+                price=23.0, quantity=5
+            ).save(using=alias)
+
+    def titles(self):
+        """Return the product titles listed by the API"""
+        res = self.client.get(PRODUCT_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [product['title'] for product in res.data]
+
+    def test_product_reads_use_replica(self):
+        """Test that product listing reads from the replica"""
+        self.assertEqual(self.titles(), ['Replica bread'])
+
+    def test_reads_stick_to_primary_after_write(self):
+        """Test that a user's reads go to the primary after a cart add"""
+        product = models.Product.objects.get()
+        res = self.client.post(SHOPPING_URL, {'product': product.id, 'count': 1})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertIn(routers.PIN_COOKIE, res.cookies)
+        self.assertEqual(self.titles(), ['Primary bread'])
+
+        # Without the cookie the user is still pinned through the cache.
+        self.client.cookies.clear()
+        self.assertEqual(self.titles(), ['Primary bread'])
+
+        cache.clear()
+        self.assertEqual(self.titles(), ['Replica bread'])
@@ -0,0 +1,82 @@
+import threading
+import time
+
+from django.test import SimpleTestCase
+
+from core.singleflight import SingleFlight
+
+
+class SingleFlightTest(SimpleTestCase):
+    """Test coalescing of concurrent calls"""
+
+    def run_concurrently(self, flights, fn, callers=8):
+        """Call fn through the flights from many threads and return results"""
+        results = []
+        errors = []
+        barrier = threading.Barrier(callers)
+
+        def worker(flight):
+            barrier.wait()
+            try:
+                results.append(flight.do('key', fn))
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [
+            threading.Thread(target=worker, args=(flights[i % len(flights)],))
+            for i in range(callers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_concurrent_calls_share_one_computation(self):
+        """Test that concurrent callers in a worker run fn once"""
+        calls = []
+
+        def fn():
+            calls.append(1)
+            time.sleep(0.1)
+            return {'id': 1}
+
+        results, errors = self.run_concurrently([SingleFlight()], fn)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(errors, [])
+        self.assertEqual(results, [{'id': 1}] * 8)
+
+    def test_errors_are_shared(self):
+        """Test that waiting callers receive the leader's exception"""
+        calls = []
+
+        def fn():
+            calls.append(1)
+            time.sleep(0.1)
+            raise ValueError('not found')
+
+        results, errors = self.run_concurrently([SingleFlight()], fn)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), 8)
+
+    def test_sequential_calls_are_not_cached(self):
+        """Test that a finished computation is not reused later"""
+        flight = SingleFlight()
+        self.assertEqual(flight.do('key', lambda: 1), 1)
+        self.assertEqual(flight.do('key', lambda: 2), 2)
+
+    def test_workers_coalesce_through_cache(self):
+        """Test that separate workers share a result through the cache"""
+        calls = []
+
+        def fn():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'value'
+
+        workers = [SingleFlight(cache_alias='default') for _ in range(4)]
+        results, errors = self.run_concurrently(workers, fn)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(errors, [])
+        self.assertEqual(results, ['value'] * 8)
@@ -0,0 +1,89 @@
+import json
+import logging
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core import models
+from core.slowlog import JsonFormatter, SlowQueryLogger, slow_query_settings
+
+
+class ListHandler(logging.Handler):
+    """Keep emitted records in memory"""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class SlowQueryLogTest(TestCase):
+    """Test logging of slow queries"""
+
+    def setUp(self):
+        self.handler = ListHandler()
+        self.logger = logging.getLogger('core.slowlog')
+        self.saved_handlers = self.logger.handlers
+        self.logger.handlers = [self.handler]
+        self.user = get_user_model().objects.create_user(
+            email='test_user@gmail.com', password='testpassword')
+
+    def tearDown(self):
+        self.logger.handlers = self.saved_handlers
+
+    def entries(self):
+        return [record.slow_query for record in self.handler.records]
+
+    def run_logged(self, **options):
+        """Run a product query under the logger with the options"""
+        settings = slow_query_settings()
+        settings.update(options)
+        with connection.execute_wrapper(SlowQueryLogger(connection, options=settings)):
+            list(models.Product.objects.filter(title='Bread'))
+
+    def test_query_over_threshold_is_logged(self):
+        """Test that a slow query is logged with its context and plan"""
+        self.run_logged(THRESHOLD_MS=0)
+        entry = self.entries()[0]
+        self.assertIn('core_product', entry['sql'])
+        self.assertEqual(list(entry['params']), ['Bread'])
+        self.assertIn('core/tests/test_slowlog.py', entry['frame'])
+        self.assertIn('run_logged', entry['frame'])
+        self.assertTrue(entry['plan'])
+        self.assertFalse(entry['analyzed'])
+
+    def test_fast_query_is_not_logged(self):
+        """Test that queries under the threshold are ignored"""
+        self.run_logged(THRESHOLD_MS=10000)
+        self.assertEqual(self.entries(), [])
+
+    def test_sampling_skips_queries(self):
+        """Test that a zero sample rate logs nothing"""
+        self.run_logged(THRESHOLD_MS=0, SAMPLE_RATE=0)
+        self.assertEqual(self.entries(), [])
+
+    def test_explain_can_be_disabled(self):
+        """Test logging without an EXPLAIN plan"""
+        self.run_logged(THRESHOLD_MS=0, EXPLAIN=False)
+        self.assertNotIn('plan', self.entries()[0])
+
+    @override_settings(SLOW_QUERY_LOG={'ENABLED': True, 'THRESHOLD_MS': 0})
+    def test_middleware_records_view(self):
+        """Test that entries logged during a request name the view"""
+        client = APIClient()
+        client.get(reverse('product:product-list'))
+        views = {entry.get('view') for entry in self.entries()}
+        self.assertIn('product.views.ProductView', views)
+
+    def test_json_formatter(self):
+        """Test that records are formatted as a JSON line"""
+        self.run_logged(THRESHOLD_MS=0)
+        line = JsonFormatter().format(self.handler.records[0])
+        data = json.loads(line)
+        self.assertEqual(data['level'], 'WARNING')
+        self.assertIn('core_product', data['sql'])
@@ -0,0 +1,89 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from core import inventory, models, stock
+from shopping.tests.test_shopping_api import sample_category, sample_product
+
+
+class StockLedgerTests(TestCase):
+    """Test the stock ledger and its snapshots"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('staff@example.com', 'password')
+        category = sample_category(self.user)
+        self.bread = sample_product(self.user, category, quantity = 5)
+        self.mango = sample_product(self.user, category, title = 'Mango', quantity = 2)
+
+    def levels(self):
+        return stock.stock_levels([self.bread.id, self.mango.id])
+
+    def test_opening_stock_recorded(self):
+        """Test that a new product starts its ledger with its quantity"""
+        movement = models.StockMovement.objects.get(product = self.bread)
+        self.assertEqual((movement.kind, movement.delta), (models.StockMovement.RECEIPT, 5))
+        self.assertEqual(self.levels(), {self.bread.id: 5, self.mango.id: 2})
+
+    def test_reservations_recorded(self):
+        """Test that reservations and their release are ledger movements"""
+        reservation = inventory.reserve(self.user, {self.bread.id: 3, self.mango.id: 1})
+        self.assertEqual(self.levels(), {self.bread.id: 2, self.mango.id: 1})
+        inventory.release(reservation)
+        self.assertEqual(self.levels(), {self.bread.id: 5, self.mango.id: 2})
+        self.assertEqual(
+            models.StockMovement.objects.filter(reservation = reservation).count(), 4)
+
+    def test_record_insufficient_stock(self):
+        """Test that a negative movement cannot take the stock below zero"""
+        with self.assertRaises(stock.InsufficientStock):
+            stock.record(self.mango.id, models.StockMovement.ADJUSTMENT, -3)
+        stock.record(self.mango.id, models.StockMovement.ADJUSTMENT, -2)
+        self.mango.refresh_from_db()
+        self.assertEqual(self.mango.quantity, 0)
+        self.assertEqual(self.levels()[self.mango.id], 0)
+
+    def test_snapshot_plus_recent_movements(self):
+        """Test that levels read the latest snapshot and the movements after it"""
+        stock.record(self.bread.id, models.StockMovement.RECEIPT, 10)
+        out = StringIO()
+        call_command('stock_snapshot', '--lag', '0', stdout = out)
+        self.assertIn('Took 2 snapshots', out.getvalue())
+        snapshot = models.StockSnapshot.objects.get(product = self.bread)
+        self.assertEqual(snapshot.quantity, 15)
+
+        stock.record(self.bread.id, models.StockMovement.RETURN, 1)
+        # Latest snapshots, then the movements after them.
+        with self.assertNumQueries(2):
+            self.assertEqual(self.levels(), {self.bread.id: 16, self.mango.id: 2})
+
+        self.assertEqual(stock.take_snapshots(lag_seconds = 0), 1)
+        self.assertEqual(
+            list(models.StockSnapshot.objects.filter(
+                product = self.bread).order_by('id').values_list('quantity', flat = True)),
+            [15, 16])
+        self.assertEqual(self.levels(), {self.bread.id: 16, self.mango.id: 2})
+
+    def test_snapshot_skips_recent_movements(self):
+        """Test that movements younger than the lag wait for the next run"""
+        self.assertEqual(stock.take_snapshots(lag_seconds = 60), 0)
+        self.assertEqual(self.levels(), {self.bread.id: 5, self.mango.id: 2})
+
+    def test_stock_at_past_time(self):
+        """Test the stock of a product at a point in time"""
+        now = timezone.now()
+        models.StockMovement.objects.filter(product = self.bread).update(
+            created_on = now - timedelta(days = 2))
+        receipt = stock.record(self.bread.id, models.StockMovement.RECEIPT, 3)
+        models.StockMovement.objects.filter(id = receipt.id).update(
+            created_on = now - timedelta(days = 1))
+        stock.record(self.bread.id, models.StockMovement.ADJUSTMENT, -4)
+
+        at = now - timedelta(hours = 36)
+        self.assertEqual(stock.stock_levels([self.bread.id], at), {self.bread.id: 5})
+        at = now - timedelta(hours = 12)
+        self.assertEqual(stock.stock_levels([self.bread.id], at), {self.bread.id: 8})
+        self.assertEqual(stock.stock_levels([self.bread.id]), {self.bread.id: 4})
@@ -0,0 +1,68 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+
+from core import models
+from core.db import upsert
+
+
+class UpsertTest(TestCase):
+    """Test INSERT ... ON CONFLICT helpers"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='test_user@gmail.com', password='testpassword')
+        category = models.Category.objects.create(user=self.user, name='Bread', desc='desc')
+        self.products = [
+            models.Product.objects.create(
+                user=self.user, category=category, title=f'Bread {index}',
+                desc='desc', price=10.0, quantity=5)
+            for index in range(2)
+        ]
+
+    def rows(self, *counts):
+        return [
+            {'user_id': self.user.id, 'product_id': product.id, 'count': count}
+            for product, count in zip(self.products, counts)
+        ]
+
+    def counts(self):
+        return list(models.ShoppingCart.objects.order_by('product_id').values_list('count', flat=True))
+
+    def run_upsert(self, rows, increment, fallback=False):
+        args = (models.ShoppingCart, rows, ('user_id', 'product_id'), ('count',))
+        if fallback:
+            return upsert._upsert_orm(*args, increment, ('id', 'count'), 'default')
+        return upsert.upsert(*args, increment=increment, returning=('id', 'count'))
+
+    def test_increment_adds_to_existing_rows(self):
+        """Test that incrementing upserts sum counts"""
+        self.run_upsert(self.rows(1), increment=True)
+        result = self.run_upsert(self.rows(2, 3), increment=True)
+        self.assertEqual(self.counts(), [3, 3])
+        self.assertEqual(sorted(row['count'] for row in result), [3, 3])
+
+    def test_replace_sets_existing_rows(self):
+        """Test that replacing upserts overwrite counts"""
+        self.run_upsert(self.rows(5, 5), increment=False)
+        self.run_upsert(self.rows(2), increment=False)
+        self.assertEqual(self.counts(), [2, 5])
+
+    def test_duplicate_rows_are_merged(self):
+        """Test that rows for the same key in one call are combined"""
+        rows = self.rows(1) + self.rows(2)
+        self.run_upsert(rows, increment=True)
+        self.assertEqual(self.counts(), [3])
+
+    def test_orm_fallback(self):
+        """Test the fallback used by backends without ON CONFLICT"""
+        self.run_upsert(self.rows(1), increment=True, fallback=True)
+        result = self.run_upsert(self.rows(2, 3), increment=True, fallback=True)
+        self.assertEqual(self.counts(), [3, 3])
+        self.assertEqual(len(result), 2)
+
+    def test_single_statement(self):
+        """Test that an upsert of many rows is one round trip"""
+        with self.assertNumQueries(1):
+            self.run_upsert(self.rows(1, 2), increment=True)
+        self.assertTrue(upsert.supports_upsert(connection))
@@ -0,0 +1,121 @@
+"""
+In-memory set of the offers still active.
+
+Each process keeps the offers whose expiry_date is in the future, loaded
+with one query, and the earliest of their expiry dates. The set is
+reloaded when that moment passes, so an offer drops out exactly when it
+expires, or when the version kept in the cache changes: saving or
+deleting an Offer bumps it. The default LocMemCache is private to each
+process, so only with a cache shared between processes (CACHES) does the
+bump reach the others on their next read. Every process also reloads
+after MAX_AGE seconds of the OFFERS settings, which bounds how long it
+serves offers changed by another process. Between those events a read is
+one cache get and no query. The offers are compiled into an OfferEngine
+once per load.
+
+Offers changed with QuerySet.update() send no signal, call invalidate()
+after such writes.
+"""
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import Offer
+from offers.engine import OfferEngine
+
+VERSION_KEY = 'offers:active-version'
+
+DEFAULTS = {
+    'MAX_AGE': 30,
+}
+
+
+def offers_settings():
+    """Return the OFFERS settings merged over the defaults"""
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'OFFERS', {}))
+    return options
+
+
+def current_version():
+    """Version of the offers in the shared cache, set one if it was evicted"""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump():
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def invalidate():
+    """Make every process reload the active offers"""
+    bump()
+    # Bumped again once the change commits, a process reloading in between
+    # would otherwise keep the offers as they were under the new version.
+    transaction.on_commit(bump)
+
+
+class ActiveOffers:
+    """Offers not expired yet, reloaded when the earliest expires, offers change or MAX_AGE passes"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.offers = {}
+        self.compiled = OfferEngine([])
+        self.expires_at = None
+        self.loaded_at = None
+
+    def stale(self, version, now):
+        # The age runs on the monotonic clock, now may be any moment.
+        return (version != self.version or
+                (self.expires_at is not None and now >= self.expires_at) or
+                self.loaded_at is None or
+                time.monotonic() - self.loaded_at >= offers_settings()['MAX_AGE'])
+
+    def load(self, now):
+        """Read the active offers, earliest expiry first"""
+        offers = list(Offer.objects.filter(expiry_date__gt=now).prefetch_related(
+            'categories').order_by('expiry_date', 'id'))
+        expires_at = offers[0].expiry_date if offers else None
+        offers.sort(key=lambda offer: (-offer.percentage, offer.id))
+        return {offer.id: offer for offer in offers}, expires_at
+
+    def get(self, now=None):
+        """Return {id: Offer} of the active offers, best percentage first"""
+        now = now or timezone.now()
+        version = current_version()
+        if self.stale(version, now):
+            with self.lock:
+                if self.stale(version, now):
+                    self.offers, self.expires_at = self.load(now)
+                    self.compiled = OfferEngine(self.offers.values())
+                    self.version = version
+                    self.loaded_at = time.monotonic()
+        return self.offers
+
+    def engine(self, now=None):
+        """OfferEngine of the active offers"""
+        self.get(now)
+        return self.compiled
+
+    def clear(self):
+        with self.lock:
+            self.version, self.offers, self.expires_at, self.loaded_at = None, {}, None, None
+            self.compiled = OfferEngine([])
+
+
+active_offers = ActiveOffers()
+
+
+def on_offer_change(sender, **kwargs):
+    """Signal receiver invalidating the active offers when an Offer is saved or deleted"""
+    invalidate()
@@ -1,5 +1,14 @@
 from django.apps import AppConfig
+from django.db.models.signals import m2m_changed, post_delete, post_save
 
 
 class OfferConfig(AppConfig):
     name = 'offers'
+
+    def ready(self):
+        from core.models import Offer
+        from offers.active import on_offer_change
+        post_save.connect(on_offer_change, sender='core.Offer', dispatch_uid='offers.active.save')
+        post_delete.connect(on_offer_change, sender='core.Offer', dispatch_uid='offers.active.delete')
+        m2m_changed.connect(on_offer_change, sender=Offer.categories.through,
+                            dispatch_uid='offers.active.categories')
@@ -0,0 +1,137 @@
+"""
+Offer engine: the best allowed combination of offers for a cart.
+
+An offer takes its percentage off the cart lines in its categories, or
+off every line when it has none, and applies when:
+
+- the cart subtotal is at least its min_cart_value,
+- the user has used it on fewer than per_user_limit orders, 0 meaning no
+  limit, and
+- its categories hold something in the cart.
+
+A stackable offer may combine with the other stackable offers. Their
+percentages add up on the lines they share, at most 100%. Any other offer
+applies alone.
+
+OfferEngine compiles the offers once into parallel lists and an index
+from category to offers. A cart is evaluated from its {category:
+amount} totals in one pass over the index, so the cost grows with the
+categories of the cart and the offers scoped to them, not with the lines.
+No subset is searched. Stacked discounts are never negative, so adding an
+eligible stackable offer cannot lower the total, and the best stack is
+every eligible stackable offer. The best deal is then the better of that
+stack and the best single offer. Single offers are tried by falling
+percentage and the scan stops once percentage x subtotal cannot beat the
+best found.
+
+Per-user limits are checked against the orders placed so far.
+Concurrent checkouts of one user may both pass the last use, and orders
+moved to the archive no longer count.
+"""
+from collections import namedtuple
+
+from django.db.models import Count
+
+from core import models
+
+Deal = namedtuple('Deal', ['offers', 'discount'])
+
+NO_DEAL = Deal((), 0.0)
+
+
+def category_amounts(lines):
+    """Return {category id: amount} of lines with count, unit_price and category_id"""
+    amounts = {}
+    for line in lines:
+        amounts[line.category_id] = amounts.get(line.category_id, 0.0) + line.count * line.unit_price
+    return amounts
+
+
+def usage(user_id, offers, exclude_order=None):
+    """Return {offer id: orders of the user applying it} for the offers with a per-user limit"""
+    limited = [offer.id for offer in offers if offer.per_user_limit]
+    if not limited:
+        return {}
+    applied = models.Order.offers_applied.through.objects.filter(
+        order__user_id=user_id, offer_id__in=limited)
+    if exclude_order is not None:
+        applied = applied.exclude(order_id=exclude_order)
+    return dict(applied.values('offer_id').annotate(orders=Count('order_id')).order_by().values_list(
+        'offer_id', 'orders'))
+
+
+class OfferEngine:
+    """Offers compiled for evaluating carts"""
+
+    def __init__(self, offers):
+        # Best percentage first, which orders the single offer scan.
+        offers = sorted(offers, key=lambda offer: (-offer.percentage, offer.id))
+        self.offers = offers
+        self.ids = [offer.id for offer in offers]
+        self.percentages = [offer.percentage for offer in offers]
+        self.minimums = [offer.min_cart_value for offer in offers]
+        self.limits = [offer.per_user_limit for offer in offers]
+        self.stackable = [offer.stackable for offer in offers]
+        self.unscoped = []
+        self.by_category = {}
+        for index, offer in enumerate(offers):
+            categories = [category.id for category in offer.categories.all()]
+            if not categories:
+                self.unscoped.append(index)
+            for category in categories:
+                self.by_category.setdefault(category, []).append(index)
+
+    def scopes(self, amounts, subtotal):
+        """Amount of the cart each offer applies to"""
+        scope = [0.0] * len(self.ids)
+        for index in self.unscoped:
+            scope[index] = subtotal
+        for category, amount in amounts.items():
+            for index in self.by_category.get(category, ()):
+                scope[index] += amount
+        return scope
+
+    def eligible(self, index, scope, subtotal, used):
+        limit = self.limits[index]
+        return (scope[index] > 0 and subtotal >= self.minimums[index] and
+                (not limit or used.get(self.ids[index], 0) < limit))
+
+    def best_single(self, scope, subtotal, used):
+        best, best_discount = None, 0.0
+        for index, percentage in enumerate(self.percentages):
+            if percentage * subtotal <= best_discount:
+                break
+            discount = percentage * scope[index]
+            if discount > best_discount and self.eligible(index, scope, subtotal, used):
+                best, best_discount = index, discount
+        if best is None:
+            return NO_DEAL
+        return Deal((self.ids[best],), round(best_discount / 100, 2))
+
+    def best_stack(self, amounts, scope, subtotal, used):
+        stack = [
+            index for index, stackable in enumerate(self.stackable)
+            if stackable and self.eligible(index, scope, subtotal, used)
+        ]
+        if len(stack) < 2:
+            return NO_DEAL
+        members = set(stack)
+        whole_cart = sum(self.percentages[index] for index in self.unscoped if index in members)
+        discount = 0.0
+        for category, amount in amounts.items():
+            percentage = whole_cart + sum(
+                self.percentages[index]
+                for index in self.by_category.get(category, ()) if index in members)
+            discount += amount * min(percentage, 100.0)
+        return Deal(tuple(self.ids[index] for index in stack), round(discount / 100, 2))
+
+    def best(self, amounts, used=None):
+        """Return the Deal of the largest discount for {category id: amount} of a cart"""
+        used = used or {}
+        subtotal = sum(amounts.values())
+        if subtotal <= 0 or not self.ids:
+            return NO_DEAL
+        scope = self.scopes(amounts, subtotal)
+        single = self.best_single(scope, subtotal, used)
+        stack = self.best_stack(amounts, scope, subtotal, used)
+        return stack if stack.discount > single.discount else single
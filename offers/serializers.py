@@ -8,5 +8,6 @@ class OfferSerializer(ModelSerializer):
 
     class Meta:
         model = models.Offer
-        fields = ('id', 'title', 'percentage', 'desc', 'created_on', 'expiry_date')
+        fields = ('id', 'title', 'percentage', 'desc', 'created_on', 'expiry_date',
+                  'min_cart_value', 'categories', 'per_user_limit', 'stackable')
         read_only_fields = ('id', 'created_on')
\ No newline at end of file
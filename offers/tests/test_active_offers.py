@@ -0,0 +1,86 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import models
+from offers.active import ActiveOffers, invalidate
+from offers.tests.test_offer_api import sample_offer, sample_user
+
+ACTIVE_URL = reverse('offers:offers-active')
+
+
+class ActiveOffersTests(TestCase):
+    """Test the in-memory active offers"""
+
+    def setUp(self):
+        self.user = sample_user()
+        self.now = timezone.now()
+        self.offers = ActiveOffers()
+
+    def test_expired_offers_are_left_out(self):
+        """Test that only offers expiring in the future are active, best first"""
+        sample_offer(self.user, title = 'Old')
+        low = sample_offer(self.user, title = 'Low', percentage = 5.0,
+                           expiry_date = self.now + timedelta(days = 2))
+        high = sample_offer(self.user, title = 'High', percentage = 20.0,
+                            expiry_date = self.now + timedelta(days = 9))
+        self.assertEqual(list(self.offers.get(self.now)), [high.id, low.id])
+
+    def test_reads_are_served_from_memory(self):
+        """Test that a second read runs no query"""
+        sample_offer(self.user, expiry_date = self.now + timedelta(days = 1))
+        self.offers.get(self.now)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.offers.get(self.now + timedelta(hours = 1))), 1)
+
+    def test_refreshes_when_earliest_offer_expires(self):
+        """Test that the set reloads at the earliest expiry, not before"""
+        soon = sample_offer(self.user, title = 'Soon', expiry_date = self.now + timedelta(hours = 1))
+        later = sample_offer(self.user, title = 'Later', expiry_date = self.now + timedelta(days = 1))
+        self.offers.get(self.now)
+        with self.assertNumQueries(0):
+            self.offers.get(soon.expiry_date - timedelta(seconds = 1))
+        # The offers and their categories.
+        with self.assertNumQueries(2):
+            self.assertEqual(list(self.offers.get(soon.expiry_date)), [later.id])
+
+    def test_refreshes_when_an_offer_is_saved(self):
+        """Test that saving or deleting an offer invalidates the set"""
+        offer = sample_offer(self.user, expiry_date = self.now + timedelta(days = 1))
+        self.offers.get(self.now)
+        offer.percentage = 30.0
+        offer.save()
+        self.assertEqual(self.offers.get(self.now)[offer.id].percentage, 30.0)
+        offer.delete()
+        self.assertEqual(self.offers.get(self.now), {})
+
+    def test_reloads_after_max_age(self):
+        """Test that the set is reloaded once MAX_AGE has passed, for changes of other processes"""
+        offer = sample_offer(self.user, expiry_date = self.now + timedelta(days = 1))
+        self.offers.get(self.now)
+        models.Offer.objects.filter(id = offer.id).update(percentage = 30.0)
+        with self.settings(OFFERS = {'MAX_AGE': 30}):
+            self.assertEqual(self.offers.get(self.now)[offer.id].percentage, 15.0)
+            self.offers.loaded_at -= 30
+            self.assertEqual(self.offers.get(self.now)[offer.id].percentage, 30.0)
+
+    def test_invalidate_after_queryset_update(self):
+        """Test that invalidate() picks up writes that send no signal"""
+        offer = sample_offer(self.user, expiry_date = self.now + timedelta(days = 1))
+        self.offers.get(self.now)
+        models.Offer.objects.filter(id = offer.id).update(expiry_date = self.now)
+        self.assertEqual(len(self.offers.get(self.now)), 1)
+        invalidate()
+        self.assertEqual(self.offers.get(self.now), {})
+
+    def test_active_offers_api(self):
+        """Test that the active endpoint lists only offers not expired"""
+        sample_offer(self.user, title = 'Old')
+        offer = sample_offer(self.user, title = 'Current', expiry_date = self.now + timedelta(days = 1))
+        res = APIClient().get(ACTIVE_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in res.data], [offer.id])
@@ -0,0 +1,177 @@
+import itertools
+import random
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import models
+from offers.engine import OfferEngine, usage
+from order.tests.test_order_api import (ORDER_URL, sample_category, sample_payment_mode,
+                                        sample_product, sample_shipping_address,
+                                        sample_shopping_item, sample_user)
+from shopping.tests.test_shopping_api import SUMMARY_URL
+
+
+class Rule:
+    """Offer stand-in for evaluating without the database"""
+
+    def __init__(self, id, percentage, categories=(), min_cart_value=0, per_user_limit=0,
+                 stackable=False):
+        self.id = id
+        self.percentage = percentage
+        self.category_ids = list(categories)
+        self.min_cart_value = min_cart_value
+        self.per_user_limit = per_user_limit
+        self.stackable = stackable
+
+    class Categories(list):
+        def all(self):
+            return self
+
+    @property
+    def categories(self):
+        return self.Categories(models.Category(id = pk) for pk in self.category_ids)
+
+
+def brute_force(rules, amounts, used):
+    """Largest discount over every allowed subset of the rules"""
+    subtotal = sum(amounts.values())
+    eligible = [
+        rule for rule in rules
+        if subtotal >= rule.min_cart_value
+        and (not rule.per_user_limit or used.get(rule.id, 0) < rule.per_user_limit)
+        and sum(amounts.get(pk, 0) for pk in rule.category_ids or amounts) > 0
+    ]
+    best = 0.0
+    for size in range(1, len(eligible) + 1):
+        for subset in itertools.combinations(eligible, size):
+            if size > 1 and not all(rule.stackable for rule in subset):
+                continue
+            discount = sum(
+                amount * min(100.0, sum(
+                    rule.percentage for rule in subset
+                    if not rule.category_ids or category in rule.category_ids))
+                for category, amount in amounts.items()
+            )
+            best = max(best, round(discount / 100, 2))
+    return best
+
+
+class OfferEngineTests(TestCase):
+    """Test the evaluation of offer rules"""
+
+    def test_min_cart_value_and_category_scope(self):
+        """Test that offers apply above their minimum and only to their categories"""
+        engine = OfferEngine([
+            Rule(1, 10),
+            Rule(2, 50, categories = [7]),
+            Rule(3, 30, min_cart_value = 500),
+        ])
+        self.assertEqual(engine.best({7: 40.0, 8: 360.0}), ((1,), 40.0))
+        self.assertEqual(engine.best({7: 100.0, 8: 100.0}), ((2,), 50.0))
+        self.assertEqual(engine.best({7: 100.0, 8: 400.0}), ((3,), 150.0))
+        self.assertEqual(engine.best({}), ((), 0.0))
+
+    def test_per_user_limit(self):
+        """Test that an offer used up by the user is skipped"""
+        engine = OfferEngine([Rule(1, 20, per_user_limit = 1), Rule(2, 5)])
+        self.assertEqual(engine.best({1: 100.0}), ((1,), 20.0))
+        self.assertEqual(engine.best({1: 100.0}, {1: 1}), ((2,), 5.0))
+
+    def test_stackable_offers_combine_up_to_the_whole_line(self):
+        """Test that stackable offers add up, capped at 100% of a line"""
+        engine = OfferEngine([
+            Rule(1, 25, stackable = True),
+            Rule(2, 60, categories = [3], stackable = True),
+            Rule(3, 40),
+            Rule(4, 30, categories = [3], stackable = True),
+        ])
+        # 25 + 60 + 30 capped to 100 on category 3, 25 elsewhere.
+        self.assertEqual(engine.best({3: 100.0, 4: 100.0}), ((2, 4, 1), 125.0))
+        # Off category 3 the non-stackable offer does better alone.
+        self.assertEqual(engine.best({3: 10.0, 4: 200.0}), ((3,), 84.0))
+
+    def test_matches_brute_force(self):
+        """Test that the best deal equals an exhaustive search on small random cases"""
+        generator = random.Random(50)
+        for case in range(200):
+            rules = [
+                Rule(
+                    pk, generator.choice([5, 10, 15, 20, 35, 50]),
+                    categories = generator.sample(range(4), generator.randint(0, 2)),
+                    min_cart_value = generator.choice([0, 0, 100, 300]),
+                    per_user_limit = generator.choice([0, 0, 1]),
+                    stackable = generator.random() < 0.5,
+                )
+                for pk in range(1, generator.randint(1, 8) + 1)
+            ]
+            amounts = {
+                category: float(generator.randint(1, 200))
+                for category in generator.sample(range(5), generator.randint(1, 4))
+            }
+            used = {rule.id: 1 for rule in rules if generator.random() < 0.2}
+            deal = OfferEngine(rules).best(amounts, used)
+            self.assertEqual(deal.discount, brute_force(rules, amounts, used), (case, deal))
+
+
+class OfferCheckoutTests(TestCase):
+    """Test the offer rules at checkout and on the cart"""
+
+    def setUp(self):
+        self.user = sample_user(is_staff = False)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.bread = sample_category(self.user)
+        self.fruit = sample_category(self.user, name = 'Fruit')
+        self.loaf = sample_product(self.user, self.bread, price = 50.0, quantity = 20)
+        self.mango = sample_product(self.user, self.fruit, title = 'Mango', price = 100.0, quantity = 20)
+        self.address = sample_shipping_address(self.user).printable()
+        self.payment_mode = sample_payment_mode(self.user)
+        expiry = timezone.now() + timedelta(days = 1)
+        self.whole = models.Offer.objects.create(
+            user = self.user, title = 'Whole', percentage = 5, desc = 'desc',
+            expiry_date = expiry, stackable = True)
+        self.fruit_offer = models.Offer.objects.create(
+            user = self.user, title = 'Fruit', percentage = 20, desc = 'desc',
+            expiry_date = expiry, stackable = True, per_user_limit = 1)
+        self.fruit_offer.categories.add(self.fruit)
+
+    def place(self, offers, products = None):
+        res = self.client.post(ORDER_URL, {
+            'cartItems': [
+                sample_shopping_item(self.user, product, count = count).id
+                for product, count in (products or [(self.loaf, 2), (self.mango, 1)])
+            ],
+            'offers_applied': [offer.id for offer in offers],
+            'shipping_address': self.address,
+            'billing_address': self.address,
+            'payment_mode': self.payment_mode.id,
+        })
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        models.ShoppingCart.objects.filter(user = self.user).delete()
+        return res.data['price_detail']['discount']
+
+    def test_checkout_applies_best_combination(self):
+        """Test that checkout stacks the applied offers and honours the user limit"""
+        # 5% of 200 and 20% of the 100 of fruit.
+        self.assertEqual(self.place([self.whole, self.fruit_offer]), 30.0)
+        self.assertEqual(usage(self.user.id, [self.fruit_offer]), {self.fruit_offer.id: 1})
+        self.assertEqual(self.place([self.whole, self.fruit_offer]), 10.0)
+
+    def test_cart_summary_suggests_offers(self):
+        """Test that the cart summary names the best combination of active offers"""
+        sample_shopping_item(self.user, self.loaf, count = 2)
+        sample_shopping_item(self.user, self.mango, count = 1)
+        res = self.client.get(SUMMARY_URL)
+        self.assertEqual(sorted(res.data['offers']), sorted([self.whole.id, self.fruit_offer.id]))
+        self.assertEqual(res.data['discount'], 30.0)
+
+    def test_unapplied_offer_keeps_its_limit(self):
+        """Test that an offer left out of the deal is neither stored nor counted"""
+        self.assertEqual(self.place([self.fruit_offer], [(self.loaf, 2)]), 0.0)
+        self.assertFalse(models.Order.offers_applied.through.objects.exists())
+        self.assertEqual(usage(self.user.id, [self.fruit_offer]), {})
+        self.assertEqual(self.place([self.fruit_offer]), 20.0)
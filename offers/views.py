@@ -1,9 +1,13 @@
+from django.db import transaction
 from rest_framework import viewsets
-from rest_framework.authentication import TokenAuthentication
+from rest_framework.decorators import action
+from rest_framework.response import Response
 
 from core.models import Offer
+from core.authentication import TokenAuthentication
 from offers import serializers
-from core import permissions
+from offers.active import active_offers
+from core import outbox, permissions
 
 
 class OfferView(viewsets.ModelViewSet):
@@ -13,6 +17,28 @@ class OfferView(viewsets.ModelViewSet):
     permission_classes = (permissions.IsStaffOrReadOnly,)
     authentication_classes = (TokenAuthentication,)
     queryset = Offer.objects.all().order_by('-id')
+    replica_reads = True
 
     def perform_create(self, serializer):
-        return serializer.save(user = self.request.user)
+        with transaction.atomic():
+            offer = serializer.save(user = self.request.user)
+            outbox.publish('offer', offer.id, 'created', serializer.data)
+        return offer
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            offer = serializer.save()
+            outbox.publish('offer', offer.id, 'updated', serializer.data)
+        return offer
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            offer_id = instance.id
+            instance.delete()
+            outbox.publish('offer', offer_id, 'deleted', {'id': offer_id})
+
+    @action(methods = ['GET'], detail = False)
+    def active(self, request):
+        """Offers not expired yet, best percentage first, read from memory"""
+        offers = list(active_offers.get().values())
+        return Response(self.get_serializer(offers, many = True).data)
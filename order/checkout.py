@@ -0,0 +1,140 @@
+"""
+Checkout: place an order and price it in one transaction.
+
+place_order() takes the cart items from stock, creates the Order with
+OrderLine snapshots of its products and stores its totals in a PriceDetail
+row, so readers get the lines and totals of the order as they were at
+checkout, whatever happens to the cart and catalog afterwards. The buyer
+is emailed by a background job, an order.placed outbox event is written
+for downstream systems, the order is added to the sales rollups and its
+placed status is logged and counted, all with the order.
+"""
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from django.utils import timezone
+
+from core import inventory, jobs, models, outbox, pricing, rollups
+from offers.engine import OfferEngine, category_amounts, usage
+from order import status
+
+
+def price(lines, offers, payment_mode, now=None, used=None):
+    """
+    Return (totals, applied offers) of order lines with the offers and payment mode.
+
+    The best allowed combination of the offers still active, see
+    offers.engine, gives the discount and the offers applied, the others
+    are left out; used holds the past uses of the offers with a per-user
+    limit. Delivery is charged on the discounted amount and the payment
+    mode adds its charges.
+    """
+    now = now or timezone.now()
+    subtotal = round(sum(line.count * line.unit_price for line in lines), 2)
+    engine = OfferEngine(offer for offer in offers if offer.expiry_date > now)
+    deal = engine.best(category_amounts(lines), used)
+    discount = min(deal.discount, subtotal)
+    delivery = pricing.delivery_charges(subtotal - discount)
+    payment_charges = float(payment_mode.charges) if subtotal else 0.0
+    totals = {
+        'subtotal': subtotal,
+        'discount': discount,
+        'payment_charges': payment_charges,
+        'delievery_charges': delivery,
+        'grand_total': round(subtotal - discount + delivery + payment_charges, 2),
+    }
+    applied = set(deal.offers)
+    return totals, [offer for offer in offers if offer.id in applied]
+
+
+def write_lines(order, items, replace=False):
+    """
+    Snapshot the products of cart items as the lines of the order.
+
+    The products are loaded in one query and the lines written with one
+    bulk insert, after deleting the previous lines if replace is set.
+    """
+    items = models.ShoppingCart.objects.filter(
+        id__in=[item.id for item in items]).select_related('product').order_by('id')
+    lines = [
+        models.OrderLine(
+            order=order,
+            product_id=item.product_id,
+            category_id=item.product.category_id,
+            title=item.product.title,
+            unit=item.product.unit,
+            unit_price=item.product.price,
+            count=item.count,
+        )
+        for item in items
+    ]
+    if replace:
+        models.OrderLine.objects.filter(order=order).delete()
+    return models.OrderLine.objects.bulk_create(lines)
+
+
+def order_event(order, lines, offers):
+    """Payload of the outbox events of an order"""
+    detail = order.pricedetail
+    return {
+        'id': order.id,
+        'user': order.user_id,
+        'payment_mode': order.payment_mode_id,
+        'shipping_address': order.shipping_address,
+        'lines': [
+            {'product': line.product_id, 'count': line.count, 'unit_price': line.unit_price}
+            for line in lines
+        ],
+        'offers': [offer.id for offer in offers],
+        'grand_total': detail.grand_total,
+    }
+
+
+def place_order(validated_data, reservation=None):
+    """
+    Create the order of validated OrderSerializer data and its PriceDetail.
+
+    The cart items are taken from stock unless a held reservation is given.
+    Raises inventory.OutOfStock or inventory.ReservationExpired, leaving
+    nothing behind.
+    """
+    items = validated_data.pop('cartItems', [])
+    offers = validated_data.pop('offers_applied', [])
+    with transaction.atomic():
+        lines = inventory.cart_lines(items)
+        if reservation is None and lines:
+            reservation = inventory.reserve(validated_data['user'], lines)
+        order = models.Order.objects.create(**validated_data)
+        order.cartItems.set(items)
+        if reservation is not None:
+            inventory.commit(reservation, order)
+        lines = write_lines(order, items)
+        totals, applied = price(lines, offers, order.payment_mode,
+                                used=usage(order.user_id, offers, exclude_order=order.id))
+        order.offers_applied.set(applied)
+        order.pricedetail = models.PriceDetail.objects.create(
+            order=order, user_id=order.user_id, **totals)
+        rollups.add_order(order, lines)
+        status.record_placed(order)
+        jobs.enqueue('order.notify_placed', priority=10, order_id=order.id)
+        outbox.publish('order', order.id, 'placed', order_event(order, lines, applied))
+    return order
+
+
+def reprice(order, offers=None):
+    """
+    Refresh the PriceDetail of an order whose lines, offers or payment mode changed.
+
+    The offers asked for, or else those applied so far, are priced again
+    and only the ones applied are kept on the order. Returns (PriceDetail,
+    applied offers).
+    """
+    if offers is None:
+        offers = order.offers_applied.all()
+    offers = list(offers)
+    prefetch_related_objects(offers, 'categories')
+    totals, applied = price(order.lines.all(), offers, order.payment_mode,
+                            used=usage(order.user_id, offers, exclude_order=order.id))
+    order.offers_applied.set(applied)
+    detail, created = models.PriceDetail.objects.update_or_create(
+        order=order, defaults=dict(totals, user_id=order.user_id))
+    return detail, applied
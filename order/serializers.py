@@ -1,8 +1,14 @@
-from rest_framework.serializers import ModelSerializer, PrimaryKeyRelatedField
+import json
 
-from core import models
-from shopping.serializers import ShoppingDetailSerializer
+from django.db import transaction
+from rest_framework.serializers import (CharField, ChoiceField, ListField, IntegerField,
+                                        ModelSerializer, PrimaryKeyRelatedField, Serializer,
+                                        SerializerMethodField, ValidationError)
+
+from core import inventory, models, outbox, rollups
+from offers.active import active_offers
 from offers.serializers import OfferSerializer
+from order import checkout
 
 class PaymentModeSerializer(ModelSerializer):
     """Serializer for payment mode Api"""
@@ -13,26 +19,235 @@ class PaymentModeSerializer(ModelSerializer):
         read_only_fields = ('id', 'created_on')
 
 
-class OrderSerializer(ModelSerializer):
-    """Serializer for order api"""
-    cartItems = PrimaryKeyRelatedField(
+def out_of_stock_error(exc):
+    """Return the validation error for an OutOfStock exception"""
+    return ValidationError({
+        'cartItems': [f'Not enough stock for product {product}.' for product in exc.products]
+    })
+
+
+class ReservationLineSerializer(ModelSerializer):
+    """Serializer for the lines of a stock reservation"""
+
+    class Meta:
+        model = models.ReservationLine
+        fields = ('product', 'count')
+
+
+class CartItemField(PrimaryKeyRelatedField):
+    """Cart item id, limited to the cart of the buyer"""
+
+    def get_queryset(self):
+        instance = self.root.instance
+        user_id = instance.user_id if instance is not None else self.context['request'].user.id
+        return models.ShoppingCart.objects.filter(user_id = user_id)
+
+
+class ReservationSerializer(ModelSerializer):
+    """Serializer holding the stock of cart items for a checkout"""
+    cartItems = CartItemField(
         many = True,
-        queryset = models.ShoppingCart.objects.all()
+        write_only = True,
+        allow_empty = False,
     )
+    lines = ReservationLineSerializer(many = True, read_only = True)
 
-    offers_applied = PrimaryKeyRelatedField(
-        many = True,
-        queryset = models.Offer.objects.all()
+    class Meta:
+        model = models.Reservation
+        fields = ('id', 'cartItems', 'status', 'expires_at', 'lines')
+        read_only_fields = ('id', 'status', 'expires_at')
+
+    def create(self, validated_data):
+        try:
+            return inventory.reserve(
+                validated_data['user'], inventory.cart_lines(validated_data['cartItems']))
+        except inventory.OutOfStock as exc:
+            raise out_of_stock_error(exc)
+
+
+class OrderLineSerializer(ModelSerializer):
+    """Serializer for the lines of an order"""
+
+    class Meta:
+        model = models.OrderLine
+        fields = ('id', 'product', 'category_id', 'title', 'unit', 'unit_price', 'count')
+        read_only_fields = fields
+
+
+class PriceDetailSerializer(ModelSerializer):
+    """Serializer for the totals of an order"""
+
+    class Meta:
+        model = models.PriceDetail
+        fields = ('subtotal', 'discount', 'payment_charges', 'delievery_charges', 'grand_total')
+        read_only_fields = fields
+
+
+class ActiveOfferField(PrimaryKeyRelatedField):
+    """Offer id looked up in the in-memory active offers, expired offers are refused"""
+    default_error_messages = dict(
+        PrimaryKeyRelatedField.default_error_messages,
+        inactive = 'Offer "{pk_value}" is not active.',
+    )
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('queryset', models.Offer.objects.all())
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type = type(data).__name__)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type = type(data).__name__)
+        offer = active_offers.get().get(pk)
+        if offer is None:
+            self.fail('inactive', pk_value = data)
+        return offer
+
+
+class OrderSerializer(ModelSerializer):
+    """Serializer for order api"""
+    cartItems = CartItemField(many = True)
+
+    offers_applied = ActiveOfferField(many = True)
+
+    reservation = PrimaryKeyRelatedField(
+        write_only = True,
+        required = False,
+        queryset = models.Reservation.objects.all()
     )
 
+    price_detail = PriceDetailSerializer(source = 'pricedetail', read_only = True, allow_null = True)
+
     class Meta:
         model = models.Order
-        fields = ('id', 'cartItems', 'offers_applied', 'ordered_on', 'shipping_address', 'billing_address', 'payment_mode')
-        read_only_fields = ('id', 'ordered_on',)
-    
+        fields = ('id', 'cartItems', 'offers_applied', 'ordered_on', 'status', 'shipping_address', 'billing_address', 'payment_mode', 'reservation', 'price_detail')
+        read_only_fields = ('id', 'ordered_on', 'status',)
+
+    def validate_reservation(self, reservation):
+        """Only a held reservation of the user can be used"""
+        if (reservation.user_id != self.context['request'].user.id or
+                reservation.status != models.Reservation.HELD):
+            raise ValidationError('Reservation is not held.')
+        return reservation
+
+    def validate(self, attrs):
+        """A reservation must hold exactly the units of the cart items"""
+        reservation = attrs.get('reservation')
+        if reservation is not None:
+            held = dict(reservation.lines.values_list('product_id', 'count'))
+            if held != inventory.cart_lines(attrs.get('cartItems', [])):
+                raise ValidationError({'reservation': ['Reservation does not match the cart items.']})
+        return attrs
+
+    def create(self, validated_data):
+        """Place the order, taking its cart items from stock and pricing it"""
+        reservation = validated_data.pop('reservation', None)
+        try:
+            return checkout.place_order(validated_data, reservation)
+        except inventory.OutOfStock as exc:
+            raise out_of_stock_error(exc)
+        except inventory.ReservationExpired:
+            raise ValidationError({'reservation': ['Reservation has expired.']})
+
+    def update(self, instance, validated_data):
+        """Reprice the order, new cart items are taken from stock in place of the old"""
+        validated_data.pop('reservation', None)
+        offers = validated_data.pop('offers_applied', None)
+        with transaction.atomic():
+            # Locked like status.transition() does, so the order cannot move on meanwhile.
+            current = models.Order.objects.select_for_update().values_list(
+                'status', flat = True).get(pk = instance.pk)
+            if current != models.Order.PLACED:
+                raise ValidationError({'status': [f'A {current} order can no longer be changed.']})
+            rollups.remove_order(instance, list(instance.lines.all()))
+            order = super().update(instance, validated_data)
+            if 'cartItems' in validated_data:
+                try:
+                    inventory.exchange(order, inventory.cart_lines(validated_data['cartItems']))
+                except inventory.OutOfStock as exc:
+                    raise out_of_stock_error(exc)
+                checkout.write_lines(order, validated_data['cartItems'], replace = True)
+            order.pricedetail, applied = checkout.reprice(order, offers)
+            lines = list(order.lines.all())
+            rollups.add_order(order, lines)
+            outbox.publish('order', order.id, 'updated', checkout.order_event(order, lines, applied))
+        return order
+
 
 class OrderDetailSerializer(OrderSerializer):
-    """Serializer for detailed order"""
-    cartItems = ShoppingDetailSerializer(many = True, read_only = True)
+    """Serializer for detailed order, read from its own lines"""
+    lines = OrderLineSerializer(many = True, read_only = True)
     offers_applied = OfferSerializer(many = True, read_only = True)
-    payment_mode = PaymentModeSerializer(read_only = True)
\ No newline at end of file
+    payment_mode = PaymentModeSerializer(read_only = True)
+
+    class Meta(OrderSerializer.Meta):
+        fields = ('id', 'lines', 'offers_applied', 'ordered_on', 'status', 'shipping_address', 'billing_address', 'payment_mode', 'price_detail')
+
+
+class OrderStatusLogSerializer(ModelSerializer):
+    """Serializer for the status changes of an order"""
+
+    class Meta:
+        model = models.OrderStatusLog
+        fields = ('from_status', 'to_status', 'user', 'note', 'created_on')
+        read_only_fields = fields
+
+
+class StatusTransitionSerializer(Serializer):
+    """Serializer for moving an order to another status"""
+    status = ChoiceField(choices = models.Order.STATUS_CHOICES)
+    note = CharField(max_length = 255, required = False, allow_blank = True, default = '')
+
+
+class BulkStatusTransitionSerializer(StatusTransitionSerializer):
+    """Serializer for moving many orders to another status"""
+    orders = ListField(child = IntegerField(min_value = 1), allow_empty = False, max_length = 500)
+
+
+class ArchivedOrderLineSerializer(ModelSerializer):
+    """Serializer for the lines of an archived order"""
+    product = IntegerField(source = 'product_id', read_only = True)
+
+    class Meta:
+        model = models.ArchivedOrderLine
+        fields = ('id', 'product', 'category_id', 'title', 'unit', 'unit_price', 'count')
+        read_only_fields = fields
+
+
+class ArchivedOrderSerializer(ModelSerializer):
+    """Serializer for archived orders, in the shape of OrderSerializer"""
+    cartItems = SerializerMethodField()
+    offers_applied = SerializerMethodField()
+    price_detail = SerializerMethodField()
+
+    class Meta:
+        model = models.ArchivedOrder
+        fields = ('id', 'cartItems', 'offers_applied', 'ordered_on', 'status', 'shipping_address', 'billing_address', 'payment_mode', 'price_detail')
+        read_only_fields = fields
+
+    def get_cartItems(self, order):
+        return json.loads(order.cart_item_ids)
+
+    def get_offers_applied(self, order):
+        return json.loads(order.offer_ids)
+
+    def get_price_detail(self, order):
+        if order.grand_total is None:
+            return None
+        return {name: getattr(order, name) for name in PriceDetailSerializer.Meta.fields}
+
+
+class ArchivedOrderDetailSerializer(ArchivedOrderSerializer):
+    """Serializer for a detailed archived order, in the shape of OrderDetailSerializer"""
+    lines = ArchivedOrderLineSerializer(many = True, read_only = True)
+    payment_mode = PaymentModeSerializer(read_only = True)
+
+    class Meta(ArchivedOrderSerializer.Meta):
+        fields = ('id', 'lines', 'offers_applied', 'ordered_on', 'status', 'shipping_address', 'billing_address', 'payment_mode', 'price_detail')
+
+    def get_offers_applied(self, order):
+        offers = models.Offer.objects.filter(id__in = json.loads(order.offer_ids)).order_by('id')
+        return OfferSerializer(offers, many = True, context = self.context).data
@@ -0,0 +1,113 @@
+"""
+Order lifecycle: placed > packed > shipped > delivered, or cancelled.
+
+transition() moves orders to a status allowed by Order.TRANSITIONS with
+one conditional UPDATE per current status, writes an OrderStatusLog row
+and an order.status_changed outbox event per order, keeps the
+OrderStatusCount counters in step and puts the stock of cancelled orders
+back, all in one transaction. Dashboards
+read the counts from those few counter rows instead of grouping the
+order table.
+
+Counters are split over SHARDS rows per status and every change adds to
+a random one, so concurrent checkouts and staff actions seldom wait on
+the same counter row.
+"""
+import random
+
+from django.db import transaction
+from django.db.models import Sum
+
+from core import inventory, models, outbox
+from core.db.upsert import upsert
+
+SHARDS = 8
+
+
+class InvalidTransition(Exception):
+    """Raised when no order can move to the status asked for"""
+
+    def __init__(self, to_status, rejected):
+        super().__init__(f'Cannot move orders {sorted(rejected)} to {to_status}')
+        self.to_status = to_status
+        self.rejected = rejected
+
+
+def sources(to_status):
+    """Statuses an order may move to to_status from"""
+    return [
+        status for status, targets in models.Order.TRANSITIONS.items() if to_status in targets
+    ]
+
+
+def count(deltas):
+    """Add {status: delta} to the status counters"""
+    shard = random.randrange(SHARDS)
+    rows = [
+        {'status': status, 'shard': shard, 'count': delta}
+        for status, delta in sorted(deltas.items()) if delta
+    ]
+    upsert(models.OrderStatusCount, rows, ['status', 'shard'], ['count'], increment=True)
+
+
+def record_placed(order, user=None):
+    """Log and count a new order, call it in the transaction creating it"""
+    models.OrderStatusLog.objects.create(
+        order=order, to_status=order.status, user=user or order.user)
+    count({order.status: 1})
+
+
+def transition(order_ids, to_status, user=None, note='', strict=False):
+    """
+    Move orders to to_status where their current status allows it.
+
+    Returns (moved {id: previous status}, rejected {id: current status});
+    ids of orders that do not exist are left out of both. With strict set
+    InvalidTransition is raised instead when any order is rejected.
+    """
+    allowed = sources(to_status)
+    with transaction.atomic():
+        current = dict(
+            models.Order.objects.select_for_update().filter(id__in=order_ids)
+            .order_by('id').values_list('id', 'status'))
+        rejected = {pk: status for pk, status in current.items() if status not in allowed}
+        if rejected and strict:
+            raise InvalidTransition(to_status, rejected)
+
+        moved = {}
+        for status in allowed:
+            ids = [pk for pk, previous in current.items() if previous == status]
+            if not ids:
+                continue
+            # The status condition keeps a concurrent change from being overwritten.
+            models.Order.objects.filter(id__in=ids, status=status).update(status=to_status)
+            moved.update((pk, status) for pk in ids)
+        if not moved:
+            return moved, rejected
+
+        models.OrderStatusLog.objects.bulk_create(
+            models.OrderStatusLog(
+                order_id=pk, from_status=previous, to_status=to_status, user=user, note=note)
+            for pk, previous in moved.items()
+        )
+        deltas = {to_status: len(moved)}
+        for previous in moved.values():
+            deltas[previous] = deltas.get(previous, 0) - 1
+        count(deltas)
+        if to_status == models.Order.CANCELLED:
+            # Cancelled orders were never shipped, their units go back to stock.
+            inventory.release_committed(list(moved))
+        outbox.publish_many('order', 'status_changed', [
+            (pk, {'id': pk, 'from': previous, 'to': to_status})
+            for pk, previous in moved.items()
+        ])
+    return moved, rejected
+
+
+def status_counts():
+    """Return {status: number of orders} for every status"""
+    counts = dict.fromkeys(dict(models.Order.STATUS_CHOICES), 0)
+    counts.update(
+        models.OrderStatusCount.objects.values('status').annotate(total=Sum('count'))
+        .order_by().values_list('status', 'total'))
+    return counts
@@ -0,0 +1,28 @@
+from django.core.mail import send_mail
+from django.utils.dateparse import parse_datetime
+
+from core import archive, models
+from core.jobs import enqueue, task
+
+
+@task('order.notify_placed')
+def notify_placed(order_id):
+    """Email the buyer that their order was placed"""
+    order = models.Order.objects.select_related('user', 'pricedetail').filter(id=order_id).first()
+    if order is None:
+        return
+    send_mail(
+        f'Order #{order.id} placed',
+        f'Your order #{order.id} of {order.pricedetail.grand_total:.2f} was placed '
+        f'and will be shipped to:\n\n{order.shipping_address}\n',
+        None,
+        [order.user.email],
+    )
+
+
+@task('order.archive')
+def archive_orders(before, batches=10):
+    """Archive a few batches of cold orders, queueing the rest as a new job"""
+    moved, finished = archive.archive(parse_datetime(before), max_batches=batches)
+    if not finished:
+        enqueue('order.archive', before=before, batches=batches)
@@ -1,3 +1,7 @@
+import json
+
+from django.core import mail
+from django.test import override_settings
 from django.test.testcases import TestCase
 from django.urls.base import reverse
 from rest_framework.test import APIClient
@@ -6,13 +10,15 @@ from rest_framework import status
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from core import models
+from core import jobs, models
+from order import checkout
 from order.serializers import OrderDetailSerializer, OrderSerializer
 
 
 ORDER_URL = reverse('order:order-list')
+RESERVE_URL = reverse('order:order-reserve')
 
 def detail_url(order_id):
     """Return detail url for offer"""
@@ -30,7 +36,7 @@ def sample_offer(user, **params):
         'title': 'Summer Offer',
         'percentage': 15.0,
         'desc': 'Summer Offer 2021',
-        'expiry_date': timezone.make_aware(datetime(2022, 6, 30))
+        'expiry_date': timezone.now() + timedelta(days=30)
     }
     defaults.update(params)
     return models.Offer.objects.create(user=user, **defaults)
@@ -151,9 +157,9 @@ class TestNormalUserOrderApi(TestCase):
         order.cartItems.add(sample_shopping_item(self.user, product))
         order.offers_applied.add(sample_offer(self.user))
         res = self.client.get(ORDER_URL)
-        orders = models.Order.objects.all().order_by('-id')
+        orders = models.Order.objects.all().order_by('-ordered_on', '-id')
         serializer = OrderSerializer(orders, many = True)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_post_basic_order_normal_user(self):
         """Test post order normal user"""
@@ -181,7 +187,7 @@ class TestNormalUserOrderApi(TestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         orders = models.Order.objects.all().filter(user = self.user)
         serializer = OrderSerializer(orders, many = True)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_post_order_with_cartitems_normal_user(self):
         """Test post order adding cart items for normal user"""
@@ -204,22 +210,42 @@ class TestNormalUserOrderApi(TestCase):
         self.assertIn(item1, items)
         self.assertIn(item2, items)
 
+    def test_post_order_emails_buyer_in_background(self):
+        """Test that placing an order queues the email to the buyer"""
+        payload = {
+            'shipping_address': self.address.printable(),
+            'billing_address': self.address.printable(),
+            'payment_mode': self.payment_mode.id,
+        }
+        res = self.client.post(ORDER_URL, payload)
+        self.assertEqual(len(mail.outbox), 0)
+        job = models.Job.objects.get(name = 'order.notify_placed')
+        self.assertEqual(job.status, models.Job.QUEUED)
+
+        jobs.Worker(threads = 1).run(once = True)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [self.user.email])
+        self.assertIn(f'#{res.data["id"]}', mail.outbox[0].subject)
+
     def test_post_order_with_offers_normal_order(self):
-        """Test post order with offers for normal user"""
+        """Test post order with offers for normal user, keeping only the offers applied"""
         offer1 = sample_offer(self.user)
-        offer2 = sample_offer(self.user, title = 'Winter offer')
+        offer2 = sample_offer(self.user, title = 'Winter offer', percentage = 20.0)
+        item = sample_shopping_item(self.user, sample_product(self.user, sample_category(self.user)))
         payload = {
+            'cartItems': [item.id],
             'offers_applied': [offer1.id, offer2.id],
             'shipping_address': self.address.printable(),
             'billing_address': self.address.printable(),
             'payment_mode': self.payment_mode.id,
         }
         res = self.client.post(ORDER_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
         order = models.Order.objects.get(id = res.data['id'])
-        offers = order.offers_applied.all()
-        self.assertEqual(len(offers), 2)
-        self.assertIn(offer1, offers)
-        self.assertIn(offer2, offers)
+        self.assertEqual(list(order.offers_applied.all()), [offer2])
+        self.assertEqual(res.data['offers_applied'], [offer2.id])
+        event = models.OutboxEvent.objects.get(aggregate_id = str(order.id), event_type = 'order.placed')
+        self.assertEqual(json.loads(event.payload)['offers'], [offer2.id])
 
     def test_retrieve_detail_order_normal_user(self):
         """Test retrieve detail order for normal user"""
@@ -238,6 +264,9 @@ class TestNormalUserOrderApi(TestCase):
     def test_partial_update_order_normal_user(self):
         """Test partial update order"""
         order = sample_order(self.user, self.address, self.address, self.payment_mode)
+        item = sample_shopping_item(self.user, sample_product(self.user, sample_category(self.user)))
+        order.cartItems.add(item)
+        checkout.write_lines(order, [item])
         address2 = sample_shipping_address(self.user, name = 'Address 2')
         payment_mode = sample_payment_mode(self.user, title = 'Credit Card')
         offer = sample_offer(self.user)
@@ -292,6 +321,208 @@ class TestNormalUserOrderApi(TestCase):
         self.assertIn(item2, cart_items)
         self.assertIn(offer2, offers)
 
+    def test_post_order_takes_stock(self):
+        """Test that creating an order takes its cart items from stock"""
+        product = sample_product(self.user, sample_category(self.user), quantity = 5)
+        item = sample_shopping_item(self.user, product, count = 3)
+        payload = {
+            'cartItems': [item.id],
+            'shipping_address': self.address.printable(),
+            'billing_address': self.address.printable(),
+            'payment_mode': self.payment_mode.id,
+        }
+        res = self.client.post(ORDER_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        product.refresh_from_db()
+        self.assertEqual(product.quantity, 2)
+        reservation = models.Reservation.objects.get(order_id = res.data['id'])
+        self.assertEqual(reservation.status, models.Reservation.COMMITTED)
+
+        res = self.client.post(ORDER_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data['cartItems'], [f'Not enough stock for product {product.id}.'])
+        self.assertEqual(models.Order.objects.count(), 1)
+
+    def test_post_order_with_reservation(self):
+        """Test holding stock first and ordering with the reservation"""
+        product = sample_product(self.user, sample_category(self.user), quantity = 5)
+        item = sample_shopping_item(self.user, product, count = 2)
+        res = self.client.post(RESERVE_URL, {'cartItems': [item.id]})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data['status'], models.Reservation.HELD)
+        self.assertEqual(res.data['lines'], [{'product': product.id, 'count': 2}])
+
+        payload = {
+            'cartItems': [item.id],
+            'reservation': res.data['id'],
+            'shipping_address': self.address.printable(),
+            'billing_address': self.address.printable(),
+            'payment_mode': self.payment_mode.id,
+        }
+        res = self.client.post(ORDER_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        product.refresh_from_db()
+        self.assertEqual(product.quantity, 3)
+
+        res = self.client.post(ORDER_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('reservation', res.data)
+
+    def test_post_order_with_reservation_of_other_items(self):
+        """Test that a reservation not matching the cart items is refused"""
+        category = sample_category(self.user)
+        bread = sample_product(self.user, category, quantity = 5)
+        mango = sample_product(self.user, category, title = 'Mango', quantity = 5)
+        held = sample_shopping_item(self.user, bread, count = 1)
+        reservation = self.client.post(RESERVE_URL, {'cartItems': [held.id]}).data['id']
+        payload = {
+            'cartItems': [held.id, sample_shopping_item(self.user, mango, count = 4).id],
+            'reservation': reservation,
+            'shipping_address': self.address.printable(),
+            'billing_address': self.address.printable(),
+            'payment_mode': self.payment_mode.id,
+        }
+        res = self.client.post(ORDER_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data['reservation'], ['Reservation does not match the cart items.'])
+        mango.refresh_from_db()
+        self.assertEqual(mango.quantity, 5)
+
+    def test_post_order_with_items_of_other_user(self):
+        """Test that cart items of another user cannot be ordered"""
+        user2 = sample_user(email = 'newuser@gmail.com', password = 'testpass', is_staff = False)
+        item = sample_shopping_item(user2, sample_product(user2, sample_category(user2)))
+        payload = {
+            'cartItems': [item.id],
+            'shipping_address': self.address.printable(),
+            'billing_address': self.address.printable(),
+            'payment_mode': self.payment_mode.id,
+        }
+        res = self.client.post(ORDER_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('cartItems', res.data)
+        self.assertFalse(models.Order.objects.exists())
+
+    def test_update_cart_items_exchanges_stock(self):
+        """Test that changing the items of an order puts back the old units and takes the new"""
+        category = sample_category(self.user)
+        bread = sample_product(self.user, category, quantity = 5)
+        mango = sample_product(self.user, category, title = 'Mango', quantity = 5)
+        res = self.client.post(ORDER_URL, {
+            'cartItems': [sample_shopping_item(self.user, bread, count = 3).id],
+            'shipping_address': self.address.printable(),
+            'billing_address': self.address.printable(),
+            'payment_mode': self.payment_mode.id,
+        })
+        url = detail_url(res.data['id'])
+
+        item = sample_shopping_item(self.user, mango, count = 6)
+        res = self.client.patch(url, {'cartItems': [item.id]})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data['cartItems'], [f'Not enough stock for product {mango.id}.'])
+
+        models.ShoppingCart.objects.filter(id = item.id).update(count = 4)
+        res = self.client.patch(url, {'cartItems': [item.id]})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        bread.refresh_from_db()
+        mango.refresh_from_db()
+        self.assertEqual((bread.quantity, mango.quantity), (5, 1))
+        self.assertEqual(
+            models.Reservation.objects.get(order_id = res.data['id']).lines.get().product, mango)
+
+    def test_post_order_with_expired_offer(self):
+        """Test that an expired or unknown offer is refused without a query per offer"""
+        active = sample_offer(self.user)
+        expired = sample_offer(
+            self.user, title = 'Expired', expiry_date = timezone.now() - timedelta(days = 1))
+        payload = {
+            'offers_applied': [active.id, expired.id, expired.id + 100],
+            'shipping_address': self.address.printable(),
+            'billing_address': self.address.printable(),
+            'payment_mode': self.payment_mode.id,
+        }
+        res = self.client.post(ORDER_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data['offers_applied'], [f'Offer "{expired.id}" is not active.'])
+        self.assertFalse(models.Order.objects.exists())
+
+    @override_settings(DELIVERY={'CHARGE': 40.0, 'FREE_ABOVE': 500.0, 'DAYS': 3})
+    def test_post_order_saves_price_detail(self):
+        """Test that placing an order stores its totals with it"""
+        category = sample_category(self.user)
+        item1 = sample_shopping_item(self.user, sample_product(self.user, category, price = 20.0), count = 3)
+        item2 = sample_shopping_item(
+            self.user, sample_product(self.user, category, title = 'Product2', price = 15.5), count = 2)
+        active = sample_offer(self.user, percentage = 10.0,
+                              expiry_date = timezone.now() + timedelta(days = 1))
+        payment_mode = sample_payment_mode(self.user, title = 'Card', charges = 5.0)
+        payload = {
+            'cartItems': [item1.id, item2.id],
+            'offers_applied': [active.id],
+            'shipping_address': self.address.printable(),
+            'billing_address': self.address.printable(),
+            'payment_mode': payment_mode.id,
+        }
+        res = self.client.post(ORDER_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        expected = {
+            'subtotal': 91.0,
+            'discount': 9.1,
+            'payment_charges': 5.0,
+            'delievery_charges': 40.0,
+            'grand_total': 126.9,
+        }
+        self.assertEqual(res.data['price_detail'], expected)
+        detail = models.PriceDetail.objects.get(order_id = res.data['id'])
+        self.assertEqual(detail.user, self.user)
+
+        # Orders joined with their totals, then cart items and offers.
+        with self.assertNumQueries(3):
+            res = self.client.get(ORDER_URL)
+        self.assertEqual(res.data['results'][0]['price_detail'], expected)
+
+        res = self.client.patch(detail_url(res.data['results'][0]['id']), {'cartItems': [item1.id]})
+        self.assertEqual(res.data['price_detail']['subtotal'], 60.0)
+        self.assertEqual(res.data['price_detail']['grand_total'], 99.0)
+
+    def test_order_detail_reads_line_snapshots(self):
+        """Test that order lines keep the product as it was at checkout"""
+        category = sample_category(self.user)
+        bread = sample_product(self.user, category, price = 20.0)
+        mango = sample_product(self.user, category, title = 'Mango', price = 50.0, unit = models.Product.KG)
+        items = [sample_shopping_item(self.user, bread, count = 2), sample_shopping_item(self.user, mango, count = 1)]
+        payload = {
+            'cartItems': [item.id for item in items],
+            'shipping_address': self.address.printable(),
+            'billing_address': self.address.printable(),
+            'payment_mode': self.payment_mode.id,
+        }
+        order_id = self.client.post(ORDER_URL, payload).data['id']
+        bread.price = 25.0
+        bread.save()
+        mango_id = mango.id
+        mango.delete()
+
+        # Order with payment mode and totals, its lines, its offers.
+        with self.assertNumQueries(3):
+            res = self.client.get(detail_url(order_id))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(line['product'], line['title'], line['unit'], line['unit_price'], line['count'])
+             for line in res.data['lines']],
+            [(bread.id, 'Brown Bread', models.Product.UNIT, 20.0, 2),
+             (mango_id, 'Mango', models.Product.KG, 50.0, 1)]
+        )
+        self.assertEqual(res.data['lines'][1]['category_id'], category.id)
+        self.assertEqual(res.data['price_detail']['subtotal'], 90.0)
+
+    def test_reserve_items_of_other_user(self):
+        """Test that cart items of another user cannot be reserved"""
+        user2 = sample_user(email='newuser@gmail.com', password='testpass', is_staff=False)
+        item = sample_shopping_item(user2, sample_product(user2, sample_category(user2)))
+        res = self.client.post(RESERVE_URL, {'cartItems': [item.id]})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_delete_order_normal_user(self):
         """Test deleting order for normal user"""
         order = sample_order(self.user, self.address, self.address, self.payment_mode)
@@ -326,6 +557,65 @@ class TestAdminUserOrderApi(TestCase):
         order2.cartItems.add(sample_shopping_item(user2, self.product))
         order2.offers_applied.add(self.offer)
         res = self.client.get(ORDER_URL)
-        orders = models.Order.objects.all().order_by('-id')
+        orders = models.Order.objects.all().order_by('-ordered_on', '-id')
         serializer = OrderSerializer(orders, many = True)
-        self.assertEqual(res.data, serializer.data)
\ No newline at end of file
+        self.assertEqual(res.data['results'], serializer.data)
+
+class TestOrderHistoryApi(TestCase):
+    """Test paging and filtering the order history"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = sample_user(is_staff=True)
+        self.client.force_authenticate(self.user)
+        self.address = sample_shipping_address(self.user)
+        self.upi = sample_payment_mode(self.user)
+        self.card = sample_payment_mode(self.user, title = 'Card')
+        self.start = timezone.make_aware(datetime(2024, 3, 1, 12))
+
+    def sample_orders(self, days, payment_mode = None):
+        """Create one order per day offset, returning their ids"""
+        ids = []
+        for day in days:
+            order = sample_order(
+                self.user, self.address, self.address, payment_mode or self.upi)
+            models.Order.objects.filter(id = order.id).update(
+                ordered_on = self.start + timedelta(days = day))
+            ids.append(order.id)
+        return ids
+
+    def test_pages_follow_ordered_on_then_id(self):
+        """Test that cursors walk every order once, ties broken by id"""
+        ids = self.sample_orders([0, 1, 1, 1, 2])
+        expected = [ids[4], ids[3], ids[2], ids[1], ids[0]]
+        seen = []
+        url = ORDER_URL + '?page_size=2'
+        while url:
+            with self.assertNumQueries(3):
+                res = self.client.get(url)
+            seen += [order['id'] for order in res.data['results']]
+            url = res.data['next']
+        self.assertEqual(seen, expected)
+
+    def test_filter_by_date_range(self):
+        """Test that from and to dates take in whole days"""
+        ids = self.sample_orders([0, 1, 2, 3])
+        res = self.client.get(ORDER_URL, {'from': '2024-03-02', 'to': '2024-03-03'})
+        self.assertEqual([order['id'] for order in res.data['results']], [ids[2], ids[1]])
+        res = self.client.get(ORDER_URL, {'to': '2024-03-02T00:00:00Z'})
+        self.assertEqual([order['id'] for order in res.data['results']], [ids[0]])
+
+    def test_filter_by_payment_mode(self):
+        """Test that orders can be filtered by payment mode"""
+        self.sample_orders([0, 1])
+        card_ids = self.sample_orders([2], payment_mode = self.card)
+        res = self.client.get(ORDER_URL, {'payment_mode': self.card.id})
+        self.assertEqual([order['id'] for order in res.data['results']], card_ids)
+
+    def test_invalid_filters_and_cursor(self):
+        """Test that bad filters are rejected and bad cursors not found"""
+        res = self.client.get(ORDER_URL, {'from': 'yesterday', 'payment_mode': 'card'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(res.data), {'from', 'payment_mode'})
+        res = self.client.get(ORDER_URL, {'cursor': 'not-a-cursor'})
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,172 @@
+from django.db.models import Count
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import models
+from order import status as order_status
+from order.tests.test_order_api import (ORDER_URL, detail_url, sample_category,
+                                        sample_payment_mode, sample_product,
+                                        sample_shipping_address, sample_shopping_item,
+                                        sample_user)
+
+BULK_URL = reverse('order:order-bulk-status')
+COUNTS_URL = reverse('order:order-status-counts')
+
+
+def transition_url(order_id):
+    return reverse('order:order-transition', args=[order_id])
+
+
+def log_url(order_id):
+    return reverse('order:order-status-log', args=[order_id])
+
+
+class OrderStatusTests(TestCase):
+    """Test the order lifecycle, its log and its counters"""
+
+    def setUp(self):
+        self.staff = sample_user()
+        self.buyer = sample_user(email = 'buyer@example.com', is_staff = False)
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+        category = sample_category(self.staff)
+        self.products = [
+            sample_product(self.staff, category, title = f'Loaf {index}', quantity = 20)
+            for index in range(3)
+        ]
+        self.address = sample_shipping_address(self.buyer).printable()
+        self.payment_mode = sample_payment_mode(self.staff)
+
+    def place(self, product):
+        res = self.client.post(ORDER_URL, {
+            'cartItems': [sample_shopping_item(self.buyer, product).id],
+            'shipping_address': self.address,
+            'billing_address': self.address,
+            'payment_mode': self.payment_mode.id,
+        })
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data['status'], models.Order.PLACED)
+        return res.data['id']
+
+    def assertCountsMatchOrders(self):
+        expected = dict.fromkeys(dict(models.Order.STATUS_CHOICES), 0)
+        expected.update(models.Order.objects.values('status').annotate(
+            total = Count('id')).order_by().values_list('status', 'total'))
+        self.assertEqual(order_status.status_counts(), expected)
+
+    def test_only_placed_orders_can_be_updated(self):
+        """Test that an order moved past placed refuses changes"""
+        order_id = self.place(self.products[0])
+        res = self.client.patch(detail_url(order_id), {'billing_address': 'Elsewhere'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        order_status.transition([order_id], models.Order.PACKED, user = self.staff)
+        res = self.client.patch(detail_url(order_id), {'billing_address': 'Somewhere else'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data['status'], ['A packed order can no longer be changed.'])
+        self.assertEqual(models.Order.objects.get(id = order_id).billing_address, 'Elsewhere')
+
+    def test_staff_moves_order_through_lifecycle(self):
+        """Test that each allowed transition is applied and logged"""
+        order_id = self.place(self.products[0])
+        self.client.force_authenticate(self.staff)
+        for to_status in ('packed', 'shipped', 'delivered'):
+            res = self.client.post(transition_url(order_id), {'status': to_status, 'note': 'ok'})
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(res.data['status'], to_status)
+        self.assertEqual(models.Order.objects.get(id = order_id).status, 'delivered')
+
+        self.client.force_authenticate(self.buyer)
+        res = self.client.get(log_url(order_id))
+        self.assertEqual(
+            [(entry['from_status'], entry['to_status']) for entry in res.data],
+            [('', 'placed'), ('placed', 'packed'), ('packed', 'shipped'), ('shipped', 'delivered')])
+        self.assertEqual(res.data[1]['user'], self.staff.id)
+        self.assertCountsMatchOrders()
+
+    def test_invalid_transition_is_refused(self):
+        """Test that an order cannot skip a status or leave a final one"""
+        order_id = self.place(self.products[0])
+        self.client.force_authenticate(self.staff)
+        res = self.client.post(transition_url(order_id), {'status': 'delivered'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.post(transition_url(order_id), {'status': 'cancelled'})
+        res = self.client.post(transition_url(order_id), {'status': 'packed'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(models.Order.objects.get(id = order_id).status, 'cancelled')
+        self.assertEqual(models.OrderStatusLog.objects.filter(order_id = order_id).count(), 2)
+        self.assertCountsMatchOrders()
+
+    def test_cancelling_puts_stock_back(self):
+        """Test that cancelled orders return their units to stock with one movement per line"""
+        ids = [self.place(product) for product in self.products[:2]]
+        order_status.transition(ids[1:], models.Order.PACKED, user = self.staff)
+        with self.assertNumQueries(15):
+            moved, rejected = order_status.transition(ids, models.Order.CANCELLED, user = self.staff)
+        self.assertEqual(sorted(moved), ids)
+        for product in self.products[:2]:
+            product.refresh_from_db()
+            self.assertEqual(product.quantity, 20)
+        releases = models.StockMovement.objects.filter(kind = models.StockMovement.RELEASE)
+        self.assertEqual(
+            sorted(releases.values_list('product_id', 'delta')),
+            [(product.id, 2) for product in self.products[:2]])
+        self.assertFalse(models.Reservation.objects.filter(
+            order_id__in = ids, status = models.Reservation.COMMITTED).exists())
+
+    def test_transitions_are_staff_only(self):
+        """Test that buyers cannot change the status of their orders"""
+        order_id = self.place(self.products[0])
+        res = self.client.post(transition_url(order_id), {'status': 'packed'})
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+        res = self.client.post(BULK_URL, {'orders': [order_id], 'status': 'packed'})
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+        res = self.client.get(COUNTS_URL)
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_bulk_transition_moves_allowed_orders(self):
+        """Test that a bulk action moves the orders it can and reports the others"""
+        ids = [self.place(product) for product in self.products]
+        self.client.force_authenticate(self.staff)
+        self.client.post(transition_url(ids[2]), {'status': 'cancelled'})
+        res = self.client.post(BULK_URL, {
+            'orders': ids + [ids[2] + 100], 'status': 'packed', 'note': 'morning batch',
+        }, format = 'json')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['moved'], ids[:2])
+        self.assertEqual(res.data['rejected'], {str(ids[2]): 'cancelled'})
+        self.assertEqual(res.data['missing'], [ids[2] + 100])
+        self.assertEqual(
+            models.OutboxEvent.objects.filter(event_type = 'order.status_changed').count(), 3)
+
+        res = self.client.get(COUNTS_URL)
+        self.assertEqual(res.data['packed'], 2)
+        self.assertEqual(res.data['cancelled'], 1)
+        self.assertEqual(res.data['placed'], 0)
+        self.assertCountsMatchOrders()
+
+    def test_bulk_transition_queries_do_not_grow_with_orders(self):
+        """Test that a bulk action runs the same statements for one or many orders"""
+        ids = [self.place(product) for product in self.products]
+        with self.assertNumQueries(7):
+            order_status.transition(ids[:1], 'packed')
+        with self.assertNumQueries(7):
+            order_status.transition(ids[1:], 'packed')
+
+    def test_status_counts_read_counter_rows(self):
+        """Test that the counts come from one query over the counters"""
+        self.place(self.products[0])
+        with self.assertNumQueries(1):
+            counts = order_status.status_counts()
+        self.assertEqual(counts['placed'], 1)
+
+    def test_filter_history_by_status(self):
+        """Test that the order list filters by status"""
+        ids = [self.place(product) for product in self.products[:2]]
+        order_status.transition(ids[:1], 'packed')
+        res = self.client.get(ORDER_URL, {'status': 'packed'})
+        self.assertEqual([order['id'] for order in res.data['results']], ids[:1])
+        res = self.client.get(ORDER_URL, {'status': 'lost'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
@@ -9,6 +9,7 @@ router = DefaultRouter()
 
 router.register('paymentmode', views.PaymentModeView)
 router.register('order', views.OrderView)
+router.register('report', views.SalesReportView, basename = 'report')
 
 urlpatterns = [
     path('', include(router.urls)),
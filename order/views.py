@@ -1,10 +1,24 @@
-from rest_framework.viewsets import ModelViewSet, GenericViewSet
-from rest_framework import mixins
-from rest_framework.permissions import IsAuthenticated
-from rest_framework.authentication import TokenAuthentication
+import json
+from datetime import datetime, time, timedelta
 
-from core import models
+from django.db.models import Prefetch
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.viewsets import ModelViewSet, GenericViewSet, ViewSet
+from rest_framework import mixins, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+
+from core import models, rollups
+from core.authentication import TokenAuthentication
+from core.pagination import KeysetPagination
+from core.idempotency import idempotent
 from order import serializers
+from order import status as order_status
 from core.permissions import IsStaffOrAuthenticated
 
 
@@ -27,17 +41,215 @@ class OrderView(GenericViewSet,
     serializer_class = serializers.OrderSerializer
     permission_classes = (IsAuthenticated,)
     authentication_classes = (TokenAuthentication,)
-    queryset = models.Order.objects.all().order_by('-id')
+    queryset = models.Order.objects.select_related('pricedetail').order_by('-ordered_on', '-id')
+    pagination_class = KeysetPagination
+
+    def archived(self):
+        """Whether the order list reads the archived orders, ?archived=true"""
+        return (self.action == 'list' and
+                self.request.query_params.get('archived') in ('1', 'true'))
 
     def get_queryset(self):
+        queryset = self.queryset
+        if self.archived():
+            queryset = self.filter_history(
+                models.ArchivedOrder.objects.order_by('-ordered_on', '-id'))
+        elif self.action == 'retrieve':
+            queryset = queryset.select_related('payment_mode').prefetch_related(
+                Prefetch('lines', queryset=models.OrderLine.objects.order_by('id')),
+                'offers_applied',
+            )
+        elif self.action == 'list':
+            queryset = self.filter_history(queryset).prefetch_related(
+                Prefetch('cartItems', queryset=models.ShoppingCart.objects.only('id')),
+                Prefetch('offers_applied', queryset=models.Offer.objects.only('id')),
+            )
         if not self.request.user.is_staff:
-            return self.queryset.filter(user=self.request.user)
-        return self.queryset
+            return queryset.filter(user=self.request.user)
+        return queryset
+
+    def get_archived_object(self):
+        """The archived order of the url, for orders no longer in the hot table"""
+        queryset = models.ArchivedOrder.objects.all()
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(user=self.request.user)
+        return get_object_or_404(queryset, pk=self.kwargs['pk'])
+
+    def filter_history(self, queryset):
+        """Filter the order list by ?from= and ?to= dates or datetimes, ?payment_mode= and ?status="""
+        params = self.request.query_params
+        errors = {}
+        # A to date takes in the whole day, up to the start of the next one.
+        for name, lookup, days_after in (('from', 'gte', 0), ('to', 'lt', 1)):
+            if not params.get(name):
+                continue
+            try:
+                moment = parse_datetime(params[name])
+                day = None if moment else parse_date(params[name])
+            except ValueError:
+                moment = day = None
+            if moment is None and day is None:
+                errors[name] = ['Enter a date or a datetime.']
+                continue
+            if moment is None:
+                moment = timezone.make_aware(datetime.combine(
+                    day + timedelta(days = days_after), time.min))
+            elif days_after:
+                lookup = 'lte'
+            queryset = queryset.filter(**{f'ordered_on__{lookup}': moment})
+        if params.get('payment_mode'):
+            if params['payment_mode'].isdigit():
+                queryset = queryset.filter(payment_mode_id=params['payment_mode'])
+            else:
+                errors['payment_mode'] = ['Enter a payment mode id.']
+        if params.get('status'):
+            if params['status'] in dict(models.Order.STATUS_CHOICES):
+                queryset = queryset.filter(status=params['status'])
+            else:
+                errors['status'] = ['Enter an order status.']
+        if errors:
+            raise ValidationError(errors)
+        return queryset
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            order = self.get_archived_object()
+        order = models.ArchivedOrder.objects.select_related('payment_mode').prefetch_related(
+            Prefetch('lines', queryset=models.ArchivedOrderLine.objects.order_by('id'))
+        ).get(pk=order.pk)
+        return Response(serializers.ArchivedOrderDetailSerializer(
+            order, context=self.get_serializer_context()).data)
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
 
     def perform_create(self, serializer):
         return serializer.save(user=self.request.user)
 
     def get_serializer_class(self):
+        if self.archived():
+            return serializers.ArchivedOrderSerializer
         if self.action == 'retrieve':
             return serializers.OrderDetailSerializer
+        if self.action == 'reserve':
+            return serializers.ReservationSerializer
+        if self.action == 'transition':
+            return serializers.StatusTransitionSerializer
+        if self.action == 'bulk_status':
+            return serializers.BulkStatusTransitionSerializer
+        if self.action == 'status_log':
+            return serializers.OrderStatusLogSerializer
         return self.serializer_class
+
+    @action(methods = ['POST'], detail = False)
+    def reserve(self, request):
+        """Hold the stock of cart items while the order is being paid"""
+        serializer = self.get_serializer(data = request.data)
+        serializer.is_valid(raise_exception = True)
+        serializer.save(user = request.user)
+        return Response(serializer.data, status = status.HTTP_201_CREATED)
+
+    @action(methods = ['POST'], detail = True, permission_classes = (IsAdminUser,))
+    def transition(self, request, pk = None):
+        """Move an order to another status, staff only"""
+        order = self.get_object()
+        serializer = self.get_serializer(data = request.data)
+        serializer.is_valid(raise_exception = True)
+        to_status = serializer.validated_data['status']
+        try:
+            order_status.transition(
+                [order.id], to_status, user = request.user,
+                note = serializer.validated_data['note'], strict = True)
+        except order_status.InvalidTransition as exc:
+            raise ValidationError({'status': [
+                f'Cannot move a {exc.rejected[order.id]} order to {to_status}.'
+            ]})
+        return Response({'id': order.id, 'status': to_status})
+
+    @action(methods = ['POST'], detail = False, url_path = 'bulk-status',
+            permission_classes = (IsAdminUser,))
+    def bulk_status(self, request):
+        """Move many orders to another status, skipping those that cannot move, staff only"""
+        serializer = self.get_serializer(data = request.data)
+        serializer.is_valid(raise_exception = True)
+        data = serializer.validated_data
+        moved, rejected = order_status.transition(
+            data['orders'], data['status'], user = request.user, note = data['note'])
+        return Response({
+            'status': data['status'],
+            'moved': sorted(moved),
+            'rejected': {str(pk): current for pk, current in sorted(rejected.items())},
+            'missing': sorted(set(data['orders']) - set(moved) - set(rejected)),
+        })
+
+    @action(methods = ['GET'], detail = True, url_path = 'status-log')
+    def status_log(self, request, pk = None):
+        """Status changes of an order, oldest first"""
+        try:
+            order = self.get_object()
+        except Http404:
+            return Response(json.loads(self.get_archived_object().status_log))
+        log = order.status_log.order_by('id')
+        return Response(self.get_serializer(log, many = True).data)
+
+    @action(methods = ['GET'], detail = False, url_path = 'status-counts',
+            permission_classes = (IsAdminUser,))
+    def status_counts(self, request):
+        """Number of orders in every status, read from the status counters"""
+        return Response(order_status.status_counts())
+
+
+class SalesReportView(ViewSet):
+    """
+    Staff sales reports read from the daily rollups of core.rollups.
+
+    `?from=` and `?to=` take inclusive dates, the last 30 days by default,
+    and `?by=total` sums the days of the range.
+    """
+    permission_classes = (IsAdminUser,)
+    authentication_classes = (TokenAuthentication,)
+
+    def day(self, request, name, default):
+        """Date of a query parameter, raise ValueError if it is not one"""
+        value = request.query_params.get(name)
+        if not value:
+            return default
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        return day
+
+    def report(self, request, model, key, names):
+        try:
+            end = self.day(request, 'to', timezone.localdate())
+            start = self.day(request, 'from', end - timedelta(days = 29))
+        except ValueError:
+            start = end = None
+        if start is None or start > end:
+            return Response(
+                {'detail': 'from and to must be dates, from not after to.'},
+                status = status.HTTP_400_BAD_REQUEST
+            )
+        rows = rollups.report(
+            model, key, start, end, by_day = request.query_params.get('by') != 'total')
+        titles = dict(names.filter(id__in = {row[key] for row in rows}))
+        for row in rows:
+            row['name'] = titles.get(row[key], '')
+        return Response({'from': start, 'to': end, 'rows': rows})
+
+    @action(methods = ['GET'], detail = False)
+    def categories(self, request):
+        """Orders, units and revenue per day and category"""
+        return self.report(
+            request, models.CategorySales, 'category_id',
+            models.Category.objects.values_list('id', 'name'))
+
+    @action(methods = ['GET'], detail = False, url_path = 'payment-modes')
+    def payment_modes(self, request):
+        """Orders, discounts and grand totals per day and payment mode"""
+        return self.report(
+            request, models.PaymentModeSales, 'payment_mode_id',
+            models.PaymentMode.objects.values_list('id', 'title'))
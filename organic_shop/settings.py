@@ -56,6 +56,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.SlowQueryLogMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,6 +64,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
+    'core.middleware.ProfilerMiddleware',
     'core.middleware.CORSMiddleware'
 ]
 
@@ -100,9 +103,40 @@ DATABASES = {
         'USER': os.environ['POSTGRES_USER'],
         'PASSWORD': os.environ['POSTGRES_PASSWORD'],
         'PORT': os.environ['POSTGRES_PORT'],
+        'CONN_MAX_AGE': int(os.environ.get('POSTGRES_CONN_MAX_AGE', 0)),
     }
 }
 
+# Per-worker connection pool used by the core.db.backends.postgresql engine.
+# HEALTH_CHECKS also pings persistent connections (CONN_MAX_AGE > 0) at the
+# start of a request, unless they ran a query within the last second.
+
+DATABASE_POOL = {
+    'SIZE': int(os.environ.get('POSTGRES_POOL_SIZE', 10)),
+    'MAX_LIFETIME': int(os.environ.get('POSTGRES_POOL_MAX_LIFETIME', 1800)),
+    'HEALTH_CHECKS': os.environ.get('POSTGRES_POOL_HEALTH_CHECKS', '1') == '1',
+    'TIMEOUT': int(os.environ.get('POSTGRES_POOL_TIMEOUT', 10)),
+}
+
+# Read replicas share the default settings except for the host. Safe-method
+# reads of views with `replica_reads = True` are routed to them, except for
+# users who wrote within DATABASE_REPLICA_PIN_SECONDS. Token clients are
+# pinned through the cache, which must be shared by the workers (CACHES).
+
+DATABASE_REPLICAS = []
+
+for index, host in enumerate(filter(None, os.environ.get('POSTGRES_REPLICA_HOSTS', '').split(','))):
+    alias = f'replica_{index}'
+    DATABASES[alias] = dict(DATABASES['default'], HOST=host, TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+
+# 'round_robin' or 'least_latency'
+DATABASE_REPLICA_SELECTION = os.environ.get('POSTGRES_REPLICA_SELECTION', 'round_robin')
+
+DATABASE_REPLICA_PIN_SECONDS = int(os.environ.get('POSTGRES_REPLICA_PIN_SECONDS', 15))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -146,4 +180,176 @@ MEDIA_URL = '/media/'
 
 MEDIA_ROOT = os.path.join(os.environ['MEDIA_ROOT'], 'media')
 
-AUTH_USER_MODEL = 'core.User'
\ No newline at end of file
+AUTH_USER_MODEL = 'core.User'
+
+
+# The default LocMemCache is private to each worker process. Cart summaries,
+# replica pins and the active offers version are only invalidated across
+# workers with a shared backend, e.g.
+# CACHE_BACKEND=django.core.cache.backends.memcached.PyLibMCCache and
+# CACHE_LOCATION=127.0.0.1:11211. Without one they are refreshed per worker
+# after CART_SUMMARY_TIMEOUT and OFFERS['MAX_AGE'].
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    },
+}
+
+
+# Cache alias used to coalesce product detail reads across workers.
+# Leave unset to coalesce only within a worker process.
+
+PRODUCT_SINGLE_FLIGHT_CACHE = os.environ.get('PRODUCT_SINGLE_FLIGHT_CACHE')
+
+
+# Slow-query log, see core/slowlog.py. Entries are written as JSON lines to
+# a rotating file.
+
+SLOW_QUERY_LOG = {
+    'ENABLED': os.environ.get('SLOW_QUERY_LOG', '0') == '1',
+    'THRESHOLD_MS': float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 200)),
+    'SAMPLE_RATE': float(os.environ.get('SLOW_QUERY_SAMPLE_RATE', 1.0)),
+    'EXPLAIN': True,
+    'ANALYZE_RATE': float(os.environ.get('SLOW_QUERY_ANALYZE_RATE', 0.0)),
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {
+            '()': 'core.slowlog.JsonFormatter',
+        },
+    },
+    'handlers': {
+        'slow_queries': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': os.environ.get('SLOW_QUERY_LOG_FILE', os.path.join(BASE_DIR, 'slow_queries.log')),
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'delay': True,
+            'formatter': 'json',
+        },
+    },
+    'loggers': {
+        'core.slowlog': {
+            'handlers': ['slow_queries'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
+
+# Staff request profiler, see core/profiling.py. Add ?_profile=text|json|collapsed
+# or an X-Profile header to a request made as a staff user.
+
+PROFILER = {
+    'STORE_DIR': os.environ.get('PROFILER_STORE_DIR', os.path.join(BASE_DIR, 'profiles')),
+    'MAX_PROFILES': int(os.environ.get('PROFILER_MAX_PROFILES', 50)),
+    'SAMPLE_INTERVAL': 0.001,
+}
+
+
+# Delivery charged on orders below FREE_ABOVE, see core/pricing.py.
+
+DELIVERY = {
+    'CHARGE': float(os.environ.get('DELIVERY_CHARGE', 40)),
+    'FREE_ABOVE': float(os.environ.get('DELIVERY_FREE_ABOVE', 500)),
+    'DAYS': int(os.environ.get('DELIVERY_DAYS', 3)),
+}
+
+# Seconds a cart summary is cached, which bounds how stale it may be on
+# workers that did not see the write when the cache is not shared.
+
+CART_SUMMARY_TIMEOUT = int(os.environ.get('CART_SUMMARY_TIMEOUT', 30))
+
+
+# Where anonymous carts are kept, see shopping/storage.py: db, cache or
+# cookie. Cache and cookie carts move to the database past MAX_ITEMS.
+
+SESSION_CART = {
+    'BACKEND': os.environ.get('SESSION_CART_BACKEND', 'db'),
+    'MAX_ITEMS': int(os.environ.get('SESSION_CART_MAX_ITEMS', 20)),
+    'TIMEOUT': 14 * 24 * 60 * 60,
+}
+
+
+# Retention of stale rows, see core/retention.py and `manage.py purge`.
+
+RETENTION = {
+    'SESSION_CART_DAYS': int(os.environ.get('RETENTION_SESSION_CART_DAYS', 30)),
+    'TOKEN_DAYS': int(os.environ.get('RETENTION_TOKEN_DAYS', 180)),
+    'TOKEN_TOUCH_SECONDS': int(os.environ.get('RETENTION_TOKEN_TOUCH_SECONDS', 3600)),
+    'JOB_DAYS': int(os.environ.get('RETENTION_JOB_DAYS', 7)),
+    'OUTBOX_DAYS': int(os.environ.get('RETENTION_OUTBOX_DAYS', 7)),
+    'BATCH_SIZE': int(os.environ.get('RETENTION_BATCH_SIZE', 500)),
+    'ROWS_PER_SECOND': int(os.environ.get('RETENTION_ROWS_PER_SECOND', 2000)),
+}
+
+
+# Stock held by checkout reservations, see core/inventory.py. Expired holds
+# are released by `manage.py release_reservations`.
+
+INVENTORY = {
+    'HOLD_SECONDS': int(os.environ.get('INVENTORY_HOLD_SECONDS', 15 * 60)),
+}
+
+
+# Stock ledger snapshots, see core/stock.py and `manage.py stock_snapshot`.
+
+STOCK = {
+    'SNAPSHOT_LAG_SECONDS': int(os.environ.get('STOCK_SNAPSHOT_LAG_SECONDS', 60)),
+}
+
+
+# Responses of create requests sent with an Idempotency-Key header, see
+# core/idempotency.py. Expired keys are deleted by `manage.py purge`.
+
+IDEMPOTENCY = {
+    'TTL_SECONDS': int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 24 * 60 * 60)),
+}
+
+
+# Background jobs, see core/jobs.py. Run them with `manage.py worker`.
+
+JOBS = {
+    'THREADS': int(os.environ.get('JOBS_THREADS', 4)),
+    'POLL_SECONDS': float(os.environ.get('JOBS_POLL_SECONDS', 1)),
+    'MAX_ATTEMPTS': int(os.environ.get('JOBS_MAX_ATTEMPTS', 5)),
+}
+
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'orders@organic-shop.local')
+
+
+# Order and catalog events for downstream systems, see core/outbox.py.
+# `manage.py relay_outbox` delivers them to these sinks.
+
+OUTBOX = {
+    'SINKS': [
+        {'BACKEND': 'file', 'PATH': os.environ.get('OUTBOX_FILE', os.path.join(BASE_DIR, 'outbox.jsonl'))},
+    ] + ([
+        {'BACKEND': 'http', 'URL': os.environ['OUTBOX_HTTP_URL']},
+    ] if os.environ.get('OUTBOX_HTTP_URL') else []),
+    'BATCH_SIZE': int(os.environ.get('OUTBOX_BATCH_SIZE', 100)),
+}
+
+
+# Cold order archive, see core/archive.py. Orders in a final status older
+# than DAYS are moved by `manage.py archive_orders` or the order.archive job.
+
+ARCHIVE = {
+    'DAYS': int(os.environ.get('ARCHIVE_DAYS', 365)),
+    'BATCH_SIZE': int(os.environ.get('ARCHIVE_BATCH_SIZE', 500)),
+}
+
+
+# Active offers kept in memory by every process, see offers/active.py.
+# Changes made by other processes are picked up within MAX_AGE seconds.
+
+OFFERS = {
+    'MAX_AGE': int(os.environ.get('OFFERS_MAX_AGE', 30)),
+}
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from core.models import Category, Product
+from core.models import Category, Product, StockMovement
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -33,4 +33,24 @@ class ProductImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = ('id', 'image')
-        read_only_fields = ('id',)
\ No newline at end of file
+        read_only_fields = ('id',)
+
+
+class StockMovementSerializer(serializers.ModelSerializer):
+    """Serializer for a stock movement recorded by staff"""
+
+    kind = serializers.ChoiceField(choices=(
+        StockMovement.RECEIPT, StockMovement.RETURN, StockMovement.ADJUSTMENT))
+
+    class Meta:
+        model = StockMovement
+        fields = ('id', 'product', 'kind', 'delta', 'note', 'created_on')
+        read_only_fields = ('id', 'product', 'created_on')
+
+    def validate(self, attrs):
+        """Receipts and returns add stock, adjustments change it"""
+        if attrs['delta'] == 0:
+            raise serializers.ValidationError({'delta': 'Delta must not be zero.'})
+        if attrs['kind'] != StockMovement.ADJUSTMENT and attrs['delta'] < 0:
+            raise serializers.ValidationError({'delta': 'Only adjustments can remove stock.'})
+        return attrs
@@ -0,0 +1,21 @@
+from PIL import Image
+
+from core import models
+from core.jobs import task
+
+IMAGE_MAX_SIZE = (1200, 1200)
+
+
+@task('product.process_image')
+def process_image(product_id, image):
+    """Shrink an uploaded product image to IMAGE_MAX_SIZE and optimize it"""
+    product = models.Product.objects.filter(id=product_id).first()
+    if product is None or product.image.name != image:
+        # Deleted, or another image was uploaded since.
+        return
+    with Image.open(product.image.path) as picture:
+        image_format = picture.format
+        if picture.width <= IMAGE_MAX_SIZE[0] and picture.height <= IMAGE_MAX_SIZE[1]:
+            return
+        picture.thumbnail(IMAGE_MAX_SIZE)
+        picture.save(product.image.path, format=image_format, optimize=True)
@@ -1,12 +1,16 @@
 import os
 import tempfile
+from unittest.mock import patch
 
-from core.models import Category, Product
+from core import jobs, routers
+from core.models import Category, Job, Product, StockMovement
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase
 from django.urls import reverse
 from PIL import Image
-from product.serializers import ProductSerializer
+from product.serializers import ProductDetailSerializer, ProductSerializer
+from product.views import product_flight
 from rest_framework import status
 from rest_framework.test import APIClient
 
@@ -21,6 +25,10 @@ def product_upload_url(product_id):
     """Return url for product image upload"""
     return reverse('product:product-upload-image', args=[product_id])
 
+def stock_url(product_id):
+    """Return the stock url of a product"""
+    return reverse('product:product-stock', args=[product_id])
+
 def sample_user(email='test_user@gmail.com', password='testpassword', is_staff=True):
     """Create and return admin user"""
     return get_user_model().objects.create_user(
@@ -114,6 +122,38 @@ class TestPrivateProductApi(TestCase):
 
         self.assertEqual(res.data, serializer.data)
 
+    def test_retrieve_product_detail(self):
+        """Test retrieving a product with its category details"""
+        category = sample_category(user=self.user)
+        product = sample_product(user=self.user, category=category)
+        res = self.client.get(detail_url(product.id))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        serializer = ProductDetailSerializer(
+            product, context={'request': res.wsgi_request})
+        self.assertEqual(res.data, serializer.data)
+
+    def test_only_plain_unpinned_reads_are_coalesced(self):
+        """Test that filtered or pinned product reads skip the shared lookup"""
+        category = sample_category(user=self.user)
+        product = sample_product(user=self.user, category=category)
+        cache.delete(routers.pin_key(self.user.pk))
+        with patch.object(product_flight, 'do', wraps=product_flight.do) as do:
+            res = self.client.get(detail_url(product.id))
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(do.call_count, 1)
+
+            res = self.client.get(detail_url(product.id), {'categories': category.id + 1})
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+            self.client.cookies[routers.PIN_COOKIE] = '1'
+            res = self.client.get(detail_url(product.id))
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(do.call_count, 1)
+
+    def test_retrieve_missing_product(self):
+        """Test retrieving a product that does not exist"""
+        res = self.client.get(detail_url(999))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_post_product_by_admin_successful(self):
         """Test creating products by admin user"""
         category = sample_category(user=self.user)
@@ -182,6 +222,8 @@ class TestPrivateProductApi(TestCase):
         self.client.delete(url)
         products = Product.objects.filter(id=pid)
         self.assertEqual(len(products), 0)
+        # The stock ledger of the product is kept.
+        self.assertTrue(StockMovement.objects.filter(product_id=pid).exists())
 
     def test_filter_products_with_category(self):
         """Test filtering the products with category"""
@@ -204,6 +246,34 @@ class TestPrivateProductApi(TestCase):
         self.assertNotIn(product3, res.data)
 
 
+    def test_update_quantity_records_adjustment(self):
+        """Test that changing the quantity appends a stock adjustment"""
+        product = sample_product(user=self.user, category=sample_category(user=self.user), quantity=5)
+        self.client.patch(detail_url(product.id), {'quantity': 8})
+        movement = StockMovement.objects.filter(product=product).latest('id')
+        self.assertEqual((movement.kind, movement.delta), (StockMovement.ADJUSTMENT, 3))
+
+    def test_stock_receipt_and_level(self):
+        """Test recording a receipt and reading the stock from the ledger"""
+        product = sample_product(user=self.user, category=sample_category(user=self.user), quantity=5)
+        res = self.client.post(stock_url(product.id), {'kind': 'receipt', 'delta': 4})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data['delta'], 4)
+
+        res = self.client.get(stock_url(product.id))
+        self.assertEqual(res.data['quantity'], 9)
+        product.refresh_from_db()
+        self.assertEqual(product.quantity, 9)
+
+    def test_stock_adjustment_below_zero(self):
+        """Test that an adjustment cannot take more units than left"""
+        product = sample_product(user=self.user, category=sample_category(user=self.user), quantity=2)
+        res = self.client.post(stock_url(product.id), {'kind': 'adjustment', 'delta': -3})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.client.post(stock_url(product.id), {'kind': 'receipt', 'delta': -1})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(StockMovement.objects.filter(product=product).count(), 1)
+
 class ProductImageUploadTest(TestCase):
     """Test the image upload to Product object api"""
 
@@ -256,6 +326,23 @@ class ProductImageUploadTest(TestCase):
         self.assertFalse(os.path.exists(old_file_path))
 
 
+    def test_uploaded_image_is_shrunk_in_background(self):
+        """Test that a large upload is resized by a job, not the request"""
+        url = product_upload_url(self.product.id)
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            img = Image.new('RGB', size = (2400, 600))
+            img.save(ntf, 'JPEG')
+            ntf.seek(0)
+            self.client.post(url, {'image': ntf}, format = 'multipart')
+        self.product.refresh_from_db()
+        with Image.open(self.product.image.path) as uploaded:
+            self.assertEqual(uploaded.size, (2400, 600))
+        self.assertTrue(Job.objects.filter(name = 'product.process_image').exists())
+
+        jobs.Worker(threads = 1).run(once = True)
+        with Image.open(self.product.image.path) as processed:
+            self.assertEqual(processed.size, (1200, 300))
+
     def test_upload_image_bad_request(self):
         """Test uploading invalid image to product"""
         url = product_upload_url(self.product.id)
@@ -1,14 +1,25 @@
 import os
 from django.http import HttpResponse
 from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
-from rest_framework import status, viewsets, authentication
+from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
 from core import permissions
-from core import models
+from core import jobs, models, outbox, routers, stock
+from core.authentication import TokenAuthentication
+from core.singleflight import SingleFlight
 from product import serializers
+from shopping import cart
+
+
+product_flight = SingleFlight(
+    cache_alias=getattr(settings, 'PRODUCT_SINGLE_FLIGHT_CACHE', None)
+)
 
 
 def greet(request):
@@ -19,9 +30,10 @@ def greet(request):
 class CategoryView(viewsets.ModelViewSet):
     """Category by View"""
     serializer_class = serializers.CategorySerializer
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (TokenAuthentication,)
     permission_classes = (permissions.IsStaffOrReadOnly,)
     queryset = models.Category.objects.all()
+    replica_reads = True
 
     def perform_create(self, serializer):
         return serializer.save(user = self.request.user)
@@ -31,13 +43,43 @@ class ProductView(viewsets.ModelViewSet):
     """Viewset for Product object"""
 
     serializer_class = serializers.ProductSerializer
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (TokenAuthentication,)
     permission_classes = (permissions.IsStaffOrReadOnly,)
     queryset = models.Product.objects.all().order_by('id')
+    replica_reads = True
 
     def perform_create(self, serializer):
         # self.request.session['username'] = self.request.user.get_email_field_name()
-        return serializer.save(user = self.request.user)
+        with transaction.atomic():
+            product = serializer.save(user = self.request.user)
+            outbox.publish('product', product.id, 'created', serializer.data)
+        return product
+
+    def perform_update(self, serializer):
+        """Record a change of quantity as a stock adjustment"""
+        quantity = serializer.validated_data.get('quantity')
+        with transaction.atomic():
+            if quantity is not None:
+                current = models.Product.objects.select_for_update().values_list(
+                    'quantity', flat = True).get(id = serializer.instance.id)
+            previous = (serializer.instance.price, serializer.instance.category_id)
+            product = serializer.save()
+            if (product.price, product.category_id) != previous:
+                cart.invalidate_prices()
+            if quantity is not None and quantity != current:
+                models.StockMovement.objects.create(
+                    product = product, kind = models.StockMovement.ADJUSTMENT,
+                    delta = quantity - current, user = self.request.user,
+                    note = 'product update')
+            outbox.publish('product', product.id, 'updated', serializer.data)
+            return product
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            product_id = instance.id
+            instance.delete()
+            cart.invalidate_prices()
+            outbox.publish('product', product_id, 'deleted', {'id': product_id})
 
     def get_queryset(self):
         """Customized queryset for filtering by category feature"""
@@ -49,14 +91,70 @@ class ProductView(viewsets.ModelViewSet):
             queryset = models.Product.objects.filter(category__in = categories)
         return queryset
 
+    def retrieve(self, request, *args, **kwargs):
+        """Share one lookup between concurrent plain reads of the same product"""
+        # Filtered lookups and writers pinned to the primary may see another
+        # answer than the shared one, they read on their own.
+        if request.query_params or routers.is_pinned(request):
+            return super().retrieve(request, *args, **kwargs)
+        lookup = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        key = f'product:{request.get_host()}:{lookup}'
+
+        def load():
+            response = super(ProductView, self).retrieve(request, *args, **kwargs)
+            return dict(response.data)
+
+        return Response(product_flight.do(key, load))
+
     def get_serializer_class(self):
         """Return detail serializer for retrieve action"""
         if self.action == 'retrieve':
             return serializers.ProductDetailSerializer
         if self.action == 'upload_image':
             return serializers.ProductImageSerializer
+        if self.action == 'stock':
+            return serializers.StockMovementSerializer
         return self.serializer_class
 
+    @action(methods = ['GET', 'POST'], detail = True)
+    def stock(self, request, pk = None):
+        """
+        Stock of the product from the ledger, at `?at=<datetime>` if given.
+        Staff post receipts, returns and adjustments.
+        """
+        product = self.get_object()
+        if request.method == 'POST':
+            serializer = self.get_serializer(data = request.data)
+            serializer.is_valid(raise_exception = True)
+            try:
+                movement = stock.record(
+                    product.id, user = request.user, **serializer.validated_data)
+            except stock.InsufficientStock:
+                return Response(
+                    {'delta': ['Not enough stock for this adjustment.']},
+                    status = status.HTTP_400_BAD_REQUEST
+                )
+            return Response(
+                self.get_serializer(movement).data,
+                status = status.HTTP_201_CREATED
+            )
+
+        at = request.query_params.get('at')
+        if at:
+            at = parse_datetime(at)
+            if at is None:
+                return Response(
+                    {'at': ['Invalid datetime.']},
+                    status = status.HTTP_400_BAD_REQUEST
+                )
+            if timezone.is_naive(at):
+                at = timezone.make_aware(at)
+        return Response({
+            'product': product.id,
+            'quantity': stock.stock_levels([product.id], at)[product.id],
+            'at': at or timezone.now(),
+        })
+
     @action(methods = ['POST'], detail = True, url_path='upload-image')
     def upload_image(self, request, pk = None):
         """Upload image to product"""
@@ -71,7 +169,8 @@ class ProductView(viewsets.ModelViewSet):
             if image:
                 old_image_path = os.path.join(settings.MEDIA_ROOT, image.path)
                 os.remove(old_image_path)
-            serializer.save()
+            product = serializer.save()
+            jobs.enqueue('product.process_image', product_id = product.id, image = product.image.name)
             return Response(
                 serializer.data,
                 status = status.HTTP_200_OK 
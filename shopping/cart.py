@@ -0,0 +1,183 @@
+"""
+Shopping cart writes and the cached cart summary.
+
+cart_summary() caches the summary of each user in the default cache with
+the versions it was computed against: the active offers version, the
+earliest expiry of the active offers and a version of the product prices.
+Cart writes drop the entry of the user, offer and price changes bump
+their version. These keys only reach every worker when CACHES names a
+cache shared by the processes. With the default LocMemCache the other
+workers keep their copy until it expires, so CART_SUMMARY_TIMEOUT (30
+seconds by default) bounds how stale a summary can be.
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, F, FloatField, Sum
+
+from core import models, pricing
+from core.db.upsert import supports_upsert, upsert
+from offers import active, engine
+from shopping.serializers import CartOperationSerializer
+
+
+def reduce_operations(operations):
+    """
+    Collapse a sequence of cart operations into one final action per product.
+
+    Returns {product_id: (op, count)} where op is add, set or remove and
+    applying the actions in any order gives the same cart as applying the
+    operations one by one.
+    """
+    actions = {}
+    for operation in operations:
+        product, op = operation['product'], operation['op']
+        count = operation.get('count')
+        previous = actions.get(product)
+        if op == CartOperationSerializer.ADD and previous is not None:
+            previous_op, previous_count = previous
+            if previous_op == CartOperationSerializer.REMOVE:
+                actions[product] = (CartOperationSerializer.SET, count)
+            else:
+                actions[product] = (previous_op, previous_count + count)
+        else:
+            actions[product] = (op, count)
+    return actions
+
+
+def apply_operations(user, actions):
+    """Apply reduced cart actions for the user in one transaction"""
+    removes = []
+    rows = {CartOperationSerializer.ADD: [], CartOperationSerializer.SET: []}
+    for product, (op, count) in actions.items():
+        if op == CartOperationSerializer.REMOVE:
+            removes.append(product)
+        else:
+            rows[op].append({'user_id': user.id, 'product_id': product, 'count': count})
+
+    with transaction.atomic():
+        if removes:
+            models.ShoppingCart.objects.filter(user=user, product_id__in=removes).delete()
+        for op, increment in ((CartOperationSerializer.SET, False),
+                              (CartOperationSerializer.ADD, True)):
+            upsert(
+                models.ShoppingCart,
+                rows[op],
+                conflict_fields=('user_id', 'product_id'),
+                update_fields=('count',),
+                increment=increment,
+            )
+
+
+def merge_session_cart(user, session_key):
+    """
+    Move the anonymous cart of the session into the user's cart.
+
+    Counts of products already in the user's cart are summed. Runs one
+    INSERT ... SELECT ... ON CONFLICT and one DELETE in a transaction,
+    whatever the size of the cart.
+    """
+    session_items = models.SessionShoppingCart.objects.filter(aUser=session_key)
+    with transaction.atomic(savepoint=False):
+        if supports_upsert(connection):
+            qn = connection.ops.quote_name
+            cart = qn(models.ShoppingCart._meta.db_table)
+            session_cart = qn(models.SessionShoppingCart._meta.db_table)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'INSERT INTO {cart} ({qn("user_id")}, {qn("product_id")}, {qn("count")}) '
+                    f'SELECT %s, {qn("product_id")}, SUM({qn("count")}) FROM {session_cart} '
+                    f'WHERE {qn("aUser")} = %s GROUP BY {qn("product_id")} '
+                    f'ON CONFLICT ({qn("user_id")}, {qn("product_id")}) '
+                    f'DO UPDATE SET {qn("count")} = {cart}.{qn("count")} + EXCLUDED.{qn("count")}',
+                    [user.id, session_key]
+                )
+                merged = cursor.rowcount
+        else:
+            rows = [
+                {'user_id': user.id, 'product_id': item['product_id'], 'count': item['count']}
+                for item in session_items.values('product_id', 'count')
+            ]
+            upsert(models.ShoppingCart, rows, ('user_id', 'product_id'), ('count',), increment=True)
+            merged = len(rows)
+        session_items.delete()
+    if merged:
+        invalidate_summary(user.id)
+    return merged
+
+
+PRICES_KEY = 'cart-summary:prices-version'
+
+
+def summary_cache_key(user_id):
+    return f'cart-summary:{user_id}'
+
+
+def invalidate_summary(user_id):
+    """Drop the cached summary after a write to the user's cart"""
+    cache.delete(summary_cache_key(user_id))
+
+
+def prices_version():
+    """Version of the product prices in the cache, set one if it was evicted"""
+    version = cache.get(PRICES_KEY)
+    if version is None:
+        cache.add(PRICES_KEY, uuid.uuid4().hex, None)
+        version = cache.get(PRICES_KEY)
+    return version
+
+
+def bump_prices():
+    cache.set(PRICES_KEY, uuid.uuid4().hex, None)
+
+
+def invalidate_prices():
+    """Make every cached summary stale after a product price or category changed"""
+    bump_prices()
+    # Bumped again on commit, a summary computed in between read the old prices.
+    transaction.on_commit(bump_prices)
+
+
+def cart_summary(user):
+    """
+    Return item count, subtotal, best offers discount and delivery of the cart.
+
+    The totals come from one aggregate per category and the discount from
+    the best combination of the active offers, see offers.engine. The
+    result is cached per user until the next cart write, offer change,
+    expiry of an active offer or product price change.
+    """
+    key = summary_cache_key(user.id)
+    offers = active.active_offers.engine()
+    version = (active.current_version(), active.active_offers.expires_at, prices_version())
+    cached = cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    rows = models.ShoppingCart.objects.filter(user=user).values(
+        category=F('product__category_id')).annotate(
+        lines=Count('id'),
+        items=Sum('count'),
+        amount=Sum(F('count') * F('product__price'), output_field=FloatField()),
+    ).order_by()
+    amounts = {row['category']: row['amount'] for row in rows}
+    subtotal = round(sum(amounts.values()), 2)
+    deal = offers.best(amounts, engine.usage(user.id, offers.offers))
+    discount = min(deal.discount, subtotal)
+    delivery = pricing.delivery_charges(subtotal - discount)
+
+    summary = {
+        'lines': sum(row['lines'] for row in rows),
+        'items': sum(row['items'] for row in rows),
+        'subtotal': subtotal,
+        'offer': deal.offers[0] if deal.offers else None,
+        'offers': list(deal.offers),
+        'discount': discount,
+        'delivery_charges': delivery,
+        'delivery_days': pricing.delivery_settings()['DAYS'],
+        'total': round(subtotal - discount + delivery, 2),
+    }
+    cache.set(key, (version, summary), getattr(settings, 'CART_SUMMARY_TIMEOUT', 30))
+    return summary
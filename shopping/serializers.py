@@ -1,4 +1,6 @@
-from rest_framework.serializers import ModelSerializer
+from rest_framework.serializers import (
+    ChoiceField, IntegerField, ModelSerializer, Serializer, ValidationError
+)
 
 from core import models
 from product.serializers import ProductDetailSerializer
@@ -30,4 +32,21 @@ class SessionShoppingSerializer(ModelSerializer):
 class SessionShoppingDetailSerializer(SessionShoppingSerializer):
     """Serializer for detail Session Shopping cart"""
 
-    product = ProductDetailSerializer(read_only = True)
\ No newline at end of file
+    product = ProductDetailSerializer(read_only = True)
+
+class CartOperationSerializer(Serializer):
+    """Serializer for one operation of a batch cart mutation"""
+
+    ADD = 'add'
+    SET = 'set'
+    REMOVE = 'remove'
+
+    op = ChoiceField(choices=(ADD, SET, REMOVE))
+    product = IntegerField(min_value = 1)
+    count = IntegerField(min_value = 1, required = False)
+
+    def validate(self, attrs):
+        """Require a count for add and set operations"""
+        if attrs['op'] != self.REMOVE and 'count' not in attrs:
+            raise ValidationError({'count': 'This field is required.'})
+        return attrs
@@ -0,0 +1,216 @@
+"""
+Storage of anonymous shopping carts.
+
+SESSION_CART['BACKEND'] selects where SessionShoppingView keeps the cart of
+an anonymous visitor:
+
+- `db` stores SessionShoppingCart rows keyed by the session key.
+- `cache` keeps a {product id: count} dict in the cache for TIMEOUT seconds,
+  found through a random cart id in a signed cookie.
+- `cookie` keeps the dict itself in a signed, zlib compressed cookie.
+
+The cache and cookie backends write nothing to the database while the cart
+is browsed. A cart that grows past MAX_ITEMS products is moved to
+SessionShoppingCart rows and stays there for the rest of the session.
+"""
+import abc
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+
+from core import models
+from core.db.upsert import upsert
+from shopping.cart import invalidate_summary, merge_session_cart
+
+DEFAULTS = {
+    'BACKEND': 'db',
+    'MAX_ITEMS': 20,
+    'TIMEOUT': 14 * 24 * 60 * 60,
+    'CACHE_ALIAS': 'default',
+    'COOKIE_NAME': 'cart',
+    'COOKIE_SALT': 'shopping.storage',
+}
+
+
+def session_cart_settings():
+    """Return the SESSION_CART settings merged over the defaults"""
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'SESSION_CART', {}))
+    return options
+
+
+def session_key(request, create=False):
+    """Return the session key of the request, saving a new session if asked"""
+    if create and not request.session.session_key:
+        request.session.save()
+    return request.session.session_key
+
+
+class DatabaseCartStorage:
+    """Cart kept in SessionShoppingCart rows"""
+
+    def __init__(self, request, options):
+        self.request = request
+        self.options = options
+
+    @property
+    def in_database(self):
+        return True
+
+    def merge(self, user):
+        """Move the cart into the user's cart"""
+        key = session_key(self.request)
+        return merge_session_cart(user, key) if key else 0
+
+    def finalize(self, response):
+        pass
+
+
+class SignedCartStorage(abc.ABC):
+    """
+    Base of the backends keeping the cart outside the database.
+
+    The stored state is {'items': {product id: count}} while the cart is
+    small and {'db': True} once it was moved to SessionShoppingCart rows.
+    """
+
+    def __init__(self, request, options):
+        self.request = request
+        self.options = options
+        self.modified = False
+        self._state = None
+
+    @property
+    def state(self):
+        if self._state is None:
+            self._state = self.read() or {}
+        return self._state
+
+    @property
+    def in_database(self):
+        return self.state.get('db', False)
+
+    def items(self):
+        """Return the {product id: count} dict of the cart in adding order"""
+        return {int(product): count for product, count in self.state.get('items', {}).items()}
+
+    def save(self, items):
+        """Store the items, moving the cart to the database past MAX_ITEMS"""
+        if len(items) > self.options['MAX_ITEMS']:
+            rows = [
+                {'aUser': session_key(self.request, create=True),
+                 'product_id': product, 'count': count}
+                for product, count in items.items()
+            ]
+            upsert(models.SessionShoppingCart, rows, ('aUser', 'product_id'), ('count',))
+            self._state = {'db': True}
+        else:
+            self._state = {'items': items}
+        self.modified = True
+
+    def instance(self, product, count):
+        """Return an unsaved cart row for the serializers, its id is the product id"""
+        return models.SessionShoppingCart(id=product, product_id=product, count=count)
+
+    def merge(self, user):
+        """Move the cart into the user's cart"""
+        if self.in_database:
+            merged = DatabaseCartStorage(self.request, self.options).merge(user)
+        else:
+            rows = [
+                {'user_id': user.id, 'product_id': product, 'count': count}
+                for product, count in self.items().items()
+            ]
+            upsert(models.ShoppingCart, rows, ('user_id', 'product_id'), ('count',), increment=True)
+            merged = len(rows)
+            if merged:
+                invalidate_summary(user.id)
+        self._state = {}
+        self.modified = True
+        return merged
+
+    def finalize(self, response):
+        """Write the cart to the response if it changed"""
+        if self.modified:
+            self.write(response)
+
+    @abc.abstractmethod
+    def read(self):
+        """Return the stored state of the request, None if there is none"""
+
+    @abc.abstractmethod
+    def write(self, response):
+        """Store the state, or clear it when empty, through the response"""
+
+
+class CookieCartStorage(SignedCartStorage):
+    """Cart kept in a signed, compressed cookie"""
+
+    def read(self):
+        value = self.request.COOKIES.get(self.options['COOKIE_NAME'])
+        if not value:
+            return None
+        try:
+            return signing.loads(value, salt=self.options['COOKIE_SALT'],
+                                 max_age=self.options['TIMEOUT'])
+        except signing.BadSignature:
+            return None
+
+    def write(self, response):
+        if not self.state:
+            response.delete_cookie(self.options['COOKIE_NAME'])
+            return
+        response.set_cookie(
+            self.options['COOKIE_NAME'],
+            signing.dumps(self.state, salt=self.options['COOKIE_SALT'], compress=True),
+            max_age=self.options['TIMEOUT'], httponly=True, samesite='Lax',
+        )
+
+
+class CacheCartStorage(SignedCartStorage):
+    """Cart kept in the cache under a random id held in a signed cookie"""
+
+    def __init__(self, request, options):
+        super().__init__(request, options)
+        self.cache = caches[options['CACHE_ALIAS']]
+        self.cart_id = request.get_signed_cookie(
+            options['COOKIE_NAME'], default=None,
+            salt=options['COOKIE_SALT'], max_age=options['TIMEOUT'],
+        )
+
+    def cache_key(self):
+        return f'session-cart:{self.cart_id}'
+
+    def read(self):
+        if self.cart_id is None:
+            return None
+        return self.cache.get(self.cache_key())
+
+    def write(self, response):
+        if not self.state:
+            if self.cart_id is not None:
+                self.cache.delete(self.cache_key())
+            response.delete_cookie(self.options['COOKIE_NAME'])
+            return
+        if self.cart_id is None:
+            self.cart_id = uuid.uuid4().hex
+        self.cache.set(self.cache_key(), self.state, self.options['TIMEOUT'])
+        response.set_signed_cookie(
+            self.options['COOKIE_NAME'], self.cart_id, salt=self.options['COOKIE_SALT'],
+            max_age=self.options['TIMEOUT'], httponly=True, samesite='Lax',
+        )
+
+
+BACKENDS = {
+    'db': DatabaseCartStorage,
+    'cache': CacheCartStorage,
+    'cookie': CookieCartStorage,
+}
+
+
+def get_storage(request):
+    """Return the cart storage of the configured backend for the request"""
+    options = session_cart_settings()
+    return BACKENDS[options['BACKEND']](request, options)
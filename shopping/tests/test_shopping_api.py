@@ -1,16 +1,23 @@
-from django.test import TestCase
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse
+from django.utils import timezone
 
 from rest_framework.test import APIClient
 from rest_framework import status
 
 from core import models
-from shopping import serializers
+from offers import active
+from shopping import cart, serializers
 from shopping.serializers import SessionShoppingSerializer, ShoppingDetailSerializer, ShoppingSerializer
 
 SHOPPING_URL = reverse('shopping:shopping-list')
 SESSION_SHOPPING_URL = reverse('shopping:aUser-list')
+BULK_URL = reverse('shopping:shopping-bulk')
+SUMMARY_URL = reverse('shopping:shopping-summary')
 
 def detail_url(shopping_id):
     """Returns the detailed url for shopping cart"""
@@ -140,6 +147,20 @@ class TestPublicShoppingAPI(TestCase):
         serializer = serializers.SessionShoppingSerializer(item)
         self.assertEqual(res.data, serializer.data)
 
+    def test_create_session_cart_item_twice_sums_count(self):
+        """Test adding the same product twice keeps one session cart row"""
+        payload = {
+            'product': self.product.id,
+            'count': 2
+        }
+        self.client.post(SESSION_SHOPPING_URL, payload)
+        res = self.client.post(SESSION_SHOPPING_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data['count'], 4)
+        items = models.SessionShoppingCart.objects.filter(product = self.product)
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0].count, 4)
+
     def test_partial_update_session_shopping_cart(self):
         """Test partial update session shopping cart for count"""
         item = sample_shopping_session_item(self.session_key, self.product)
@@ -151,6 +172,17 @@ class TestPublicShoppingAPI(TestCase):
         item.refresh_from_db()
         self.assertEqual(payload['count'], item.count)
         
+    def test_update_session_item_onto_product_in_cart(self):
+        """Test that moving a session row onto a product already in the cart merges the rows"""
+        item = sample_shopping_session_item(self.session_key, self.product, count = 2)
+        product2 = sample_product(self.user, self.category, title = 'Product2')
+        item2 = sample_shopping_session_item(self.session_key, product2, count = 3)
+        res = self.client.patch(detail_url_session(shopping_id = item2.id), {'product': self.product.id})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual((res.data['id'], res.data['count']), (item.id, 5))
+        self.assertEqual(
+            list(models.SessionShoppingCart.objects.values_list('product', 'count')), [(self.product.id, 5)])
+
     def test_deleting_session_shopping_cart(self):
         """Test deleting session shopping cart"""
         sample_shopping_session_item(self.session_key, self.product)
@@ -162,6 +194,104 @@ class TestPublicShoppingAPI(TestCase):
         self.assertEqual(len(items), 0)
 
 
+
+class TestSessionCartCookieStorageApi(TestCase):
+    """Test the session cart kept in a signed cookie"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = sample_user()
+        self.category = sample_category(self.user)
+        self.product = sample_product(self.user, self.category)
+
+    @override_settings(SESSION_CART={'BACKEND': 'cookie', 'MAX_ITEMS': 2})
+    def test_cart_kept_in_cookie(self):
+        """Test adding, updating and deleting items without database rows"""
+        product2 = sample_product(self.user, self.category, title = 'Product 2')
+        self.client.post(SESSION_SHOPPING_URL, {'product': self.product.id, 'count': 2})
+        res = self.client.post(SESSION_SHOPPING_URL, {'product': self.product.id, 'count': 1})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data, {'id': self.product.id, 'product': self.product.id, 'count': 3})
+        self.client.post(SESSION_SHOPPING_URL, {'product': product2.id, 'count': 1})
+
+        self.client.patch(detail_url_session(product2.id), {'count': 4})
+        res = self.client.get(detail_url_session(product2.id))
+        self.assertEqual(res.data['count'], 4)
+        self.assertEqual(res.data['product']['title'], 'Product 2')
+
+        self.client.delete(detail_url_session(self.product.id))
+        res = self.client.get(SESSION_SHOPPING_URL)
+        self.assertEqual(res.data, [{'id': product2.id, 'product': product2.id, 'count': 4}])
+        self.assertFalse(models.SessionShoppingCart.objects.exists())
+
+    @override_settings(SESSION_CART={'BACKEND': 'cookie', 'MAX_ITEMS': 2})
+    def test_update_onto_product_in_cart_merges_counts(self):
+        """Test that moving an item onto a product already in the cart adds up the counts"""
+        product2 = sample_product(self.user, self.category, title = 'Product 2')
+        self.client.post(SESSION_SHOPPING_URL, {'product': self.product.id, 'count': 2})
+        self.client.post(SESSION_SHOPPING_URL, {'product': product2.id, 'count': 3})
+        res = self.client.patch(detail_url_session(product2.id), {'product': self.product.id})
+        self.assertEqual(res.data['count'], 5)
+        res = self.client.get(SESSION_SHOPPING_URL)
+        self.assertEqual(res.data, [{'id': self.product.id, 'product': self.product.id, 'count': 5}])
+
+    @override_settings(SESSION_CART={'BACKEND': 'cookie', 'MAX_ITEMS': 2})
+    def test_tampered_cookie_is_ignored(self):
+        """Test that a cart cookie with a bad signature reads as empty"""
+        self.client.cookies['cart'] = 'forged:value'
+        res = self.client.get(SESSION_SHOPPING_URL)
+        self.assertEqual(res.data, [])
+
+    @override_settings(SESSION_CART={'BACKEND': 'cookie', 'MAX_ITEMS': 2})
+    def test_cart_moves_to_database_past_limit(self):
+        """Test that a cart growing past MAX_ITEMS is stored as rows"""
+        products = [
+            sample_product(self.user, self.category, title = f'Product {index}')
+            for index in range(3)
+        ]
+        for product in products:
+            self.client.post(SESSION_SHOPPING_URL, {'product': product.id, 'count': 1})
+        rows = models.SessionShoppingCart.objects.filter(aUser = self.client.session.session_key)
+        self.assertEqual(rows.count(), 3)
+
+        res = self.client.post(SESSION_SHOPPING_URL, {'product': products[0].id, 'count': 2})
+        self.assertEqual(res.data['count'], 3)
+        res = self.client.get(SESSION_SHOPPING_URL)
+        self.assertEqual(res.data, SessionShoppingSerializer(rows.order_by('id'), many = True).data)
+
+
+@override_settings(SESSION_CART={'BACKEND': 'cache', 'MAX_ITEMS': 5})
+class TestSessionCartCacheStorageApi(TestCase):
+    """Test the session cart kept in the cache"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = sample_user()
+        self.category = sample_category(self.user)
+        self.product = sample_product(self.user, self.category)
+
+    def test_cart_kept_in_cache(self):
+        """Test that adding items writes no rows and reads back from the cache"""
+        self.client.post(SESSION_SHOPPING_URL, {'product': self.product.id, 'count': 2})
+        self.client.post(SESSION_SHOPPING_URL, {'product': self.product.id, 'count': 2})
+        with self.assertNumQueries(0):
+            res = self.client.get(SESSION_SHOPPING_URL)
+        self.assertEqual(res.data, [{'id': self.product.id, 'product': self.product.id, 'count': 4}])
+        self.assertFalse(models.SessionShoppingCart.objects.exists())
+
+    def test_cart_expires_with_cache(self):
+        """Test that a cart evicted from the cache reads as empty"""
+        self.client.post(SESSION_SHOPPING_URL, {'product': self.product.id, 'count': 2})
+        cache.clear()
+        res = self.client.get(SESSION_SHOPPING_URL)
+        self.assertEqual(res.data, [])
+
+    def test_missing_item(self):
+        """Test retrieving a product that is not in the cart"""
+        res = self.client.get(detail_url_session(self.product.id))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
 class TestPrivateShoppingCartApi(TestCase):
     """Test the public API of Shopping Cart"""
 
@@ -221,6 +351,21 @@ class TestPrivateShoppingCartApi(TestCase):
         serializer = ShoppingSerializer(cart_item)
         self.assertEqual(res.data, serializer.data)
 
+    def test_create_shopping_cart_twice_sums_count(self):
+        """Test adding the same product twice keeps one cart row"""
+        payload = {
+            'product': self.product.id,
+            'count': 3
+        }
+        first = self.client.post(SHOPPING_URL, payload)
+        res = self.client.post(SHOPPING_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data['id'], first.data['id'])
+        self.assertEqual(res.data['count'], 6)
+        items = models.ShoppingCart.objects.filter(user = self.user)
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0].count, 6)
+
     def test_partial_update_shopping_cart(self):
         """Test the partial update to shopping cart (count)"""
         cartItem = sample_shopping_item(self.user, self.product, count = 1)
@@ -232,6 +377,17 @@ class TestPrivateShoppingCartApi(TestCase):
         cartItem.refresh_from_db()
         self.assertEqual(payload['count'], cartItem.count)
 
+    def test_update_item_onto_product_in_cart_merges_counts(self):
+        """Test that moving a cart item onto a product already in the cart merges the rows"""
+        item = sample_shopping_item(self.user, self.product, count = 2)
+        product2 = sample_product(self.user, self.category, title = 'Product2')
+        item2 = sample_shopping_item(self.user, product2, count = 3)
+        res = self.client.patch(detail_url(shopping_id = item2.id), {'product': self.product.id})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual((res.data['id'], res.data['count']), (item.id, 5))
+        self.assertEqual(
+            list(models.ShoppingCart.objects.values_list('product', 'count')), [(self.product.id, 5)])
+
     def test_delete_shopping_cart(self):
         """Test deleting cart Item"""
         sample_shopping_item(self.user, self.product)
@@ -243,4 +399,154 @@ class TestPrivateShoppingCartApi(TestCase):
         items = models.ShoppingCart.objects.filter(id = cartItem2.id)
         self.assertEqual(len(items), 0)
 
-    
\ No newline at end of file
+    def test_bulk_operations(self):
+        """Test applying add, set and remove operations in one request"""
+        product2 = sample_product(self.user, self.category, title = 'Mango')
+        product3 = sample_product(self.user, self.category, title = 'Apple')
+        sample_shopping_item(self.user, self.product, count = 1)
+        sample_shopping_item(self.user, product3, count = 1)
+        payload = [
+            {'op': 'add', 'product': self.product.id, 'count': 2},
+            {'op': 'set', 'product': product2.id, 'count': 5},
+            {'op': 'add', 'product': product2.id, 'count': 1},
+            {'op': 'remove', 'product': product3.id},
+        ]
+        res = self.client.post(BULK_URL, payload, format = 'json')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        cart_items = models.ShoppingCart.objects.filter(user = self.user).order_by('id')
+        self.assertEqual(res.data, ShoppingSerializer(cart_items, many = True).data)
+        counts = {item.product_id: item.count for item in cart_items}
+        self.assertEqual(counts, {self.product.id: 3, product2.id: 6})
+
+    def test_bulk_remove_then_add(self):
+        """Test that an add after a remove sets the count"""
+        sample_shopping_item(self.user, self.product, count = 4)
+        payload = [
+            {'op': 'remove', 'product': self.product.id},
+            {'op': 'add', 'product': self.product.id, 'count': 2},
+        ]
+        self.client.post(BULK_URL, payload, format = 'json')
+        item = models.ShoppingCart.objects.get(user = self.user)
+        self.assertEqual(item.count, 2)
+
+    def test_bulk_invalid_product(self):
+        """Test that an unknown product rejects the whole batch"""
+        payload = [
+            {'op': 'add', 'product': self.product.id, 'count': 2},
+            {'op': 'add', 'product': 9999, 'count': 1},
+        ]
+        res = self.client.post(BULK_URL, payload, format = 'json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(models.ShoppingCart.objects.exists())
+
+    def test_bulk_requires_count(self):
+        """Test that add and set operations need a count"""
+        payload = [{'op': 'set', 'product': self.product.id}]
+        res = self.client.post(BULK_URL, payload, format = 'json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_query_count_is_constant(self):
+        """Test that a large batch runs a fixed number of queries"""
+        products = [
+            sample_product(self.user, self.category, title = f'Product {index}')
+            for index in range(40)
+        ]
+        payload = [{'op': 'add', 'product': product.id, 'count': 1} for product in products]
+        # Product validation, savepoint, upsert, savepoint release, cart listing.
+        with self.assertNumQueries(5):
+            res = self.client.post(BULK_URL, payload, format = 'json')
+        self.assertEqual(len(res.data), 40)
+
+
+@override_settings(DELIVERY={'CHARGE': 40.0, 'FREE_ABOVE': 500.0, 'DAYS': 2})
+class TestShoppingCartSummaryApi(TestCase):
+    """Test the cart summary of a logged in user"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = sample_user(is_staff=False)
+        self.category = sample_category(self.user)
+        self.client.force_authenticate(self.user)
+
+    def test_summary_of_cart(self):
+        """Test totals, best active offer and delivery of the cart"""
+        sample_shopping_item(self.user, sample_product(self.user, self.category, price = 20.0), count = 3)
+        sample_shopping_item(self.user, sample_product(self.user, self.category, price = 15.5), count = 2)
+        models.Offer.objects.create(
+            user = self.user, title = 'Expired', percentage = 50, desc = 'desc',
+            expiry_date = timezone.now() - timedelta(days = 1))
+        offer = models.Offer.objects.create(
+            user = self.user, title = 'Active', percentage = 10, desc = 'desc',
+            expiry_date = timezone.now() + timedelta(days = 1))
+
+        res = self.client.get(SUMMARY_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {
+            'lines': 2,
+            'items': 5,
+            'subtotal': 91.0,
+            'offer': offer.id,
+            'offers': [offer.id],
+            'discount': 9.1,
+            'delivery_charges': 40.0,
+            'delivery_days': 2,
+            'total': 121.9,
+        })
+
+    def test_summary_of_empty_cart(self):
+        """Test the summary of an empty cart"""
+        res = self.client.get(SUMMARY_URL)
+        self.assertEqual(res.data['items'], 0)
+        self.assertEqual(res.data['total'], 0.0)
+
+    def test_summary_is_cached_until_cart_write(self):
+        """Test that the summary is served from cache and invalidated by writes"""
+        product = sample_product(self.user, self.category, price = 10.0)
+        self.client.post(SHOPPING_URL, {'product': product.id, 'count': 1})
+        self.client.get(SUMMARY_URL)
+        with self.assertNumQueries(0):
+            res = self.client.get(SUMMARY_URL)
+        self.assertEqual(res.data['items'], 1)
+
+        self.client.post(SHOPPING_URL, {'product': product.id, 'count': 2})
+        res = self.client.get(SUMMARY_URL)
+        self.assertEqual(res.data['items'], 3)
+        self.assertEqual(res.data['subtotal'], 30.0)
+
+    def test_summary_expires_after_timeout(self):
+        """Test that cached summaries expire, bounding staleness on workers that missed a write"""
+        sample_shopping_item(self.user, sample_product(self.user, self.category, price = 10.0), count = 1)
+        self.client.get(SUMMARY_URL)
+        key = cart.summary_cache_key(self.user.id)
+        self.assertIsNotNone(cache.get(key))
+        with self.settings(CART_SUMMARY_TIMEOUT = 0):
+            cache.delete(key)
+            self.client.get(SUMMARY_URL)
+            self.assertIsNone(cache.get(key))
+
+    def test_summary_is_recomputed_when_an_offer_expires(self):
+        """Test that a cached summary does not outlive the offers it applied"""
+        sample_shopping_item(self.user, sample_product(self.user, self.category, price = 100.0), count = 1)
+        offer = models.Offer.objects.create(
+            user = self.user, title = 'Soon', percentage = 10, desc = 'desc',
+            expiry_date = timezone.now() + timedelta(hours = 1))
+        self.assertEqual(self.client.get(SUMMARY_URL).data['offers'], [offer.id])
+
+        # The offer expires, which sends no signal.
+        models.Offer.objects.filter(id = offer.id).update(expiry_date = timezone.now())
+        active.active_offers.expires_at = timezone.now()
+        res = self.client.get(SUMMARY_URL)
+        self.assertEqual((res.data['offers'], res.data['discount']), ([], 0.0))
+
+    def test_summary_is_recomputed_after_price_change(self):
+        """Test that updating a product price makes the cached summaries stale"""
+        product = sample_product(self.user, self.category, price = 10.0)
+        sample_shopping_item(self.user, product, count = 2)
+        self.assertEqual(self.client.get(SUMMARY_URL).data['subtotal'], 20.0)
+
+        staff = APIClient()
+        staff.force_authenticate(sample_user(email = 'staff@example.com'))
+        res = staff.patch(reverse('product:product-detail', args = [product.id]), {'price': 12.5})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(SUMMARY_URL).data['subtotal'], 25.0)
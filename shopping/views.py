@@ -1,9 +1,14 @@
-from rest_framework import viewsets
-from rest_framework.authentication import TokenAuthentication
+from django.db import transaction
+from django.http import Http404
+from rest_framework import status, viewsets
 from rest_framework import permissions
+from rest_framework.decorators import action
+from rest_framework.response import Response
 from core import models
+from core.authentication import TokenAuthentication
+from core.idempotency import idempotent
 
-from shopping import serializers
+from shopping import cart, serializers, storage
 
 class ShoppingView(viewsets.ModelViewSet):
     """Viewset for Shopping object"""
@@ -12,8 +17,37 @@ class ShoppingView(viewsets.ModelViewSet):
     permission_classes = (permissions.IsAuthenticated,)
     queryset = models.ShoppingCart.objects.all().order_by('id')
 
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
     def perform_create(self, serializer):
-        return serializer.save(user = self.request.user)
+        """Add the product to the cart, summing the counts of repeated adds"""
+        serializer.instance = models.ShoppingCart.objects.add_item(
+            self.request.user,
+            serializer.validated_data['product'],
+            serializer.validated_data['count']
+        )
+        cart.invalidate_summary(self.request.user.id)
+        return serializer.instance
+
+    def perform_update(self, serializer):
+        """Save the item, merging it into the row of its new product if the cart has one"""
+        item = serializer.instance
+        product = serializer.validated_data.get('product', item.product)
+        if product.id == item.product_id or not self.get_queryset().filter(product = product).exists():
+            serializer.save()
+        else:
+            with transaction.atomic():
+                item.delete()
+                serializer.instance = models.ShoppingCart.objects.add_item(
+                    self.request.user, product, serializer.validated_data.get('count', item.count))
+        cart.invalidate_summary(self.request.user.id)
+        return serializer.instance
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        cart.invalidate_summary(self.request.user.id)
 
     def get_queryset(self):
         return self.queryset.filter(user = self.request.user)
@@ -21,18 +55,153 @@ class ShoppingView(viewsets.ModelViewSet):
     def get_serializer_class(self):
         if self.action == 'retrieve':
             return serializers.ShoppingDetailSerializer
+        if self.action == 'bulk':
+            return serializers.CartOperationSerializer
         return self.serializer_class
 
+    @action(methods = ['POST'], detail = False)
+    def bulk(self, request):
+        """Apply a list of add, set and remove operations in one transaction"""
+        serializer = self.get_serializer(data = request.data, many = True)
+        serializer.is_valid(raise_exception = True)
+
+        product_ids = {operation['product'] for operation in serializer.validated_data}
+        found = set(models.Product.objects.filter(
+            id__in = product_ids).values_list('id', flat = True))
+        missing = sorted(product_ids - found)
+        if missing:
+            return Response(
+                {'product': [f'Invalid pk "{pk}" - object does not exist.' for pk in missing]},
+                status = status.HTTP_400_BAD_REQUEST
+            )
+
+        cart.apply_operations(
+            request.user, cart.reduce_operations(serializer.validated_data))
+        cart.invalidate_summary(request.user.id)
+        items = serializers.ShoppingSerializer(self.get_queryset(), many = True)
+        return Response(items.data, status = status.HTTP_200_OK)
+
+    @action(methods = ['GET'], detail = False)
+    def summary(self, request):
+        """Item count, totals, offer discount and delivery of the cart"""
+        return Response(cart.cart_summary(request.user))
+
 
 class SessionShoppingView(viewsets.ModelViewSet):
-    """Viewset for Session Shopping object"""
+    """
+    Viewset for Session Shopping object
+
+    Carts are kept by the backend of shopping.storage. Outside the database
+    the id of a cart item is its product id.
+    """
     serializer_class = serializers.SessionShoppingSerializer
     queryset = models.SessionShoppingCart.objects.all().order_by('id')
 
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.storage = storage.get_storage(request)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        cart_storage = getattr(self, 'storage', None)
+        if cart_storage is not None:
+            cart_storage.finalize(response)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        if self.storage.in_database:
+            return super().list(request, *args, **kwargs)
+        items = [
+            self.storage.instance(product, count)
+            for product, count in self.storage.items().items()
+        ]
+        return Response(self.get_serializer(items, many = True).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        if self.storage.in_database:
+            return super().retrieve(request, *args, **kwargs)
+        return Response(self.get_serializer(self.get_stored_item()).data)
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        if self.storage.in_database:
+            return super().create(request, *args, **kwargs)
+        serializer = self.get_serializer(data = request.data)
+        serializer.is_valid(raise_exception = True)
+        product = serializer.validated_data['product'].id
+        items = self.storage.items()
+        items[product] = items.get(product, 0) + serializer.validated_data['count']
+        self.storage.save(items)
+        return Response(
+            self.get_serializer(self.stored_instance(product, items[product])).data,
+            status = status.HTTP_201_CREATED
+        )
+
+    def update(self, request, *args, **kwargs):
+        if self.storage.in_database:
+            return super().update(request, *args, **kwargs)
+        item = self.get_stored_item()
+        serializer = self.get_serializer(
+            item, data = request.data, partial = kwargs.pop('partial', False))
+        serializer.is_valid(raise_exception = True)
+        product = serializer.validated_data.get('product')
+        product = product.id if product else item.product_id
+        count = serializer.validated_data.get('count', item.count)
+        items = self.storage.items()
+        del items[item.product_id]
+        if product != item.product_id:
+            # Moved onto a product already in the cart, the counts add up.
+            count += items.get(product, 0)
+        items[product] = count
+        self.storage.save(items)
+        return Response(self.get_serializer(self.stored_instance(product, count)).data)
+
+    def destroy(self, request, *args, **kwargs):
+        if self.storage.in_database:
+            return super().destroy(request, *args, **kwargs)
+        item = self.get_stored_item()
+        items = self.storage.items()
+        del items[item.product_id]
+        self.storage.save(items)
+        return Response(status = status.HTTP_204_NO_CONTENT)
+
+    def get_stored_item(self):
+        """Return the item of the url from a cart kept outside the database"""
+        try:
+            product = int(self.kwargs[self.lookup_field])
+        except ValueError:
+            raise Http404
+        items = self.storage.items()
+        if product not in items:
+            raise Http404
+        return self.storage.instance(product, items[product])
+
+    def stored_instance(self, product, count):
+        """Return the saved item, a database row if the cart moved there"""
+        if self.storage.in_database:
+            return self.get_queryset().get(product_id = product)
+        return self.storage.instance(product, count)
+
     def perform_create(self, serializer):
-        session_key = self.request.session.session_key
-        return serializer.save(aUser = session_key)
-    
+        """Add the product to the session cart, summing repeated adds"""
+        serializer.instance = models.SessionShoppingCart.objects.add_item(
+            storage.session_key(self.request, create = True),
+            serializer.validated_data['product'],
+            serializer.validated_data['count']
+        )
+        return serializer.instance
+
+    def perform_update(self, serializer):
+        """Save the item, merging it into the row of its new product if the cart has one"""
+        item = serializer.instance
+        product = serializer.validated_data.get('product', item.product)
+        if product.id == item.product_id or not self.get_queryset().filter(product = product).exists():
+            return serializer.save()
+        with transaction.atomic():
+            item.delete()
+            serializer.instance = models.SessionShoppingCart.objects.add_item(
+                item.aUser, product, serializer.validated_data.get('count', item.count))
+        return serializer.instance
+
     def get_queryset(self):
         session_key = self.request.session.session_key
         return self.queryset.filter(aUser = session_key)
@@ -40,4 +209,4 @@ class SessionShoppingView(viewsets.ModelViewSet):
     def get_serializer_class(self):
         if self.action == 'retrieve':
             return serializers.SessionShoppingDetailSerializer
-        return self.serializer_class
\ No newline at end of file
+        return self.serializer_class
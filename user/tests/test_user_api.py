@@ -1,13 +1,19 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
+from core import models
+from shopping.tests.test_shopping_api import (
+    sample_category, sample_product, sample_shopping_item, sample_shopping_session_item
+)
+
 CREATE_USER_URL = reverse('user:create')
 TOKEN_URL = reverse('user:token')
 ME_URL = reverse('user:me')
+SESSION_CART_URL = reverse('shopping:aUser-list')
 
 def create_user(**params):
     """Create a sample user with params provided"""
@@ -78,6 +84,7 @@ class PublicUserApiTests(TestCase):
         
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertIn('token', res.data)
+        self.assertTrue(models.TokenUsage.objects.filter(token_id = res.data['token']).exists())
 
     def test_creating_token_invalid_credentials(self):
         """Test creating token for invalid user credentials"""
@@ -118,6 +125,64 @@ class PublicUserApiTests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertNotIn('token', res.data)
 
+    def test_token_merges_session_cart(self):
+        """Test that logging in moves the session cart into the user cart"""
+        payload = {
+            'email': 'test_user@gmail.com',
+            'password': 'testpassword'
+        }
+        user = create_user(**payload)
+        category = sample_category(user)
+        bread = sample_product(user, category)
+        mango = sample_product(user, category, title = 'Mango')
+        session_key = self.client.session.session_key
+        sample_shopping_session_item(session_key, bread, count = 2)
+        sample_shopping_session_item(session_key, mango, count = 1)
+        sample_shopping_session_item('other session', mango, count = 7)
+        sample_shopping_item(user, bread, count = 3)
+
+        res = self.client.post(TOKEN_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        counts = dict(models.ShoppingCart.objects.filter(
+            user = user).values_list('product_id', 'count'))
+        self.assertEqual(counts, {bread.id: 5, mango.id: 1})
+        self.assertFalse(models.SessionShoppingCart.objects.filter(aUser = session_key).exists())
+        self.assertTrue(models.SessionShoppingCart.objects.filter(aUser = 'other session').exists())
+
+    def test_token_merge_query_count_is_constant(self):
+        """Test that merging a large session cart runs the same queries as a small one"""
+        payload = {
+            'email': 'test_user@gmail.com',
+            'password': 'testpassword'
+        }
+        user = create_user(**payload)
+        category = sample_category(user)
+        session_key = self.client.session.session_key
+        for index in range(30):
+            sample_shopping_session_item(
+                session_key, sample_product(user, category, title = f'Product {index}'))
+
+        with self.assertNumQueries(12):
+            self.client.post(TOKEN_URL, payload)
+        self.assertEqual(models.ShoppingCart.objects.filter(user = user).count(), 30)
+
+    @override_settings(SESSION_CART = {'BACKEND': 'cookie'})
+    def test_token_merges_cookie_cart(self):
+        """Test that logging in moves a cookie cart into the user cart"""
+        payload = {
+            'email': 'test_user@gmail.com',
+            'password': 'testpassword'
+        }
+        user = create_user(**payload)
+        bread = sample_product(user, sample_category(user))
+        sample_shopping_item(user, bread, count = 3)
+        self.client.post(SESSION_CART_URL, {'product': bread.id, 'count': 2})
+
+        res = self.client.post(TOKEN_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(models.ShoppingCart.objects.get(user = user).count, 5)
+        self.assertEqual(res.cookies['cart'].value, '')
+
     def test_unauthenticated_user(self):
         """Test that authentication is required"""
         res = self.client.post(ME_URL)
@@ -1,9 +1,15 @@
 from core.models import UserAddress, UserDetails
-from rest_framework import generics, mixins, permissions, authentication
+from core.authentication import TokenAuthentication, touch
+from django.contrib.auth.models import update_last_login
+from django.db import transaction
+from rest_framework import generics, mixins, permissions
+from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.response import Response
 from rest_framework.settings import api_settings
 from rest_framework import viewsets
 
+from shopping import storage
 from user import serializers
 
 
@@ -19,12 +25,30 @@ class UserTokenView(ObtainAuthToken):
     serializer_class = serializers.UserTokenSerializer
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
 
+    def post(self, request, *args, **kwargs):
+        """Return the token and move the anonymous session cart to the user"""
+        serializer = self.serializer_class(
+            data = request.data,
+            context = {'request': request}
+        )
+        serializer.is_valid(raise_exception = True)
+        user = serializer.validated_data['user']
+        cart_storage = storage.get_storage(request)
+        with transaction.atomic():
+            token, created = Token.objects.get_or_create(user = user)
+            update_last_login(None, user)
+            touch(token)
+            cart_storage.merge(user)
+        response = Response({'token': token.key})
+        cart_storage.finalize(response)
+        return response
+
 
 class RetrieveUpdateUserView(generics.RetrieveUpdateAPIView):
     """View for retrieve and update the user for authentiated user"""
 
     serializer_class = serializers.UserSerializer
-    authentication_classes = [authentication.TokenAuthentication,]
+    authentication_classes = [TokenAuthentication,]
     permission_classes = [permissions.IsAuthenticated,]
 
     def get_object(self):
@@ -37,7 +61,7 @@ class UserAddressView(viewsets.ModelViewSet):
     """Viewset for UserAddress object"""
 
     serializer_class = serializers.UserAddressSerializer
-    authentication_classes = [authentication.TokenAuthentication,]
+    authentication_classes = [TokenAuthentication,]
     permission_classes = [permissions.IsAuthenticated,]
     queryset = UserAddress.objects.all().order_by('-id')
 
@@ -59,7 +83,7 @@ class UserDetailsView(viewsets.GenericViewSet,
     """Viewset for UserDetails viewset"""
     serializer_class = serializers.UserDetailsSerializer
     permission_classes = (permissions.IsAuthenticated,)
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (TokenAuthentication,)
     queryset = UserDetails.objects.all()
 
     def get_queryset(self):